@@ -0,0 +1,304 @@
+"""
+analytics.py
+
+This module answers occupancy questions over the whole hotel store, such
+as the occupancy rate of each hotel and of each location, and the
+distribution of free rooms, without looping over the hotel records.
+
+The hotels are kept as NumPy columns: hotel_id, a location code,
+total_rooms and the number of rooms held on the busiest night. The columns
+are a secondary index of the hotel repository (see indexes.py): they are
+built once, the first time they are queried, and then updated one row at
+a time as hotels change, so each query is a handful of vectorized
+operations over the columns. Grouping by location uses np.bincount over
+the location codes.
+
+Rooms held by stays count on their busiest night from today on, like
+Hotel.search, so a hotel is full when it has no room free on every night
+from today on. The columns are rebuilt on the first query of each day, as
+stays end. Hotels whose ID is not an integer are left out.
+
+NumPy is an optional dependency: without it, the queries raise ImportError.
+"""
+
+from app.availability import today
+from app.hotel import _hotels
+from app.indexes import Index
+from app.metrics import timed
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - numpy is optional.
+    np = None
+
+# Name of the column index in the hotel repository.
+INDEX_NAME = "occupancy_columns"
+
+# Percentiles of free rooms reported by free_rooms_distribution.
+PERCENTILES = (50, 90, 99)
+
+
+class OccupancyColumns(Index):
+    """
+    The hotels as column arrays, one row per hotel.
+
+    Rows of deleted hotels are marked as dead and reused by the next new
+    hotel. The arrays double in size when they are full.
+    """
+
+    def __init__(self):
+        """
+        Initialize an empty OccupancyColumns instance.
+        """
+        # Maps each hotel ID to its row.
+        self._rows = {}
+        self._dead_rows = []
+        self._size = 0
+        # The day the held rooms were counted on.
+        self._day = None
+        # Maps each location to its code, and each code to its location.
+        self._codes = {}
+        self.locations = []
+        self._allocate(0)
+
+    def _allocate(self, capacity):
+        """
+        Replace the arrays with empty ones of the given capacity.
+        """
+        self.hotel_ids = np.zeros(capacity, dtype=np.int64)
+        self.location_codes = np.zeros(capacity, dtype=np.int32)
+        self.total_rooms = np.zeros(capacity, dtype=np.int64)
+        self.held_rooms = np.zeros(capacity, dtype=np.int64)
+        self.live = np.zeros(capacity, dtype=bool)
+
+    def _grow(self):
+        """
+        Double the capacity of the arrays, keeping their rows.
+        """
+        old = (self.hotel_ids, self.location_codes, self.total_rooms,
+               self.held_rooms, self.live)
+        self._allocate(max(16, 2 * len(self.live)))
+        new = (self.hotel_ids, self.location_codes, self.total_rooms,
+               self.held_rooms, self.live)
+        for old_column, new_column in zip(old, new):
+            new_column[:len(old_column)] = old_column
+
+    def _code(self, location):
+        """
+        Return the code of a location, assigning one if it is new.
+        """
+        code = self._codes.get(location)
+        if code is None:
+            code = self._codes[location] = len(self.locations)
+            self.locations.append(location)
+        return code
+
+    def _values(self, hotel_id, hotel):
+        """
+        Return the (location code, total rooms, held rooms) of a hotel, or
+        None if it is not indexed.
+        """
+        if hotel is None or not isinstance(hotel_id, int):
+            return None
+        total_rooms = hotel.get("total_rooms")
+        occupancy = hotel.get("reserved_rooms")
+        try:
+            location = self._code(hotel.get("location"))
+        except TypeError:
+            # An unhashable location.
+            location = self._code(None)
+        return (
+            location,
+            total_rooms if isinstance(total_rooms, int) else 0,
+            occupancy.held_rooms() if occupancy is not None else 0,
+        )
+
+    def rebuild(self, records):
+        self._day = today()
+        self._rows = {}
+        self._dead_rows = []
+        self._codes = {}
+        self.locations = []
+        rows = []
+        for hotel_id, hotel in records.items():
+            values = self._values(hotel_id, hotel)
+            if values is not None:
+                self._rows[hotel_id] = len(rows)
+                rows.append((hotel_id,) + values)
+        self._size = len(rows)
+        self._allocate(self._size)
+        if rows:
+            hotel_ids, locations, totals, held = zip(*rows)
+            self.hotel_ids[:] = hotel_ids
+            self.location_codes[:] = locations
+            self.total_rooms[:] = totals
+            self.held_rooms[:] = held
+            self.live[:] = True
+
+    def update(self, record_id, record):
+        values = self._values(record_id, record)
+        row = self._rows.get(record_id)
+        if values is None:
+            if row is not None:
+                self.live[row] = False
+                self._dead_rows.append(row)
+                del self._rows[record_id]
+            return
+        if row is None:
+            if self._dead_rows:
+                row = self._dead_rows.pop()
+            else:
+                if self._size == len(self.live):
+                    self._grow()
+                row = self._size
+                self._size += 1
+            self._rows[record_id] = row
+            self.hotel_ids[row] = record_id
+            self.live[row] = True
+        (self.location_codes[row], self.total_rooms[row],
+         self.held_rooms[row]) = values
+
+    def stale(self):
+        return self._day != today()
+
+    def columns(self, location=None):
+        """
+        Return copies of the columns of the live hotels.
+
+        Args:
+            location (str, optional): Only return the hotels of this
+                location. Defaults to every hotel.
+
+        Returns:
+            tuple: The hotel_ids, location_codes, total_rooms and
+            held_rooms arrays, in the same row order.
+        """
+        live = self.live[:self._size]
+        if location is not None:
+            code = self._codes.get(location)
+            if code is None:
+                live = np.zeros(self._size, dtype=bool)
+            else:
+                live = live & (self.location_codes[:self._size] == code)
+        return (
+            self.hotel_ids[:self._size][live],
+            self.location_codes[:self._size][live],
+            self.total_rooms[:self._size][live],
+            self.held_rooms[:self._size][live],
+        )
+
+
+def _query(query):
+    """
+    Run a query against the columns of the hotel repository, building them
+    first if needed.
+
+    Raises:
+        ImportError: If NumPy is not installed.
+    """
+    if np is None:
+        raise ImportError("NumPy is required for occupancy analytics")
+    hotels = _hotels()
+    hotels.add_index(INDEX_NAME, OccupancyColumns())
+    return hotels.query_index(INDEX_NAME, query)
+
+
+def _rates(held, total):
+    """
+    Return held / total, NaN where a hotel has no rooms.
+    """
+    rates = np.full(len(total), np.nan)
+    np.divide(held, total, out=rates, where=total > 0)
+    return rates
+
+
+@timed("analytics.occupancy_by_hotel")
+def occupancy_by_hotel(location=None):
+    """
+    Return the occupancy rate of every hotel.
+
+    Args:
+        location (str, optional): Only include the hotels of this
+            location. Defaults to every hotel.
+
+    Returns:
+        tuple: Two arrays, the hotel IDs and their occupancy rates, held
+        rooms over total rooms. Rates exceed 1 for hotels over capacity,
+        and are NaN for hotels without rooms.
+    """
+    def query(index):
+        hotel_ids, _, total, held = index.columns(location)
+        return hotel_ids, _rates(held, total)
+
+    return _query(query)
+
+
+@timed("analytics.occupancy_by_location")
+def occupancy_by_location():
+    """
+    Return the occupancy of each location.
+
+    Returns:
+        dict: Maps each location to its hotels, total_rooms,
+        held_rooms and occupancy_rate, held rooms over total rooms, or
+        NaN if its hotels have no rooms.
+    """
+    def query(index):
+        _, codes, total, held = index.columns()
+        size = len(index.locations)
+        hotels = np.bincount(codes, minlength=size)
+        totals = np.bincount(codes, weights=total, minlength=size)
+        helds = np.bincount(codes, weights=held, minlength=size)
+        rates = _rates(helds, totals)
+        return {
+            index.locations[code]: {
+                "hotels": int(hotels[code]),
+                "total_rooms": int(totals[code]),
+                "held_rooms": int(helds[code]),
+                "occupancy_rate": float(rates[code]),
+            }
+            for code in np.flatnonzero(hotels)
+        }
+
+    return _query(query)
+
+
+@timed("analytics.free_rooms_distribution")
+def free_rooms_distribution(location=None, percentiles=PERCENTILES):
+    """
+    Return the distribution of the number of free rooms per hotel.
+
+    Args:
+        location (str, optional): Only include the hotels of this
+            location. Defaults to every hotel.
+        percentiles (iterable, optional): Percentiles to report.
+
+    Returns:
+        dict: hotels, the number of hotels; histogram, an array whose
+        n-th element counts the hotels with n free rooms; mean; and
+        percentiles, mapping each requested percentile to its value.
+        Statistics are NaN when there are no hotels.
+    """
+    percentiles = tuple(percentiles)
+
+    def query(index):
+        _, _, total, held = index.columns(location)
+        free = np.maximum(total - held, 0)
+        if not len(free):
+            return {
+                "hotels": 0,
+                "histogram": np.zeros(1, dtype=np.int64),
+                "mean": float("nan"),
+                "percentiles": {p: float("nan") for p in percentiles},
+            }
+        values = np.percentile(free, percentiles) if percentiles else ()
+        return {
+            "hotels": len(free),
+            "histogram": np.bincount(free),
+            "mean": float(free.mean()),
+            "percentiles": {
+                p: float(value) for p, value in zip(percentiles, values)
+            },
+        }
+
+    return _query(query)
@@ -0,0 +1,209 @@
+"""
+availability.py
+
+This module defines the NightlyInventory class, which counts how many rooms
+of a hotel are booked on each night. It is a sparse segment tree over day
+numbers supporting range increments and range maximums, so checking whether
+a room is free for a stay and booking or releasing a stay take O(log n)
+time, independent of the number of existing reservations.
+
+Nights are identified by date; a stay from check_in to check_out occupies
+the nights check_in, ..., check_out - 1.
+
+Nodes left without bookings by a release are freed and reused by later
+bookings, so the tree only holds as many nodes as the current bookings
+need, however many stays were booked and released before.
+"""
+
+import datetime
+
+# Number of day numbers covered by the tree. date.max.toordinal() is below
+# 2 ** 22, so every representable date fits.
+SPAN = 1 << 22
+
+
+def to_date(value):
+    """
+    Convert a date or an ISO 8601 date string to a date.
+
+    Args:
+        value (date or str): The date to convert.
+
+    Returns:
+        datetime.date: The converted date.
+
+    Raises:
+        ValueError: If the value is not a valid date.
+    """
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    if isinstance(value, datetime.date):
+        return value
+    if isinstance(value, str):
+        return datetime.date.fromisoformat(value)
+    raise ValueError(f"Invalid date: {value!r}")
+
+
+def stay_nights(check_in, check_out):
+    """
+    Return the range of day numbers occupied by a stay.
+
+    Args:
+        check_in (date or str): Arrival date.
+        check_out (date or str): Departure date.
+
+    Returns:
+        tuple: (first, end) day numbers, end being exclusive.
+
+    Raises:
+        ValueError: If a date is invalid or check_out is not after
+            check_in.
+    """
+    first = to_date(check_in).toordinal()
+    end = to_date(check_out).toordinal()
+    if end <= first:
+        raise ValueError("check_out must be after check_in")
+    return first, end
+
+
+def today():
+    """
+    Return the day number of the current date.
+
+    Returns:
+        int: The ordinal of today's date.
+    """
+    return datetime.date.today().toordinal()
+
+
+class NightlyInventory:
+    """
+    A class counting booked rooms per night.
+    """
+
+    __slots__ = ("_left", "_right", "_max", "_add", "_free")
+
+    def __init__(self):
+        """
+        Initialize an empty NightlyInventory instance.
+        """
+        # Nodes are stored in parallel lists. Node 0 is the root, so a
+        # child index of 0 means the child has not been created yet and
+        # every night below it has no bookings.
+        self._left = [0]
+        self._right = [0]
+        self._max = [0]
+        self._add = [0]
+        # Indexes of freed nodes, reused before new ones are created.
+        self._free = []
+
+    def _new_node(self):
+        """
+        Create an empty node and return its index.
+        """
+        if self._free:
+            # Freed nodes were left empty, with no children.
+            return self._free.pop()
+        self._left.append(0)
+        self._right.append(0)
+        self._max.append(0)
+        self._add.append(0)
+        return len(self._max) - 1
+
+    def _is_empty(self, node):
+        """
+        Check whether a node adds nothing and has no children.
+        """
+        return not (self._add[node] or self._left[node]
+                    or self._right[node])
+
+    def _update(self, node, low, high, first, end, amount):
+        """
+        Add amount to every night in [first, end) under the given node,
+        which covers [low, high).
+        """
+        if first <= low and high <= end:
+            self._add[node] += amount
+            self._max[node] += amount
+            return
+        middle = (low + high) // 2
+        if first < middle:
+            if not self._left[node]:
+                self._left[node] = self._new_node()
+            self._update(self._left[node], low, middle, first, end, amount)
+        if end > middle:
+            if not self._right[node]:
+                self._right[node] = self._new_node()
+            self._update(self._right[node], middle, high, first, end, amount)
+        # Children are pruned on the way up, so an emptied subtree has
+        # been reduced to its root by the time its parent sees it.
+        left, right = self._left[node], self._right[node]
+        if left and self._is_empty(left):
+            self._free.append(left)
+            self._left[node] = left = 0
+        if right and self._is_empty(right):
+            self._free.append(right)
+            self._right[node] = right = 0
+        self._max[node] = self._add[node] + max(
+            self._max[left] if left else 0,
+            self._max[right] if right else 0
+        )
+
+    def _query(self, node, low, high, first, end):
+        """
+        Return the maximum count over the nights in [first, end) under the
+        given node, which covers [low, high).
+        """
+        if first <= low and high <= end:
+            return self._max[node]
+        middle = (low + high) // 2
+        counts = []
+        if first < middle:
+            left = self._left[node]
+            counts.append(
+                self._query(left, low, middle, first, end) if left else 0)
+        if end > middle:
+            right = self._right[node]
+            counts.append(
+                self._query(right, middle, high, first, end) if right else 0)
+        return max(counts) + self._add[node]
+
+    def add(self, first, end, amount):
+        """
+        Add amount to the booked count of the nights in [first, end).
+
+        Args:
+            first (int): First day number.
+            end (int): Day number after the last night.
+            amount (int): Number of rooms to add, negative to release.
+        """
+        self._update(0, 0, SPAN, first, end, amount)
+
+    def booked(self, first, end):
+        """
+        Return the largest number of rooms booked on any night in
+        [first, end).
+
+        Args:
+            first (int): First day number.
+            end (int): Day number after the last night.
+
+        Returns:
+            int: The peak booked count over the range.
+        """
+        return self._query(0, 0, SPAN, first, end)
+
+    def peak(self):
+        """
+        Return the largest number of rooms booked on any night.
+
+        Returns:
+            int: The peak booked count.
+        """
+        return self._max[0]
+
+    def __len__(self):
+        """
+        Return the number of nodes in use, the root included.
+        """
+        return len(self._max) - len(self._free)
@@ -0,0 +1,434 @@
+"""
+benchmark.py
+
+This module measures the throughput and latency of the reservation system
+at realistic data sizes. For each size it seeds that many hotels, customers
+and reservations in a scratch data directory, then times the public
+operations one call at a time and reports operations per second, median and
+99th percentile latency, and the peak resident memory of the process.
+
+Each size runs in its own process, so its peak memory is not inflated by
+the sizes run before it. Results are written as JSON and may be compared
+against a saved baseline; the command exits with status 1 if any operation
+regressed by more than the allowed tolerance.
+
+In json mode every write rewrites a whole store, so writes at the larger
+sizes take seconds each; use --mode journal, or fewer --samples, there.
+
+With --codecs, the benchmark instead times each persistence codec writing
+and loading a store of that many reservations, and reports the size of the
+file it writes.
+
+Usage:
+    python -m app.benchmark --sizes 1000 10000 --output results.json
+    python -m app.benchmark --baseline baseline.json --output results.json
+    python -m app.benchmark --codecs --sizes 100000 1000000
+"""
+
+import argparse
+import concurrent.futures
+import contextlib
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+from app.customer import Customer
+from app.hotel import Hotel
+from app.persistence import (
+    CODECS,
+    get_codec,
+    get_storage_mode,
+    set_codec,
+    set_storage_mode,
+)
+from app.repository import reset_repositories
+from app.reservation import Reservation
+
+# Number of hotels, customers and reservations seeded, per run.
+SIZES = (1000, 10000, 100000, 1000000)
+
+# Number of timed calls per operation.
+SAMPLES = 200
+
+# Allowed relative slowdown before a result counts as a regression.
+TOLERANCE = 0.2
+
+# Rooms per seeded hotel. Each hotel holds one seeded reservation, so the
+# remaining rooms are free for the timed reservations.
+ROOMS = 50
+
+
+def _percentile(samples, fraction):
+    """
+    Return a percentile of a sorted list of samples (nearest rank).
+    """
+    index = min(int(fraction * len(samples)), len(samples) - 1)
+    return samples[index]
+
+
+def _summarize(durations):
+    """
+    Summarize the durations of the timed calls of one operation.
+
+    Args:
+        durations (list): Duration of each call, in seconds.
+
+    Returns:
+        dict: ops_per_sec, p50_ms and p99_ms.
+    """
+    durations = sorted(durations)
+    total = sum(durations)
+    return {
+        "ops_per_sec": len(durations) / total if total else 0.0,
+        "p50_ms": _percentile(durations, 0.50) * 1000,
+        "p99_ms": _percentile(durations, 0.99) * 1000,
+    }
+
+
+def _time_calls(calls):
+    """
+    Time each call of a list of zero-argument callables.
+
+    Args:
+        calls (list): The calls to time, run in order.
+
+    Returns:
+        dict: The summary of the durations, see _summarize.
+    """
+    durations = []
+    for call in calls:
+        start = time.perf_counter()
+        call()
+        durations.append(time.perf_counter() - start)
+    return _summarize(durations)
+
+
+def _peak_rss_kb():
+    """
+    Return the peak resident set size of the process, in kilobytes.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, Linux reports kilobytes.
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def seed(size):
+    """
+    Create size hotels, customers and reservations in the current data
+    directory, with one reservation per hotel.
+
+    Args:
+        size (int): Number of records of each kind.
+    """
+    Hotel.create_hotels(
+        Hotel(hotel_id, f"Hotel {hotel_id}", f"City {hotel_id % 100}", ROOMS)
+        for hotel_id in range(1, size + 1)
+    )
+    Customer.create_customers(
+        Customer(customer_id, f"Customer {customer_id}",
+                 f"customer{customer_id}@example.com", "555-0100")
+        for customer_id in range(1, size + 1)
+    )
+    Reservation.create_reservations(
+        Reservation(reservation_id, reservation_id, reservation_id)
+        for reservation_id in range(1, size + 1)
+    )
+
+
+def run_size(size, samples=SAMPLES, mode=None, seed_value=0):
+    """
+    Seed a scratch data directory and time every operation at one size.
+
+    The operations run in the current process, in a temporary working
+    directory that is removed afterwards.
+
+    Args:
+        size (int): Number of records of each kind to seed.
+        samples (int, optional): Number of timed calls per operation.
+        mode (str, optional): Storage mode to use. Defaults to the
+            current one.
+        seed_value (int, optional): Seed of the random record choice.
+
+    Returns:
+        dict: seed_seconds, peak_rss_kb and, under operations, the summary
+        of each operation.
+    """
+    rng = random.Random(seed_value)
+    previous_mode = get_storage_mode()
+    previous_directory = os.getcwd()
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        os.makedirs(os.path.join(tmp_dir, "json"))
+        os.chdir(tmp_dir)
+        set_storage_mode(mode or previous_mode)
+        reset_repositories()
+
+        start = time.perf_counter()
+        seed(size)
+        seed_seconds = time.perf_counter() - start
+
+        existing = [rng.randint(1, size) for _ in range(samples)]
+        new_ids = range(size + 1, size + samples + 1)
+        operations = {}
+        with open(os.devnull, "w", encoding="utf-8") as devnull:
+            with contextlib.redirect_stdout(devnull):
+                operations["create_hotel"] = _time_calls([
+                    lambda i=i: Hotel.create_hotel(
+                        Hotel(i, f"Hotel {i}", "Benchmark", ROOMS))
+                    for i in new_ids
+                ])
+                operations["display_hotel"] = _time_calls([
+                    lambda i=i: Hotel.display_hotel(i) for i in existing
+                ])
+                operations["modify_hotel"] = _time_calls([
+                    lambda i=i: Hotel.modify_hotel(i, {"name": "Renamed"})
+                    for i in existing
+                ])
+                operations["reserve_room"] = _time_calls([
+                    lambda i=i: Hotel.reserve_room(i, -i) for i in new_ids
+                ])
+                operations["hotel_cancel_reservation"] = _time_calls([
+                    lambda i=i: Hotel.cancel_reservation(i, -i)
+                    for i in new_ids
+                ])
+                operations["delete_hotel"] = _time_calls([
+                    lambda i=i: Hotel.delete_hotel(i) for i in new_ids
+                ])
+
+                operations["create_customer"] = _time_calls([
+                    lambda i=i: Customer.create_customer(
+                        Customer(i, f"Customer {i}",
+                                 f"customer{i}@example.com", "555-0100"))
+                    for i in new_ids
+                ])
+                operations["display_customer"] = _time_calls([
+                    lambda i=i: Customer.display_customer(i)
+                    for i in existing
+                ])
+                operations["modify_customer"] = _time_calls([
+                    lambda i=i: Customer.modify_customer(
+                        i, {"phone": "555-0199"})
+                    for i in existing
+                ])
+                operations["delete_customer"] = _time_calls([
+                    lambda i=i: Customer.delete_customer(i) for i in new_ids
+                ])
+
+                operations["create_reservation"] = _time_calls([
+                    lambda i=i, h=h: Reservation.create_reservation(
+                        Reservation(i, h, h))
+                    for i, h in zip(new_ids, existing)
+                ])
+                operations["cancel_reservation"] = _time_calls([
+                    lambda i=i: Reservation.cancel_reservation(i)
+                    for i in new_ids
+                ])
+        return {
+            "seed_seconds": seed_seconds,
+            "peak_rss_kb": _peak_rss_kb(),
+            "operations": operations,
+        }
+    finally:
+        os.chdir(previous_directory)
+        set_storage_mode(previous_mode)
+        reset_repositories()
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def _reservation_records(size):
+    """
+    Return size reservation records in stored form.
+    """
+    return [
+        {
+            "reservation_id": reservation_id,
+            "hotel_id": reservation_id % 1000 + 1,
+            "customer_id": reservation_id,
+            "check_in": "2026-05-01",
+            "check_out": "2026-05-04",
+        }
+        for reservation_id in range(1, size + 1)
+    ]
+
+
+def run_codecs(size, repeat=3):
+    """
+    Time each persistence codec writing and loading a store of size
+    reservations, keeping the fastest of several runs.
+
+    Args:
+        size (int): Number of records in the store.
+        repeat (int, optional): Number of runs per codec.
+
+    Returns:
+        dict: encode_ms, decode_ms and bytes, keyed by codec name.
+    """
+    records = _reservation_records(size)
+    results = {}
+    tmp_dir = tempfile.mkdtemp()
+    previous = get_codec()
+    try:
+        path = os.path.join(tmp_dir, "reservations.json")
+        for name, codec in CODECS.items():
+            # The pickle codec only loads files while it is selected.
+            set_codec(name)
+            encode = decode = float("inf")
+            for _ in range(repeat):
+                start = time.perf_counter()
+                with open(path, "wb") as f:
+                    codec.dump(records, f)
+                encode = min(encode, time.perf_counter() - start)
+                start = time.perf_counter()
+                with open(path, "rb") as f:
+                    codec.load(f)
+                decode = min(decode, time.perf_counter() - start)
+            results[name] = {
+                "encode_ms": encode * 1000,
+                "decode_ms": decode * 1000,
+                "bytes": os.path.getsize(path),
+            }
+    finally:
+        set_codec(previous)
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return results
+
+
+def run(sizes=SIZES, samples=SAMPLES, mode=None):
+    """
+    Run the benchmark at several sizes, each in a fresh process.
+
+    Args:
+        sizes (iterable, optional): Numbers of records to seed.
+        samples (int, optional): Number of timed calls per operation.
+        mode (str, optional): Storage mode to use. Defaults to the
+            current one.
+
+    Returns:
+        dict: The environment the benchmark ran in, and the results of
+        each size keyed by the size as a string.
+    """
+    mode = mode or get_storage_mode()
+    results = {}
+    context = multiprocessing.get_context("spawn")
+    for size in sizes:
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=1, mp_context=context) as executor:
+            results[str(size)] = executor.submit(
+                run_size, size, samples, mode).result()
+    return {
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "storage_mode": mode,
+            "samples": samples,
+        },
+        "results": results,
+    }
+
+
+def compare(results, baseline, tolerance=TOLERANCE):
+    """
+    Compare benchmark results against a baseline.
+
+    An operation regresses if its throughput dropped, or its p99 latency
+    grew, by more than the tolerance. Sizes and operations missing from
+    either side are ignored.
+
+    Args:
+        results (dict): Results returned by run.
+        baseline (dict): Results of an earlier run.
+        tolerance (float, optional): Allowed relative change.
+
+    Returns:
+        list: One message per regression.
+    """
+    regressions = []
+    for size, current in results["results"].items():
+        previous = baseline.get("results", {}).get(size)
+        if previous is None:
+            continue
+        for name, summary in current["operations"].items():
+            before = previous["operations"].get(name)
+            if before is None:
+                continue
+            slowest = before["ops_per_sec"] * (1 - tolerance)
+            if summary["ops_per_sec"] < slowest:
+                regressions.append(
+                    f"{size} {name}: {summary['ops_per_sec']:.0f} ops/s, "
+                    f"baseline {before['ops_per_sec']:.0f} ops/s")
+            if summary["p99_ms"] > before["p99_ms"] * (1 + tolerance):
+                regressions.append(
+                    f"{size} {name}: p99 {summary['p99_ms']:.3f} ms, "
+                    f"baseline {before['p99_ms']:.3f} ms")
+    return regressions
+
+
+def main(argv=None):
+    """
+    Run the benchmark from the command line.
+
+    Args:
+        argv (list, optional): Command-line arguments.
+
+    Returns:
+        int: 1 if a regression was found against the baseline, else 0.
+    """
+    parser = argparse.ArgumentParser(
+        description="Benchmark the reservation system.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES)
+    parser.add_argument("--samples", type=int, default=SAMPLES)
+    parser.add_argument("--mode", help="storage mode to benchmark")
+    parser.add_argument("--output", help="file to write the results to")
+    parser.add_argument("--baseline", help="results to compare against")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE)
+    parser.add_argument("--codecs", action="store_true",
+                        help="benchmark the persistence codecs instead")
+    args = parser.parse_args(argv)
+
+    if args.codecs:
+        results = {"environment": {"python": platform.python_version(),
+                                   "platform": platform.platform()},
+                   "codecs": {}}
+        for size in args.sizes:
+            codecs = results["codecs"][str(size)] = run_codecs(size)
+            print(f"{size} records:")
+            for name, result in codecs.items():
+                print(f"  {name:14} encode {result['encode_ms']:10.1f} ms"
+                      f"  decode {result['decode_ms']:10.1f} ms"
+                      f"  {result['bytes']:12} bytes")
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                json.dump(results, f, indent=4)
+        return 0
+
+    results = run(args.sizes, args.samples, args.mode)
+    for size, result in results["results"].items():
+        print(f"{size} records: seeded in {result['seed_seconds']:.2f} s, "
+              f"peak RSS {result['peak_rss_kb'] / 1024:.1f} MiB")
+        for name, summary in result["operations"].items():
+            print(f"  {name:20} {summary['ops_per_sec']:12.0f} ops/s"
+                  f"  p50 {summary['p50_ms']:8.3f} ms"
+                  f"  p99 {summary['p99_ms']:8.3f} ms")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=4)
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,655 @@
+"""
+consistency.py
+
+This module checks that the hotel, customer and reservation stores agree
+with each other, and repairs them when they do not. It reports:
+
+- stores that cannot be read at all;
+- duplicate IDs within a store;
+- orphaned rooms: reservation IDs held by a hotel that has no such
+  reservation;
+- orphaned reservations: reservations their hotel holds no room for;
+- reservations whose hotel or customer does not exist;
+- hotels over capacity, holding more rooms than they have on some night.
+
+The stores are read through the active storage backend (see
+storage.py), one record at a time, so memory use does not depend on their
+size. Checking the references between stores is a join on IDs: while the
+stores are streamed, each record is reduced to a few small facts, which
+are spilled to partition files on disk by the hash of the ID they are
+about. Each partition is then loaded and checked on its own, so memory
+use is bounded by the size of a partition and the number of issues
+found. Every store is read once, and every fact once. Like the
+repositories, the checker treats the first record of a duplicated ID as
+the live one and ignores the others.
+
+repair() fixes what can be fixed without a human decision:
+
+- duplicated records are removed, keeping the first;
+- orphaned rooms are released;
+- an orphaned reservation is given a room at its hotel if one is free for
+  its stay, and deleted otherwise;
+- reservations whose hotel or customer does not exist are canceled.
+
+Hotels over capacity are reported but not repaired, as choosing the
+reservations to cancel is a business decision. Nothing is repaired while
+a store cannot be read, since rewriting it would lose its records.
+
+Usage:
+    python -m app.consistency
+    python -m app.consistency --report issues.ndjson
+    python -m app.consistency --repair
+"""
+
+import argparse
+import collections
+import json
+import marshal
+import math
+import os
+import pickle
+import sqlite3
+import tempfile
+import time
+
+from app.hotel import decode_hotel, encode_hotel, hotel_occupancy
+from app.metrics import timed
+from app.persistence import (
+    CODECS,
+    NDJSON_FORMAT,
+    detect_format,
+    rewrite_records,
+    HOTEL_FILE,
+    CUSTOMER_FILE,
+    RESERVATION_FILE,
+)
+from app.storage import JsonBackend, get_backend
+from app.transaction import recover
+
+# Kinds of issues.
+UNREADABLE_STORE = "unreadable_store"
+DUPLICATE_ID = "duplicate_id"
+ORPHANED_ROOM = "orphaned_room"
+ORPHANED_RESERVATION = "orphaned_reservation"
+MISSING_HOTEL = "missing_hotel"
+MISSING_CUSTOMER = "missing_customer"
+OVER_CAPACITY = "over_capacity"
+
+# Names of the stores in issues, and the field identifying their records.
+HOTELS = "hotels"
+CUSTOMERS = "customers"
+RESERVATIONS = "reservations"
+KEYS = {
+    HOTELS: "hotel_id",
+    CUSTOMERS: "customer_id",
+    RESERVATIONS: "reservation_id",
+}
+
+# Bytes of stored data per partition, and the largest number of
+# partitions. A partition takes about ten times its share of stored data
+# in memory, and each one keeps three files open while the stores are
+# read.
+PARTITION_BYTES = 16 * 1024 * 1024
+MAX_PARTITIONS = 256
+
+# Facts buffered per partition before they are written to its file.
+SPILL_BATCH = 4096
+
+# Kinds of facts: a record with the ID, a reference to the ID from
+# another store, and a room held for the ID by a hotel.
+_RECORD = 0
+_REFERENCE = 1
+_HELD = 2
+
+# Errors raised by a store that cannot be read.
+_READ_ERRORS = (ValueError, OSError, EOFError, pickle.UnpicklingError,
+                sqlite3.Error)
+
+
+class _Unreadable(Exception):
+    """
+    Raised when a store cannot be read.
+    """
+
+    def __init__(self, store, error):
+        super().__init__(str(error))
+        self.store = store
+
+
+class _Spill:
+    """
+    Facts spilled to partition files, grouped by the hash of the ID they
+    are about.
+    """
+
+    def __init__(self, directory, name, partitions):
+        """
+        Create the partition files.
+
+        Args:
+            directory (str): Directory of the files.
+            name (str): Prefix of the file names.
+            partitions (int): Number of partitions.
+        """
+        self._paths = [os.path.join(directory, f"{name}.{number}")
+                       for number in range(partitions)]
+        self._files = [open(path, "wb") for path in self._paths]
+        self._buffers = [[] for _ in self._paths]
+
+    def add(self, record_id, fact):
+        """
+        Add a fact about a record ID.
+        """
+        try:
+            partition = hash(record_id) % len(self._buffers)
+        except TypeError:
+            # An ID that cannot be hashed matches no record.
+            partition = 0
+        buffer = self._buffers[partition]
+        buffer.append(fact)
+        if len(buffer) >= SPILL_BATCH:
+            self._flush(partition)
+
+    def _flush(self, partition):
+        """
+        Write the buffered facts of a partition to its file, preceded by
+        their size.
+        """
+        data = marshal.dumps(self._buffers[partition])
+        self._files[partition].write(len(data).to_bytes(8, "little"))
+        self._files[partition].write(data)
+        self._buffers[partition] = []
+
+    def close(self):
+        """
+        Write the buffered facts and close the files.
+        """
+        for partition, f in enumerate(self._files):
+            if not f.closed:
+                if self._buffers[partition]:
+                    self._flush(partition)
+                f.close()
+
+    def partitions(self):
+        """
+        Iterate over the partitions, deleting each file once it is read.
+
+        Yields:
+            list: The facts of a partition.
+        """
+        self.close()
+        for path in self._paths:
+            facts = []
+            with open(path, "rb") as f:
+                data = memoryview(f.read())
+            os.remove(path)
+            position = 0
+            while position < len(data):
+                size = int.from_bytes(data[position:position + 8], "little")
+                position += 8
+                facts.extend(marshal.loads(data[position:position + size]))
+                position += size
+            yield facts
+
+
+def _hashable(value):
+    """
+    Check whether a value can be used as an ID.
+    """
+    try:
+        hash(value)
+    except TypeError:
+        return False
+    return True
+
+
+def _issue(kind, store, record_id, **details):
+    """
+    Return an issue as a dict.
+    """
+    return dict(kind=kind, store=store, id=record_id, **details)
+
+
+def _partition_count(backend, file_paths):
+    """
+    Return the number of partitions for stores of the given size.
+    """
+    size = sum(backend.size(file_path) for file_path in file_paths)
+    return max(1, min(MAX_PARTITIONS, math.ceil(size / PARTITION_BYTES)))
+
+
+def _scan(backend, store, file_path, visit):
+    """
+    Stream the records of a store, calling visit with the position and
+    the ID of each record and the record itself.
+
+    Raises:
+        _Unreadable: If the store cannot be read.
+    """
+    key = KEYS[store]
+    try:
+        for ordinal, record in enumerate(backend.iter_records(file_path)):
+            if isinstance(record, dict) and _hashable(record.get(key)):
+                visit(ordinal, record.get(key), record)
+    except _READ_ERRORS as e:
+        raise _Unreadable(store, e) from e
+
+
+def _duplicates(store, facts):
+    """
+    Find the duplicated IDs of a partition.
+
+    Args:
+        store (str): Name of the store the record facts belong to.
+        facts (list): The facts of the partition.
+
+    Returns:
+        tuple: A dict mapping each ID of the partition to the position of
+        its live record, the duplicate ID issues, and the positions of
+        the records hidden by a duplicate.
+    """
+    ordinals = collections.defaultdict(list)
+    for fact in facts:
+        if fact[0] == _RECORD:
+            ordinals[fact[1]].append(fact[2])
+    live = {}
+    issues = []
+    hidden = set()
+    for record_id, found in ordinals.items():
+        live[record_id] = min(found)
+        if len(found) > 1:
+            issues.append(_issue(DUPLICATE_ID, store, record_id,
+                                 count=len(found)))
+            hidden.update(found)
+            hidden.discard(live[record_id])
+    return live, issues, hidden
+
+
+def check(hotel_file=HOTEL_FILE, customer_file=CUSTOMER_FILE,
+          reservation_file=RESERVATION_FILE, partitions=None):
+    """
+    Check that the stores are consistent with each other.
+
+    The facts are spilled to a temporary directory next to the
+    reservation store, and removed when the check ends.
+
+    Args:
+        hotel_file (str, optional): Path to the hotel store.
+        customer_file (str, optional): Path to the customer store.
+        reservation_file (str, optional): Path to the reservation store.
+        partitions (int, optional): Number of partitions. Defaults to one
+            per PARTITION_BYTES of stored data.
+
+    Yields:
+        dict: The issues found. Each has a kind, the store and the id of
+        the record at fault, and details depending on the kind. If a
+        store cannot be read, the only issue is an unreadable_store one
+        with the error, since every other result would be wrong.
+    """
+    backend = get_backend()
+    file_paths = (hotel_file, customer_file, reservation_file)
+    partitions = partitions or _partition_count(backend, file_paths)
+    directory = os.path.dirname(reservation_file) or "."
+    with tempfile.TemporaryDirectory(dir=directory,
+                                     prefix=".check.") as spill_directory:
+        spills = {
+            store: _Spill(spill_directory, store, partitions)
+            for store in KEYS
+        }
+        try:
+            over_capacity = _spill_stores(backend, spills, *file_paths)
+        except _Unreadable as e:
+            yield _issue(UNREADABLE_STORE, e.store, None, error=str(e))
+            return
+        finally:
+            for spill in spills.values():
+                spill.close()
+        yield from _check_partitions(spills, over_capacity)
+
+
+def _spill_stores(backend, spills, hotel_file, customer_file,
+                  reservation_file):
+    """
+    Stream the stores, spilling their facts.
+
+    Returns:
+        list: (position, hotel_id, held_rooms, total_rooms) of the hotel
+        records over capacity.
+
+    Raises:
+        _Unreadable: If a store cannot be read.
+    """
+    over_capacity = []
+
+    def visit_hotel(ordinal, hotel_id, record):
+        spills[HOTELS].add(hotel_id, (_RECORD, hotel_id, ordinal))
+        occupancy = decode_hotel(record).get("reserved_rooms")
+        if occupancy is None:
+            return
+        for reservation_id in occupancy.to_list():
+            spills[RESERVATIONS].add(
+                reservation_id, (_HELD, reservation_id, hotel_id, ordinal))
+        total_rooms = record.get("total_rooms", 0)
+        held_rooms = occupancy.held_rooms()
+        if isinstance(total_rooms, int) and held_rooms > total_rooms:
+            over_capacity.append((ordinal, hotel_id, held_rooms, total_rooms))
+
+    def visit_customer(ordinal, customer_id, record):
+        spills[CUSTOMERS].add(customer_id, (_RECORD, customer_id, ordinal))
+
+    def visit_reservation(ordinal, reservation_id, record):
+        hotel_id = record.get("hotel_id")
+        customer_id = record.get("customer_id")
+        spills[RESERVATIONS].add(reservation_id, (
+            _RECORD, reservation_id, ordinal, hotel_id,
+            record.get("check_in"), record.get("check_out")))
+        spills[HOTELS].add(
+            hotel_id, (_REFERENCE, hotel_id, ordinal, reservation_id))
+        spills[CUSTOMERS].add(
+            customer_id,
+            (_REFERENCE, customer_id, ordinal, reservation_id, hotel_id))
+
+    _scan(backend, HOTELS, hotel_file, visit_hotel)
+    _scan(backend, CUSTOMERS, customer_file, visit_customer)
+    _scan(backend, RESERVATIONS, reservation_file, visit_reservation)
+    return over_capacity
+
+
+def _missing(facts, live):
+    """
+    Return the references of a partition to IDs without a record, as
+    (position of the reservation, fact) pairs.
+    """
+    return [
+        (fact[2], fact)
+        for fact in facts
+        if fact[0] == _REFERENCE
+        and not (_hashable(fact[1]) and fact[1] in live)
+    ]
+
+
+def _check_partitions(spills, over_capacity):
+    """
+    Check the spilled facts, one partition at a time.
+
+    Hotels and customers are checked first, to find the hotel records
+    hidden by duplicates, whose rooms are ignored, and the references to
+    missing hotels and customers. These are only reported once the
+    reservations are checked, unless they come from a reservation record
+    hidden by a duplicate.
+
+    Yields:
+        dict: The issues found.
+    """
+    hidden_hotels = set()
+    missing_hotels = []
+    for facts in spills[HOTELS].partitions():
+        live, issues, hidden = _duplicates(HOTELS, facts)
+        yield from issues
+        hidden_hotels.update(hidden)
+        missing_hotels.extend(_missing(facts, live))
+    missing_customers = []
+    for facts in spills[CUSTOMERS].partitions():
+        live, issues, _ = _duplicates(CUSTOMERS, facts)
+        yield from issues
+        missing_customers.extend(_missing(facts, live))
+
+    hidden_reservations = set()
+    unheld = []
+    for facts in spills[RESERVATIONS].partitions():
+        live, issues, hidden = _duplicates(RESERVATIONS, facts)
+        yield from issues
+        hidden_reservations.update(hidden)
+        records = {}
+        held = collections.defaultdict(set)
+        for fact in facts:
+            if fact[0] == _RECORD:
+                if fact[2] == live[fact[1]]:
+                    records[fact[1]] = fact
+            elif fact[3] not in hidden_hotels:
+                held[fact[1]].add(fact[2])
+        for reservation_id, hotel_ids in held.items():
+            record = records.get(reservation_id)
+            for hotel_id in hotel_ids:
+                if record is None or record[3] != hotel_id:
+                    yield _issue(ORPHANED_ROOM, HOTELS, hotel_id,
+                                 reservation_id=reservation_id)
+        for reservation_id, record in records.items():
+            if record[3] not in held.get(reservation_id, ()):
+                unheld.append(record)
+
+    missing = set()
+    for ordinal, fact in missing_hotels:
+        if ordinal not in hidden_reservations:
+            missing.add(ordinal)
+            yield _issue(MISSING_HOTEL, RESERVATIONS, fact[3],
+                         hotel_id=fact[1])
+    for ordinal, fact in missing_customers:
+        if ordinal not in hidden_reservations:
+            yield _issue(MISSING_CUSTOMER, RESERVATIONS, fact[3],
+                         customer_id=fact[1], hotel_id=fact[4])
+    for _, reservation_id, ordinal, hotel_id, check_in, check_out in unheld:
+        # A reservation of a missing hotel is reported as such.
+        if ordinal not in missing:
+            yield _issue(ORPHANED_RESERVATION, RESERVATIONS, reservation_id,
+                         hotel_id=hotel_id, check_in=check_in,
+                         check_out=check_out)
+    for ordinal, hotel_id, held_rooms, total_rooms in over_capacity:
+        if ordinal not in hidden_hotels:
+            yield _issue(OVER_CAPACITY, HOTELS, hotel_id,
+                         held_rooms=held_rooms, total_rooms=total_rooms)
+
+
+def _first_records(backend, file_path, key, record_ids):
+    """
+    Return the first record of each of the given IDs, keyed by ID.
+    """
+    found = {}
+    if not record_ids:
+        return found
+    for record in backend.iter_records(file_path):
+        record_id = record.get(key)
+        if (
+            _hashable(record_id)
+            and record_id in record_ids
+            and record_id not in found
+        ):
+            found[record_id] = record
+    return found
+
+
+def _rewrite(backend, file_path, key, mutations):
+    """
+    Apply mutations to a store. A JSON file keeps its format, and loses
+    every later record of a duplicated ID that is put.
+    """
+    if not mutations:
+        return
+    if isinstance(backend, JsonBackend):
+        file_format = detect_format(file_path)
+        rewrite_records(file_path, key, mutations,
+                        ndjson=file_format == NDJSON_FORMAT,
+                        codec=file_format if file_format in CODECS else None)
+        return
+
+    def records():
+        states = {record_id: record for _, record_id, record in mutations}
+        result = []
+        for record in backend.iter_records(file_path):
+            record_id = record.get(key)
+            if not _hashable(record_id) or record_id not in states:
+                result.append(record)
+            elif states[record_id] is not None:
+                result.append(states.pop(record_id))
+        result.extend(record for record in states.values()
+                      if record is not None)
+        return result
+
+    backend.write(file_path, key, mutations, records)
+
+
+@timed("consistency.repair")
+def repair(hotel_file=HOTEL_FILE, customer_file=CUSTOMER_FILE,
+           reservation_file=RESERVATION_FILE, partitions=None):
+    """
+    Check the stores and repair the issues found.
+
+    Transactions left by dead processes are recovered first. The stores
+    are then locked exclusively, checked, and written one at a time
+    through the active storage backend, hotels first. If the process dies
+    before every store is written, running the repair again finishes it.
+
+    Args:
+        hotel_file (str, optional): Path to the hotel store.
+        customer_file (str, optional): Path to the customer store.
+        reservation_file (str, optional): Path to the reservation store.
+        partitions (int, optional): Number of partitions, see check.
+
+    Returns:
+        dict: issues, the list of issues found before repairing, and the
+        number of duplicates_removed, rooms_released, rooms_reserved and
+        reservations_deleted.
+    """
+    recover(os.path.dirname(reservation_file))
+    backend = get_backend()
+    with backend.lock(hotel_file), backend.lock(customer_file), \
+            backend.lock(reservation_file):
+        issues = list(check(hotel_file, customer_file, reservation_file,
+                            partitions))
+        result = {
+            "issues": issues,
+            "duplicates_removed": 0,
+            "rooms_released": 0,
+            "rooms_reserved": 0,
+            "reservations_deleted": 0,
+        }
+        if any(issue["kind"] == UNREADABLE_STORE for issue in issues):
+            print("Not repairing: a store cannot be read.")
+            return result
+
+        duplicates = {store: set() for store in KEYS}
+        release = collections.defaultdict(set)
+        hold = collections.defaultdict(list)
+        delete = set()
+        for issue in issues:
+            kind = issue["kind"]
+            if kind == DUPLICATE_ID:
+                duplicates[issue["store"]].add(issue["id"])
+                result["duplicates_removed"] += issue["count"] - 1
+            elif kind == ORPHANED_ROOM:
+                release[issue["id"]].add(issue["reservation_id"])
+            elif kind == ORPHANED_RESERVATION:
+                hold[issue["hotel_id"]].append(
+                    (issue["id"], issue["check_in"], issue["check_out"]))
+            elif kind in (MISSING_HOTEL, MISSING_CUSTOMER):
+                delete.add(issue["id"])
+                if _hashable(issue["hotel_id"]):
+                    release[issue["hotel_id"]].add(issue["id"])
+
+        hotel_ids = duplicates[HOTELS] | set(release) | set(hold)
+        mutations = []
+        for hotel_id, record in _first_records(
+                backend, hotel_file, KEYS[HOTELS], hotel_ids).items():
+            hotel = decode_hotel(record)
+            if hotel_id in release or hotel_id in hold:
+                occupancy = hotel_occupancy(hotel)
+                for reservation_id in release.get(hotel_id, ()):
+                    result["rooms_released"] += occupancy.cancel(
+                        reservation_id)
+                for reservation_id, check_in, check_out in hold.get(
+                        hotel_id, ()):
+                    if reservation_id in delete:
+                        continue
+                    try:
+                        reserved = occupancy.reserve(
+                            reservation_id, hotel.get("total_rooms", 0),
+                            check_in, check_out)
+                    except (TypeError, ValueError):
+                        reserved = False
+                    if reserved:
+                        result["rooms_reserved"] += 1
+                    else:
+                        delete.add(reservation_id)
+            mutations.append(("put", hotel_id, encode_hotel(hotel)))
+        _rewrite(backend, hotel_file, KEYS[HOTELS], mutations)
+
+        _rewrite(backend, customer_file, KEYS[CUSTOMERS], [
+            ("put", customer_id, record)
+            for customer_id, record in _first_records(
+                backend, customer_file, KEYS[CUSTOMERS],
+                duplicates[CUSTOMERS]).items()
+        ])
+
+        mutations = [("delete", reservation_id, None)
+                     for reservation_id in delete]
+        mutations.extend(
+            ("put", reservation_id, record)
+            for reservation_id, record in _first_records(
+                backend, reservation_file, KEYS[RESERVATIONS],
+                duplicates[RESERVATIONS] - delete).items()
+        )
+        _rewrite(backend, reservation_file, KEYS[RESERVATIONS], mutations)
+        result["reservations_deleted"] = len(delete)
+        return result
+
+
+def _summary(issues):
+    """
+    Return the number of issues of each kind, as a printable string.
+    """
+    counts = collections.Counter(issue["kind"] for issue in issues)
+    return ", ".join(f"{count} {kind}"
+                     for kind, count in sorted(counts.items())) or "none"
+
+
+def main(argv=None):
+    """
+    Run a check, or a repair, from the command line.
+
+    Args:
+        argv (list, optional): Command-line arguments.
+
+    Returns:
+        int: 1 if any issue remains, else 0.
+    """
+    parser = argparse.ArgumentParser(
+        description="Check the stores for inconsistencies.")
+    parser.add_argument("--hotels", default=HOTEL_FILE,
+                        help="path to the hotel store")
+    parser.add_argument("--customers", default=CUSTOMER_FILE,
+                        help="path to the customer store")
+    parser.add_argument("--reservations", default=RESERVATION_FILE,
+                        help="path to the reservation store")
+    parser.add_argument("--partitions", type=int,
+                        help="number of partitions of the spilled facts")
+    parser.add_argument("--report",
+                        help="NDJSON file for the issues, one per line")
+    parser.add_argument("--repair", action="store_true",
+                        help="repair the issues found")
+    args = parser.parse_args(argv)
+    stores = (args.hotels, args.customers, args.reservations)
+
+    start = time.perf_counter()
+    if args.repair:
+        result = repair(*stores, args.partitions)
+        issues = result["issues"]
+        print(f"Found: {_summary(issues)}")
+        print(f"Repaired: {result['duplicates_removed']} duplicates "
+              f"removed, {result['rooms_released']} rooms released, "
+              f"{result['rooms_reserved']} rooms reserved, "
+              f"{result['reservations_deleted']} reservations deleted")
+        remaining = list(check(*stores, args.partitions))
+    else:
+        issues = remaining = list(check(*stores, args.partitions))
+    seconds = time.perf_counter() - start
+    print(f"Issues: {_summary(remaining)} in {seconds:.2f} s")
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            for issue in issues:
+                f.write(json.dumps(issue, default=str))
+                f.write("\n")
+    return 1 if remaining else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
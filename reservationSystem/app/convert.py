@@ -0,0 +1,73 @@
+"""
+convert.py
+
+This module converts the persistence files between the newline-delimited
+JSON format used in ndjson mode and the formats written by the codecs:
+indented JSON, compact JSON, gzip-compressed JSON and pickle. Each file is
+streamed one record at a time through a temporary file, so memory use
+does not depend on the size of the file, except when writing pickle. Any
+journal kept next to a file is folded into the converted file. Pickle
+files are only read while the pickle codec is selected, so converting one
+to another format needs RESERVATION_CODEC=pickle.
+
+Usage:
+    python -m app.convert --to ndjson
+    python -m app.convert --to json json/customers.json
+    python -m app.convert --to gzip-json
+    RESERVATION_CODEC=pickle python -m app.convert --to json
+"""
+
+import argparse
+
+from app.persistence import (
+    CODECS,
+    NDJSON_FORMAT,
+    convert_file,
+    HOTEL_FILE,
+    CUSTOMER_FILE,
+    RESERVATION_FILE,
+)
+
+# Files converted by default.
+FILES = (HOTEL_FILE, CUSTOMER_FILE, RESERVATION_FILE)
+
+
+def convert(file_paths=None, ndjson=True, codec=None):
+    """
+    Convert persistence files to the given format.
+
+    Args:
+        file_paths (iterable, optional): Paths of the files to convert.
+            Defaults to FILES.
+        ndjson (bool, optional): True to convert to newline-delimited JSON,
+            False to convert to the format of a codec.
+        codec (str, optional): Name of the codec to convert to. Defaults
+            to the current codec.
+    """
+    for file_path in file_paths or FILES:
+        convert_file(file_path, ndjson, codec)
+
+
+def main(argv=None):
+    """
+    Run the conversion from the command line.
+
+    Args:
+        argv (list, optional): Command-line arguments.
+    """
+    parser = argparse.ArgumentParser(
+        description="Convert the persistence files between formats.")
+    parser.add_argument("file_paths", nargs="*", help="files to convert")
+    parser.add_argument("--to", choices=(NDJSON_FORMAT, *CODECS),
+                        default=NDJSON_FORMAT)
+    args = parser.parse_args(argv)
+    if args.to == NDJSON_FORMAT:
+        convert(args.file_paths)
+    else:
+        convert(args.file_paths, ndjson=False, codec=args.to)
+    for file_path in args.file_paths or FILES:
+        print(f"{file_path}: converted to {args.to}")
+
+
+if __name__ == "__main__":
+    main()
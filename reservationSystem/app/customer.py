@@ -5,7 +5,28 @@ This module defines the Customer class which represents a customer entity
 with operations to create, modify, display, and delete customer records.
 """
 
-from app.persistence import load_data, save_data, CUSTOMER_FILE
+from app.persistence import CUSTOMER_FILE
+from app.metrics import timed
+from app.events import CUSTOMER_CREATED, CUSTOMER_MODIFIED
+from app.records import CompactRecord, encode
+from app.repository import get_repository
+from app.transaction import Transaction, inserter
+
+
+class _CustomerRecord(CompactRecord):
+    """
+    The in-memory form of a stored customer record.
+    """
+
+    __slots__ = FIELDS = ("customer_id", "name", "email", "phone")
+
+
+def _customers():
+    """
+    Return the shared repository of customer records.
+    """
+    return get_repository(CUSTOMER_FILE, "customer_id",
+                          _CustomerRecord.from_dict, encode)
 
 
 class Customer:
@@ -13,12 +34,15 @@ class Customer:
     A class representing a customer.
     """
 
+    __slots__ = ("customer_id", "name", "email", "phone")
+
     def __init__(self, customer_id, name, email, phone):
         """
         Initialize a Customer instance.
 
         Args:
-            customer_id (int): Unique identifier for the customer.
+            customer_id (int): Unique identifier for the customer, or None
+                to have one given when it is created.
             name (str): Name of the customer.
             email (str): Email address.
             phone (str): Phone number.
@@ -61,33 +85,89 @@ class Customer:
         )
 
     @staticmethod
+    @timed("Customer.create_customer")
     def create_customer(customer):
         """
-        Create a new customer and store it persistently.
+        Create a new customer and store it persistently. A customer without
+        an ID is given a new one.
 
         Args:
-            customer (Customer): The Customer instance to be added.
+            customer (Customer): The Customer instance to be added. Its
+                customer_id is set if it had none.
+
+        Returns:
+            bool: True if the customer was created, False if its ID is
+            already taken.
+        """
+        if Customer.create_customers([customer])[0]:
+            return True
+        print("Customer ID already exists.")
+        return False
+
+    @staticmethod
+    @timed("Customer.create_customers")
+    def create_customers(customers):
+        """
+        Create several customers and store them with a single write.
+        Customers without an ID are given a new one.
+
+        Args:
+            customers (iterable): The Customer instances to be added. Their
+                customer_id is set if they had none.
+
+        Returns:
+            list: One bool per customer, True if it was created and False
+            if its ID is already taken.
         """
-        customers = load_data(CUSTOMER_FILE)
-        customers.append(customer.to_dict())
-        save_data(CUSTOMER_FILE, customers)
+        customers = list(customers)
+        ids = _customers().create_many(
+            (customer.to_dict() for customer in customers),
+            inserter(_customers(), CUSTOMER_CREATED))
+        for customer, customer_id in zip(customers, ids):
+            if customer_id is not None:
+                customer.customer_id = customer_id
+        return [customer_id is not None for customer_id in ids]
 
     @staticmethod
-    def delete_customer(customer_id):
+    @timed("Customer.delete_customer")
+    def delete_customer(customer_id, on_delete="cascade"):
         """
         Delete a customer by its ID.
 
         Args:
             customer_id (int): The ID of the customer to delete.
+            on_delete (str, optional): "cascade" to cancel the customer's
+                reservations with it, or "restrict" to keep the customer if
+                it has any.
+
+        Returns:
+            bool: True if the customer was found and deleted, else False.
+        """
+        return bool(Customer.delete_customers([customer_id], on_delete))
+
+    @staticmethod
+    @timed("Customer.delete_customers")
+    def delete_customers(customer_ids, on_delete="cascade"):
+        """
+        Delete several customers, and with "cascade" their reservations, in
+        a single transaction.
+
+        Args:
+            customer_ids (iterable): The IDs of the customers to delete.
+            on_delete (str, optional): "cascade" to cancel the customers'
+                reservations with them, or "restrict" to keep the customers
+                that have any.
+
+        Returns:
+            list: The IDs of the customers that were found and deleted.
         """
-        customers = load_data(CUSTOMER_FILE)
-        customers = [
-            c for c in customers
-            if c.get("customer_id") != customer_id
-        ]
-        save_data(CUSTOMER_FILE, customers)
+        # Imported here because the reservation module imports this one.
+        from app.reservation import delete_with_reservations
+        return delete_with_reservations(
+            _customers(), "customer", customer_ids, on_delete)
 
     @staticmethod
+    @timed("Customer.display_customer")
     def display_customer(customer_id):
         """
         Display information for a customer with the given ID.
@@ -98,24 +178,39 @@ class Customer:
         Returns:
             dict or None: Customer information if found, else None.
         """
-        customers = load_data(CUSTOMER_FILE)
-        for customer in customers:
-            if customer.get("customer_id") == customer_id:
-                return customer
-        return None
+        return _customers().get(customer_id)
 
     @staticmethod
+    @timed("Customer.modify_customer")
     def modify_customer(customer_id, new_data):
         """
         Modify the information of an existing customer.
 
         Args:
             customer_id (int): The ID of the customer to modify.
-            new_data (dict): A dictionary of attributes to update.
-        """
-        customers = load_data(CUSTOMER_FILE)
-        for customer in customers:
-            if customer.get("customer_id") == customer_id:
-                customer.update(new_data)
-                break
-        save_data(CUSTOMER_FILE, customers)
+            new_data (dict): A dictionary of attributes to update. It
+                may not change the customer ID.
+        """
+        if new_data.get("customer_id", customer_id) != customer_id:
+            print("Customer ID cannot be changed.")
+            return
+        Customer.modify_customers({customer_id: new_data})
+
+    @staticmethod
+    @timed("Customer.modify_customers")
+    def modify_customers(patches):
+        """
+        Modify several existing customers with a single write.
+
+        Args:
+            patches (dict): Maps each customer ID to a dictionary of
+                attributes to update. Patches that would change the customer
+                ID are ignored.
+
+        Returns:
+            list: The IDs of the customers that were found and updated.
+        """
+        with Transaction() as transaction:
+            updated = transaction.stage(_customers()).update_many(patches)
+            transaction.emit(CUSTOMER_MODIFIED, _customers(), updated)
+        return updated
@@ -0,0 +1,671 @@
+"""
+events.py
+
+This module provides the change feed: typed events emitted when hotels,
+customers and reservations are created, modified, deleted, reserved or
+canceled, so caches and other services can follow the stores instead of
+re-reading them.
+
+Every event carries a sequence number, increasing by one with each event,
+the ID of the record it is about, and the state of that record, in stored
+form, as the change left it, or None if the record no longer exists.
+
+Operations emit their events through the transaction that makes their
+changes (see transaction.py). The events are written to the transaction's
+commit log along with the records, so they are durable together, and are
+sequenced when the stores are written, while the records are still
+locked: the events of a record are numbered in the order its changes
+committed, and a consumer that applies events in sequence order always
+ends with the latest state. A transaction replayed by recover() appends
+its events to the log unless they are there already.
+
+Inside the process, subscribers register a callback, called with each
+event, in order, by a dispatcher thread. Events wait for the dispatcher in
+a bounded queue: when it is full, emitting operations block until the
+subscribers catch up. Callbacks may themselves change the stores; events
+they emit are queued without blocking.
+
+Events may also be appended to a log file, one JSON line per event, with
+sequence numbers shared by every process writing to the log. Other
+processes tail the log with EventLog.read, resuming from the offset
+returned by their previous read instead of rescanning the stores.
+
+The feed is disabled by default; while disabled an operation costs one
+lookup per emit call. It is enabled with enable(), by subscribing,
+or by setting the RESERVATION_EVENT_LOG environment variable to the path
+of the log.
+"""
+
+import itertools
+import json
+import os
+import threading
+import time
+
+from app.locking import store_lock
+
+# Event types.
+HOTEL_CREATED = "hotel.created"
+HOTEL_MODIFIED = "hotel.modified"
+HOTEL_DELETED = "hotel.deleted"
+ROOM_RESERVED = "hotel.room_reserved"
+ROOM_RELEASED = "hotel.room_released"
+CUSTOMER_CREATED = "customer.created"
+CUSTOMER_MODIFIED = "customer.modified"
+CUSTOMER_DELETED = "customer.deleted"
+RESERVATION_CREATED = "reservation.created"
+RESERVATION_CANCELED = "reservation.canceled"
+
+# Largest number of events waiting for the subscribers.
+QUEUE_SIZE = 10000
+
+
+class _Active:
+    """
+    Holds the active feed, or None while the feed is disabled.
+    """
+
+    __slots__ = ("feed", "lock")
+
+    def __init__(self):
+        self.feed = None
+        self.lock = threading.Lock()
+
+
+_ACTIVE = _Active()
+
+
+class Event:
+    """
+    A change made to a record.
+    """
+
+    __slots__ = ("sequence", "type", "record_id", "record", "details",
+                 "time", "transaction")
+
+    def __init__(self, sequence, event_type, record_id, record=None,
+                 details=None, timestamp=None):
+        """
+        Initialize an Event instance.
+
+        Args:
+            sequence (int): Position of the event in the feed.
+            event_type (str): One of the event types, such as
+                HOTEL_CREATED.
+            record_id: The ID of the record.
+            record (dict, optional): The state of the record after the
+                change, or None if it no longer existed.
+            details (dict, optional): Details of the change, such as the
+                reservation_id of ROOM_RESERVED and ROOM_RELEASED events.
+            timestamp (float, optional): Time of the event, in seconds
+                since the epoch. Defaults to now.
+        """
+        self.sequence = sequence
+        self.type = event_type
+        self.record_id = record_id
+        self.record = record
+        self.details = details
+        self.time = time.time() if timestamp is None else timestamp
+        # ID of the logged transaction that emitted the event, if any.
+        self.transaction = None
+
+    def to_dict(self):
+        """
+        Convert the Event instance to a dictionary.
+
+        Returns:
+            dict: The event, as written to the log.
+        """
+        data = {
+            "sequence": self.sequence,
+            "type": self.type,
+            "id": self.record_id,
+            "record": self.record,
+            "details": self.details,
+            "time": self.time,
+        }
+        if self.transaction is not None:
+            data["transaction"] = self.transaction
+        return data
+
+    @staticmethod
+    def from_dict(data):
+        """
+        Create an Event instance from a dictionary.
+
+        Args:
+            data (dict): The event, as written to the log.
+
+        Returns:
+            Event: A new Event instance.
+        """
+        event = Event(
+            data["sequence"],
+            data["type"],
+            data.get("id"),
+            data.get("record"),
+            data.get("details"),
+            data.get("time"),
+        )
+        event.transaction = data.get("transaction")
+        return event
+
+    def __repr__(self):
+        """
+        Return a short representation of the event.
+        """
+        return f"Event({self.sequence}, {self.type!r}, {self.record_id!r})"
+
+
+def _decode_line(path, line):
+    """
+    Decode one log line, returning None for blank or damaged lines.
+    """
+    if not line.strip():
+        return None
+    try:
+        return Event.from_dict(json.loads(line))
+    except (json.JSONDecodeError, UnicodeDecodeError, KeyError,
+            TypeError) as e:
+        print(f"Error reading {path}: {e}")
+        return None
+
+
+class EventLog:
+    """
+    An append-only file of events, shared by several processes.
+
+    Writers take the log's store lock to number and append their events,
+    so sequence numbers never repeat across processes.
+    """
+
+    def __init__(self, path):
+        """
+        Initialize an EventLog instance.
+
+        Args:
+            path (str): Path of the log file.
+        """
+        self.path = path
+        # (size, inode, sequence) of the log after this process last wrote
+        # to it.
+        self._tail = None
+
+    def last_sequence(self):
+        """
+        Return the sequence number of the last event in the log.
+
+        Returns:
+            int: The last sequence number, or 0 if the log is empty.
+        """
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return 0
+        if self._tail and self._tail[:2] == (stat.st_size, stat.st_ino):
+            return self._tail[2]
+        block = 4096
+        with open(self.path, "rb") as f:
+            while True:
+                start = max(0, stat.st_size - block)
+                f.seek(start)
+                lines = f.read(stat.st_size - start).splitlines()
+                # The first line of a block may be cut.
+                for line in reversed(lines[1:] if start else lines):
+                    event = _decode_line(self.path, line)
+                    if event is not None:
+                        return event.sequence
+                if not start:
+                    return 0
+                block *= 4
+
+    def append(self, build, transaction=None, after=None):
+        """
+        Number new events and append them to the log with a single write.
+
+        Args:
+            build (callable): Called with the last sequence number in the
+                log, returns the events to append, numbered from the next
+                one. It runs under the log's lock.
+            transaction (str, optional): ID of the logged transaction
+                the events belong to. They are tagged with it, and an
+                error writing them is raised rather than printed, so the
+                transaction is recovered.
+            after (int, optional): Offset of the log when the transaction
+                was logged. If given, nothing is appended when the log
+                holds events of the transaction after it, as when the
+                transaction is replayed.
+
+        Returns:
+            list: The events returned by build, or an empty list if they
+            were appended already.
+
+        Raises:
+            OSError: If the events of a transaction cannot be written.
+        """
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with store_lock(self.path):
+            if after is not None and any(
+                    event.transaction == transaction
+                    for event, _ in self._read_lines(after, None)[0]):
+                return []
+            events = build(self.last_sequence())
+            if not events:
+                return events
+            for event in events:
+                event.transaction = transaction
+            data = "".join(
+                json.dumps(event.to_dict(), separators=(",", ":")) + "\n"
+                for event in events
+            ).encode("utf-8")
+            try:
+                fd = os.open(self.path,
+                             os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
+                try:
+                    size = os.fstat(fd).st_size
+                    # Start on a fresh line if an earlier append was
+                    # interrupted.
+                    if size and os.pread(fd, 1, size - 1) != b"\n":
+                        data = b"\n" + data
+                    os.write(fd, data)
+                    stat = os.fstat(fd)
+                    self._tail = (stat.st_size, stat.st_ino,
+                                  events[-1].sequence)
+                finally:
+                    os.close(fd)
+            except OSError as e:
+                if transaction is not None:
+                    raise
+                print(f"Error writing to {self.path}: {e}")
+            return events
+
+    def size(self):
+        """
+        Return the size of the log, the offset its next event starts at.
+
+        Returns:
+            int: The size in bytes, 0 if the log does not exist.
+        """
+        try:
+            return os.path.getsize(self.path)
+        except FileNotFoundError:
+            return 0
+
+    def _read_lines(self, offset, limit):
+        """
+        Return the (event, offset after it) pairs of the complete lines
+        after an offset, and the offset after the last line read.
+        """
+        try:
+            with open(self.path, "rb") as f:
+                f.seek(offset)
+                data = f.read()
+        except OSError:
+            return [], offset
+        events = []
+        position = 0
+        while limit is None or len(events) < limit:
+            end = data.find(b"\n", position)
+            if end < 0:
+                break
+            event = _decode_line(self.path, data[position:end])
+            position = end + 1
+            if event is not None:
+                events.append((event, offset + position))
+        return events, offset + position
+
+    def read(self, offset=0, limit=None):
+        """
+        Read the events appended after an offset.
+
+        Args:
+            offset (int, optional): Offset in bytes to read from, 0 or the
+                offset returned by a previous read.
+            limit (int, optional): Largest number of events to return.
+
+        Returns:
+            tuple: (events, offset), where offset is where the next read
+            should resume. A line still being written is left for it.
+        """
+        events, offset = self._read_lines(offset, limit)
+        return [event for event, _ in events], offset
+
+    def follow(self, offset=0, poll_interval=0.1):
+        """
+        Yield the events appended after an offset, waiting for new ones.
+
+        Args:
+            offset (int, optional): Offset in bytes to start from.
+            poll_interval (float, optional): Seconds to wait before
+                reading again when there are no new events.
+
+        Yields:
+            tuple: (event, offset) pairs, where offset is where to resume
+            after the event.
+        """
+        while True:
+            events, offset = self._read_lines(offset, None)
+            if not events:
+                time.sleep(poll_interval)
+            yield from events
+
+
+class _Subscription:
+    """
+    A callback registered with a ChangeFeed.
+    """
+
+    __slots__ = ("callback", "types")
+
+    def __init__(self, callback, types):
+        self.callback = callback
+        self.types = frozenset(types) if types is not None else None
+
+
+class ChangeFeed:
+    """
+    Numbers the events of this process, appends them to an optional log
+    and delivers them to subscribers.
+    """
+
+    def __init__(self, log_path=None, queue_size=QUEUE_SIZE):
+        """
+        Initialize a ChangeFeed instance.
+
+        Args:
+            log_path (str, optional): Path of the event log. Defaults to
+                no log, with sequence numbers local to the process.
+            queue_size (int, optional): Largest number of events waiting
+                for the subscribers.
+        """
+        self.log = EventLog(log_path) if log_path else None
+        self.queue_size = queue_size
+        self._last_sequence = 0
+        self._subscriptions = ()
+        self._queue = []
+        self._delivering = False
+        self._closed = False
+        self._dispatcher = None
+        # Orders sequencing; the condition guards the queue.
+        self._lock = threading.Lock()
+        self._condition = threading.Condition()
+
+    def subscribe(self, callback, types=None):
+        """
+        Call a function with every event emitted from now on.
+
+        Args:
+            callback (callable): Called with each Event, in order, from
+                the dispatcher thread. Errors it raises are printed.
+            types (iterable, optional): Event types to deliver. Defaults
+                to every type.
+
+        Returns:
+            The subscription, to pass to unsubscribe.
+        """
+        subscription = _Subscription(callback, types)
+        with self._condition:
+            self._subscriptions += (subscription,)
+            if self._dispatcher is None:
+                self._dispatcher = threading.Thread(
+                    target=self._dispatch, name="change-feed", daemon=True)
+                self._dispatcher.start()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """
+        Stop delivering events to a subscriber.
+
+        Args:
+            subscription: A value returned by subscribe.
+        """
+        with self._condition:
+            self._subscriptions = tuple(
+                s for s in self._subscriptions if s is not subscription)
+
+    def emit(self, changes):
+        """
+        Sequence events, append them to the log and queue them for the
+        subscribers, blocking while the queue is full.
+
+        Args:
+            changes (iterable): (event_type, repository, record_id,
+                details) tuples. The state of each record is read from
+                its repository when the event is sequenced.
+
+        Returns:
+            list: The new events.
+        """
+        changes = list(changes)
+        if not changes:
+            return []
+        self.wait_for_room()
+
+        def build(sequence):
+            return [
+                Event(sequence + number, event_type, record_id,
+                      repository.get(record_id), details)
+                for number, (event_type, repository, record_id, details)
+                in enumerate(changes, 1)
+            ]
+
+        return self._sequence(build)
+
+    def append(self, events, transaction=None, after=None):
+        """
+        Sequence events built already, such as those of a transaction
+        whose records are being written, append them to the log and queue
+        them for the subscribers, without blocking.
+
+        Args:
+            events (list): The Event instances, numbered here.
+            transaction (str, optional): ID of the logged transaction the
+                events belong to. See EventLog.append.
+            after (int, optional): Offset of the log when the transaction
+                was logged. See EventLog.append.
+
+        Returns:
+            list: The events, or an empty list if they were logged
+            already.
+
+        Raises:
+            OSError: If the events of a transaction cannot be logged.
+        """
+        if not events:
+            return []
+
+        def build(sequence):
+            for number, event in enumerate(events, 1):
+                event.sequence = sequence + number
+            return events
+
+        return self._sequence(build, transaction, after)
+
+    def _sequence(self, build, transaction=None, after=None):
+        """
+        Number the events returned by build, append them to the log and
+        queue them for the subscribers.
+        """
+        with self._lock:
+            if self.log is not None:
+                events = self.log.append(build, transaction, after)
+            else:
+                events = build(self._last_sequence)
+            if not events:
+                return events
+            self._last_sequence = events[-1].sequence
+            with self._condition:
+                if self._subscriptions:
+                    self._queue.extend(events)
+                    self._condition.notify_all()
+        return events
+
+    def wait_for_room(self):
+        """
+        Block until the queue has room, unless called by the dispatcher.
+
+        It must not be called while holding locks that subscribers may
+        need, such as those of a transaction.
+        """
+        if threading.current_thread() is self._dispatcher:
+            return
+        with self._condition:
+            while (len(self._queue) >= self.queue_size
+                   and not self._closed):
+                self._condition.wait()
+
+    def _dispatch(self):
+        """
+        Deliver queued events to the subscribers until the feed closes.
+        """
+        while True:
+            with self._condition:
+                while not self._queue and not self._closed:
+                    self._condition.wait()
+                if not self._queue:
+                    return
+                events = self._queue
+                self._queue = []
+                self._delivering = True
+                subscriptions = self._subscriptions
+                # Producers blocked on a full queue may go on.
+                self._condition.notify_all()
+            for event in events:
+                for subscription in subscriptions:
+                    if (subscription.types is not None
+                            and event.type not in subscription.types):
+                        continue
+                    try:
+                        subscription.callback(event)
+                    except Exception as e:  # pylint: disable=broad-except
+                        print(f"Error in event subscriber: {e}")
+            with self._condition:
+                self._delivering = False
+                self._condition.notify_all()
+
+    def flush(self, timeout=None):
+        """
+        Wait until every queued event has been delivered.
+
+        Args:
+            timeout (float, optional): Seconds to wait at most.
+
+        Returns:
+            bool: True if the queue was drained in time.
+        """
+        with self._condition:
+            return self._condition.wait_for(
+                lambda: not self._queue and not self._delivering, timeout)
+
+    def close(self):
+        """
+        Deliver the queued events and stop the dispatcher thread.
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+            dispatcher = self._dispatcher
+        if (dispatcher is not None
+                and dispatcher is not threading.current_thread()):
+            dispatcher.join()
+
+
+def enable(log_path=None, queue_size=QUEUE_SIZE):
+    """
+    Start emitting events, replacing the active feed if there is one.
+
+    Args:
+        log_path (str, optional): Path of the event log. Defaults to no
+            log.
+        queue_size (int, optional): Largest number of events waiting for
+            the subscribers.
+
+    Returns:
+        ChangeFeed: The new feed.
+    """
+    feed = ChangeFeed(log_path, queue_size)
+    with _ACTIVE.lock:
+        previous, _ACTIVE.feed = _ACTIVE.feed, feed
+    if previous is not None:
+        previous.close()
+    return feed
+
+
+def disable():
+    """
+    Stop emitting events, after delivering those already queued.
+    """
+    with _ACTIVE.lock:
+        previous, _ACTIVE.feed = _ACTIVE.feed, None
+    if previous is not None:
+        previous.close()
+
+
+def get_feed():
+    """
+    Return the active feed.
+
+    Returns:
+        ChangeFeed or None: The feed, or None while disabled.
+    """
+    return _ACTIVE.feed
+
+
+def subscribe(callback, types=None):
+    """
+    Subscribe to the active feed, enabling it without a log if needed. See
+    ChangeFeed.subscribe.
+
+    Args:
+        callback (callable): Called with each Event.
+        types (iterable, optional): Event types to deliver.
+
+    Returns:
+        The subscription, to pass to unsubscribe.
+    """
+    with _ACTIVE.lock:
+        if _ACTIVE.feed is None:
+            _ACTIVE.feed = ChangeFeed()
+        feed = _ACTIVE.feed
+    return feed.subscribe(callback, types)
+
+
+def unsubscribe(subscription):
+    """
+    Stop delivering events of the active feed to a subscriber.
+
+    Args:
+        subscription: A value returned by subscribe.
+    """
+    feed = _ACTIVE.feed
+    if feed is not None:
+        feed.unsubscribe(subscription)
+
+
+def emit(event_type, repository, record_ids, details=None):
+    """
+    Emit one event per record, if the feed is enabled. The state of each
+    record is read when its event is sequenced, so operations that change
+    records emit their events through their transaction instead (see
+    Transaction.emit).
+
+    Args:
+        event_type (str): The type of the events.
+        repository (Repository): The repository holding the records.
+        record_ids (iterable): The IDs of the changed records.
+        details (iterable, optional): The details of each event, in the
+            order of the IDs. Defaults to None for every event.
+    """
+    feed = _ACTIVE.feed
+    if feed is None:
+        return
+    if details is None:
+        details = itertools.repeat(None)
+    feed.emit(
+        (event_type, repository, record_id, detail)
+        for record_id, detail in zip(record_ids, details)
+    )
+
+
+if os.environ.get("RESERVATION_EVENT_LOG"):
+    enable(os.environ["RESERVATION_EVENT_LOG"])
@@ -4,9 +4,151 @@ hotel.py
 This module defines the Hotel class which represents a hotel entity
 with operations to create, modify, display, and delete hotel records,
 as well as to reserve and cancel room reservations.
+
+A reservation either holds a room on every night, or only on the nights
+of a stay from check_in to check_out. Stays are stored in the hotel record
+as [reservation_id, check_in, check_out] entries under "stays".
 """
 
-from app.persistence import load_data, save_data, HOTEL_FILE
+import sys
+
+from app.persistence import HOTEL_FILE
+from app.metrics import timed
+from app.events import (
+    HOTEL_CREATED,
+    HOTEL_MODIFIED,
+    ROOM_RELEASED,
+    ROOM_RESERVED,
+)
+from app.repository import get_repository
+from app.indexes import GroupedRangeIndex
+from app.occupancy import Occupancy
+from app.transaction import Transaction, in_transaction, inserter
+
+# Group under which every hotel is indexed, whatever its location.
+ANY_LOCATION = object()
+
+
+def decode_hotel(data):
+    """
+    Convert a stored hotel record to its in-memory form, in which
+    reserved_rooms is an Occupancy that also holds the stays.
+
+    Args:
+        data (dict): The hotel record as stored.
+
+    Returns:
+        dict: A new in-memory hotel record.
+    """
+    record = dict(data)
+    if isinstance(record.get("location"), str):
+        # Many hotels share a location, so they share one string too.
+        record["location"] = sys.intern(record["location"])
+    if "reserved_rooms" in record or "stays" in record:
+        record["reserved_rooms"] = Occupancy.from_list(
+            record.get("reserved_rooms") or [], record.pop("stays", None))
+    return record
+
+
+def encode_hotel(record):
+    """
+    Convert an in-memory hotel record to its stored form.
+
+    Args:
+        record (dict): The in-memory hotel record.
+
+    Returns:
+        dict: A new hotel record, as stored.
+    """
+    data = dict(record)
+    if "reserved_rooms" in data:
+        occupancy = data["reserved_rooms"]
+        data["reserved_rooms"] = occupancy.to_list()
+        stays = occupancy.stays_to_list()
+        if stays:
+            data["stays"] = stays
+    return data
+
+
+def hotel_occupancy(hotel):
+    """
+    Return the Occupancy of an in-memory hotel record, adding an empty one
+    if the record has none.
+
+    Args:
+        hotel (dict): The in-memory hotel record.
+
+    Returns:
+        Occupancy: The rooms and stays held by the hotel.
+    """
+    if "reserved_rooms" not in hotel:
+        hotel["reserved_rooms"] = Occupancy()
+    return hotel["reserved_rooms"]
+
+
+def reserve_stay(hotel, reservation_id, check_in=None, check_out=None):
+    """
+    Reserve a room of an in-memory hotel record for a reservation, if one
+    is free on every night of the stay.
+
+    Args:
+        hotel (dict): The in-memory hotel record, changed in place.
+        reservation_id (int): The reservation ID to add.
+        check_in (date or str, optional): Arrival date of the stay.
+        check_out (date or str, optional): Departure date of the stay.
+            Without dates, the room is held on every night.
+
+    Returns:
+        bool: True if the room was reserved.
+    """
+    return hotel_occupancy(hotel).reserve(
+        reservation_id, hotel.get("total_rooms", 0), check_in, check_out)
+
+
+def _availability_keys(hotel):
+    """
+    Return the (location, free rooms) pairs a hotel is indexed under.
+    """
+    occupancy = hotel.get("reserved_rooms") or Occupancy()
+    free_rooms = occupancy.free_rooms(hotel.get("total_rooms", 0))
+    return (
+        (hotel.get("location"), free_rooms),
+        (ANY_LOCATION, free_rooms),
+    )
+
+
+def _emit_requests(transaction, event_type, requests, results):
+    """
+    Emit an event for each successful reservation or cancellation.
+
+    Args:
+        transaction (Transaction): The transaction making the changes.
+        event_type (str): ROOM_RESERVED or ROOM_RELEASED.
+        requests (list): Tuples starting with (hotel_id, reservation_id).
+        results (list): One bool per request, True if it succeeded.
+    """
+    done = [request for request, result in zip(requests, results)
+            if result]
+    transaction.emit(
+        event_type, _hotels(), [request[0] for request in done],
+        [{"reservation_id": request[1]} for request in done])
+
+
+def _indexes():
+    """
+    Return the secondary indexes maintained over the hotel records.
+    """
+    return {
+        "availability": GroupedRangeIndex(_availability_keys, daily=True),
+    }
+
+
+def _hotels():
+    """
+    Return the shared repository of hotel records.
+    """
+    return get_repository(HOTEL_FILE, "hotel_id", decode_hotel,
+                          encode_hotel, _indexes)
 
 
 class Hotel:
@@ -14,6 +156,9 @@ class Hotel:
     A class representing a hotel.
     """
 
+    __slots__ = ("hotel_id", "name", "location", "total_rooms",
+                 "reserved_rooms")
+
     def __init__(self,
                  hotel_id,
                  name,
@@ -24,7 +169,8 @@ class Hotel:
         Initialize a Hotel instance.
 
         Args:
-            hotel_id (int): Unique identifier for the hotel.
+            hotel_id (int): Unique identifier for the hotel, or None
+                to have one given when it is created.
             name (str): Name of the hotel.
             location (str): Location of the hotel.
             total_rooms (int): Total number of rooms.
@@ -76,30 +222,89 @@ class Hotel:
         )
 
     @staticmethod
+    @timed("Hotel.create_hotel")
     def create_hotel(hotel):
         """
-        Create a new hotel and store it persistently.
+        Create a new hotel and store it persistently. A hotel without an ID
+        is given a new one.
+
+        Args:
+            hotel (Hotel): The Hotel instance to be added. Its hotel_id is
+                set if it had none.
+
+        Returns:
+            bool: True if the hotel was created, False if its ID is
+            already taken.
+        """
+        if Hotel.create_hotels([hotel])[0]:
+            return True
+        print("Hotel ID already exists.")
+        return False
+
+    @staticmethod
+    @timed("Hotel.create_hotels")
+    def create_hotels(hotels):
+        """
+        Create several hotels and store them with a single write. Hotels
+        without an ID are given a new one.
 
         Args:
-            hotel (Hotel): The Hotel instance to be added.
+            hotels (iterable): The Hotel instances to be added. Their
+                hotel_id is set if they had none.
+
+        Returns:
+            list: One bool per hotel, True if it was created and False if
+            its ID is already taken.
         """
-        hotels = load_data(HOTEL_FILE)
-        hotels.append(hotel.to_dict())
-        save_data(HOTEL_FILE, hotels)
+        hotels = list(hotels)
+        ids = _hotels().create_many(
+            (hotel.to_dict() for hotel in hotels),
+            inserter(_hotels(), HOTEL_CREATED))
+        for hotel, hotel_id in zip(hotels, ids):
+            if hotel_id is not None:
+                hotel.hotel_id = hotel_id
+        return [hotel_id is not None for hotel_id in ids]
 
     @staticmethod
-    def delete_hotel(hotel_id):
+    @timed("Hotel.delete_hotel")
+    def delete_hotel(hotel_id, on_delete="cascade"):
         """
         Delete a hotel by its ID.
 
         Args:
             hotel_id (int): The ID of the hotel to delete.
+            on_delete (str, optional): "cascade" to cancel the hotel's
+                reservations with it, or "restrict" to keep the hotel if
+                it has any.
+
+        Returns:
+            bool: True if the hotel was found and deleted, else False.
         """
-        hotels = load_data(HOTEL_FILE)
-        hotels = [h for h in hotels if h.get("hotel_id") != hotel_id]
-        save_data(HOTEL_FILE, hotels)
+        return bool(Hotel.delete_hotels([hotel_id], on_delete))
 
     @staticmethod
+    @timed("Hotel.delete_hotels")
+    def delete_hotels(hotel_ids, on_delete="cascade"):
+        """
+        Delete several hotels, and with "cascade" their reservations, in a
+        single transaction.
+
+        Args:
+            hotel_ids (iterable): The IDs of the hotels to delete.
+            on_delete (str, optional): "cascade" to cancel the hotels'
+                reservations with them, or "restrict" to keep the hotels
+                that have any.
+
+        Returns:
+            list: The IDs of the hotels that were found and deleted.
+        """
+        # Imported here because the reservation module imports this one.
+        from app.reservation import delete_with_reservations
+        return delete_with_reservations(
+            _hotels(), "hotel", hotel_ids, on_delete)
+
+    @staticmethod
+    @timed("Hotel.display_hotel")
     def display_hotel(hotel_id):
         """
         Display information for a hotel with the given ID.
@@ -110,75 +315,203 @@ class Hotel:
         Returns:
             dict or None: Hotel information if found, else None.
         """
-        hotels = load_data(HOTEL_FILE)
-        for hotel in hotels:
-            if hotel.get("hotel_id") == hotel_id:
-                return hotel
-        return None
+        return _hotels().get(hotel_id)
 
     @staticmethod
+    @timed("Hotel.modify_hotel")
     def modify_hotel(hotel_id, new_data):
         """
         Modify the information of an existing hotel.
 
         Args:
             hotel_id (int): The ID of the hotel to modify.
-            new_data (dict): A dictionary of attributes to update.
+            new_data (dict): A dictionary of attributes to update. It
+                may not change the hotel ID.
         """
-        hotels = load_data(HOTEL_FILE)
-        for hotel in hotels:
-            if hotel.get("hotel_id") == hotel_id:
-                hotel.update(new_data)
-                break
-        save_data(HOTEL_FILE, hotels)
+        if new_data.get("hotel_id", hotel_id) != hotel_id:
+            print("Hotel ID cannot be changed.")
+            return
+        Hotel.modify_hotels({hotel_id: new_data})
 
     @staticmethod
-    def reserve_room(hotel_id, reservation_id):
+    @timed("Hotel.modify_hotels")
+    def modify_hotels(patches):
+        """
+        Modify several existing hotels with a single write.
+
+        Args:
+            patches (dict): Maps each hotel ID to a dictionary of
+                attributes to update. Patches that would change the hotel
+                ID are ignored.
+
+        Returns:
+            list: The IDs of the hotels that were found and updated.
+        """
+        with Transaction() as transaction:
+            updated = transaction.stage(_hotels()).update_many(patches)
+            transaction.emit(HOTEL_MODIFIED, _hotels(), updated)
+        return updated
+
+    @staticmethod
+    @timed("Hotel.search")
+    def search(location=None, min_free_rooms=1):
+        """
+        Find the hotels with at least a number of free rooms, optionally
+        in a given location.
+
+        The search uses an index kept up to date as hotels are created,
+        modified, deleted and reserved, so it takes time proportional to
+        the number of results. Rooms count as free only if they are free
+        on every night from today on; the index is rebuilt on the first
+        search of each day, as stays end.
+
+        Args:
+            location (str, optional): Location of the hotels. Defaults to
+                any location.
+            min_free_rooms (int, optional): Smallest number of free rooms.
+                Defaults to 1.
+
+        Returns:
+            list: Information of the matching hotels, those with the most
+            free rooms first.
+        """
+        group = ANY_LOCATION if location is None else location
+        return _hotels().find("availability", group, min_free_rooms)
+
+    @staticmethod
+    @timed("Hotel.is_available")
+    def is_available(hotel_id, check_in=None, check_out=None):
+        """
+        Check whether a room is free at a given hotel.
+
+        Args:
+            hotel_id (int): The ID of the hotel.
+            check_in (date or str, optional): Arrival date of the stay.
+            check_out (date or str, optional): Departure date of the stay.
+                Without dates, the room must be free on every night from
+                today on.
+
+        Returns:
+            bool: True if a room is free, False otherwise.
+        """
+        def available(hotel):
+            occupancy = hotel.get("reserved_rooms") or Occupancy()
+            return occupancy.has_room(
+                hotel.get("total_rooms", 0), check_in, check_out)
+
+        return bool(_hotels().read(hotel_id, available))
+
+    @staticmethod
+    @timed("Hotel.reserve_room")
+    def reserve_room(hotel_id, reservation_id, check_in=None, check_out=None):
         """
         Reserve a room at a given hotel by adding a reservation ID.
 
         Args:
             hotel_id (int): The ID of the hotel.
             reservation_id (int): The reservation ID to add.
+            check_in (date or str, optional): Arrival date of the stay.
+            check_out (date or str, optional): Departure date of the stay.
+                Without dates, the room is held on every night.
 
         Returns:
             bool: True if successful, False otherwise.
         """
-        hotels = load_data(HOTEL_FILE)
-        updated = False
-        for hotel in hotels:
-            if hotel.get("hotel_id") == hotel_id:
-                if (
-                    len(hotel.get("reserved_rooms", []))
-                    < hotel.get("total_rooms", 0)
-                ):
-                    hotel["reserved_rooms"].append(reservation_id)
-                    updated = True
-                else:
-                    print("No available rooms in this hotel.")
-                break
-        save_data(HOTEL_FILE, hotels)
-        return updated
+        def reserve(hotel):
+            total_rooms = hotel.get("total_rooms", 0)
+            occupancy = hotel_occupancy(hotel)
+            if not occupancy.has_room(total_rooms, check_in, check_out):
+                print("No available rooms in this hotel.")
+                return False
+            return occupancy.reserve(
+                reservation_id, total_rooms, check_in, check_out)
+
+        with Transaction() as transaction:
+            if not transaction.stage(_hotels()).mutate(hotel_id, reserve):
+                return False
+            transaction.emit(ROOM_RESERVED, _hotels(), [hotel_id],
+                             [{"reservation_id": reservation_id}])
+        return True
 
     @staticmethod
-    def cancel_reservation(hotel_id, reservation_id):
+    @timed("Hotel.cancel_reservation")
+    def cancel_reservation(hotel_id, reservation_id, transaction=None):
         """
         Cancel a reservation at a given hotel by removing the reservation ID.
 
         Args:
             hotel_id (int): The ID of the hotel.
             reservation_id (int): The reservation ID to remove.
+            transaction (Transaction, optional): Stage the change in this
+                transaction instead of writing it immediately.
 
         Returns:
             bool: True if successful, False otherwise.
         """
-        hotels = load_data(HOTEL_FILE)
-        updated = False
-        for hotel in hotels:
-            if hotel.get("hotel_id") == hotel_id:
-                if reservation_id in hotel.get("reserved_rooms", []):
-                    hotel["reserved_rooms"].remove(reservation_id)
-                    updated = True
-                break
-        save_data(HOTEL_FILE, hotels)
-        return updated
+        return Hotel.cancel_reservations([(hotel_id, reservation_id)],
+                                         transaction)[0]
+
+    @staticmethod
+    @timed("Hotel.cancel_reservations")
+    def cancel_reservations(requests, transaction=None):
+        """
+        Cancel several reservations with a single write.
+
+        Args:
+            requests (iterable): (hotel_id, reservation_id) pairs.
+            transaction (Transaction, optional): Stage the changes in this
+                transaction instead of writing them immediately.
+
+        Returns:
+            list: One bool per request, True if the reservation was found
+            and canceled.
+        """
+        def canceler(reservation_id):
+            def cancel(hotel):
+                return hotel_occupancy(hotel).cancel(reservation_id)
+            return cancel
+
+        requests = list(requests)
+        with in_transaction(transaction) as current:
+            hotels = current.stage(_hotels())
+            results = [bool(result) for result in hotels.mutate_many(
+                (hotel_id, canceler(reservation_id))
+                for hotel_id, reservation_id in requests
+            )]
+            _emit_requests(current, ROOM_RELEASED, requests, results)
+        return results
+
+    @staticmethod
+    @timed("Hotel.reserve_rooms")
+    def reserve_rooms(requests, transaction=None):
+        """
+        Reserve rooms for several reservations with a single write.
+
+        Requests are applied in order, so a hotel that runs out of rooms
+        part way through the batch rejects the remaining requests for it.
+
+        Args:
+            requests (iterable): (hotel_id, reservation_id) pairs, or
+                (hotel_id, reservation_id, check_in, check_out) tuples for
+                stays.
+            transaction (Transaction, optional): Stage the changes in this
+                transaction instead of writing them immediately.
+
+        Returns:
+            list: One bool per request, True if the room was reserved.
+        """
+        def reserver(reservation_id, check_in=None, check_out=None):
+            def reserve(hotel):
+                return reserve_stay(hotel, reservation_id, check_in,
+                                    check_out)
+            return reserve
+
+        requests = list(requests)
+        with in_transaction(transaction) as current:
+            hotels = current.stage(_hotels())
+            results = [bool(result) for result in hotels.mutate_many(
+                (request[0], reserver(*request[1:]))
+                for request in requests
+            )]
+            _emit_requests(current, ROOM_RESERVED, requests, results)
+        return results
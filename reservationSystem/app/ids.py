@@ -0,0 +1,142 @@
+"""
+ids.py
+
+This module defines IdAllocator, which hands out new integer record IDs
+for a store, so callers do not have to pick IDs themselves.
+
+Each store has a high-water mark, kept in a small file in a .ids directory
+next to the store: every ID below it may already have been handed out. An
+allocator reserves IDs a block at a time, by raising the mark under a file
+lock and flushing it to disk, and then hands out the IDs of its block
+without further coordination. Processes and threads therefore never
+receive the same ID, and an ID is never handed out twice, even after a
+crash; the unused rest of a block is simply skipped.
+
+Callers may still choose IDs themselves. The IDs handed out skip those
+already taken, and repositories check every new ID for uniqueness under
+their write lock (see Repository.insert_many).
+"""
+
+import os
+import threading
+
+from app.locking import store_lock
+
+# Directory, next to the stores, holding the high-water mark of each store.
+ID_DIRECTORY = ".ids"
+
+# Number of IDs reserved at a time.
+BLOCK_SIZE = 100
+
+# Allocators of this process, keyed by store.
+_allocators = {}
+_allocators_lock = threading.Lock()
+
+
+class IdAllocator:
+    """
+    Hands out unique integer IDs for one store.
+    """
+
+    def __init__(self, file_path, block_size=BLOCK_SIZE):
+        """
+        Initialize an IdAllocator instance.
+
+        Args:
+            file_path (str): Path identifying the store.
+            block_size (int, optional): Number of IDs reserved at a time.
+        """
+        directory, name = os.path.split(file_path)
+        self.path = os.path.join(directory or ".", ID_DIRECTORY,
+                                 f"{name}.next")
+        self.block_size = block_size
+        self._next = 0
+        self._limit = 0
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+
+    def _read_mark(self):
+        """
+        Return the persisted high-water mark, or None if there is none.
+        """
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return int(f.read())
+        except (OSError, ValueError):
+            return None
+
+    def _write_mark(self, mark):
+        """
+        Durably replace the persisted high-water mark.
+        """
+        temp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            f.write(str(mark))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.path)
+
+    def _reserve(self, count, first_free):
+        """
+        Reserve the next block of at least count IDs.
+
+        Args:
+            count (int): Minimum number of IDs to reserve.
+            first_free (callable): Returns the lowest ID above every
+                existing record. Only called for a store without a mark.
+        """
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with store_lock(self.path):
+            mark = self._read_mark()
+            if mark is None:
+                mark = first_free()
+            limit = mark + max(count, self.block_size)
+            self._write_mark(limit)
+        self._next = mark
+        self._limit = limit
+
+    def allocate(self, count, taken, first_free):
+        """
+        Hand out new IDs.
+
+        Args:
+            count (int): Number of IDs to hand out.
+            taken (callable): Called with an ID, returns True if a record
+                already uses it.
+            first_free (callable): Returns the lowest ID above every
+                existing record, used to start a store without a mark.
+
+        Returns:
+            list: count distinct IDs, in increasing order.
+        """
+        ids = []
+        with self._lock:
+            if self._pid != os.getpid():
+                # The block was inherited from the parent process.
+                self._pid = os.getpid()
+                self._next = self._limit = 0
+            while len(ids) < count:
+                if self._next >= self._limit:
+                    self._reserve(count - len(ids), first_free)
+                record_id = self._next
+                self._next += 1
+                if not taken(record_id):
+                    ids.append(record_id)
+        return ids
+
+
+def get_allocator(file_path):
+    """
+    Return the shared allocator of a store.
+
+    Args:
+        file_path (str): Path identifying the store.
+
+    Returns:
+        IdAllocator: The allocator of the store.
+    """
+    with _allocators_lock:
+        allocator = _allocators.get(file_path)
+        if allocator is None:
+            allocator = _allocators[file_path] = IdAllocator(file_path)
+        return allocator
@@ -0,0 +1,409 @@
+"""
+importer.py
+
+This module imports reservation feeds, CSV or NDJSON files with one
+booking per row, as partner channels send them. A feed is applied in bulk
+rather than row by row, and in a single transaction, so a feed is either
+imported or, if the import fails, not applied at all:
+
+1. The rows are streamed from the file and checked against a snapshot of
+   the stores: valid IDs, an existing hotel and customer, and a
+   reservation ID that is not taken. They are partitioned by hotel and
+   kept as compact tuples. Rows without a reservation ID are then given
+   one that no row of the feed uses.
+2. The partitions are spread over a process pool. Each worker checks the
+   dates of its rows and applies the capacity checks of
+   Hotel.reserve_room to a copy of each of its hotels, row by row in file
+   order, so throughput grows with the number of cores.
+3. The results are merged into the stores in a single transaction by
+   Reservation.merge_reservations. A hotel changed by another writer
+   since the snapshot was taken has its rows checked again, against its
+   current state, before they are committed.
+
+Rows that cannot be imported are returned, with the reason, and may be
+written to a CSV report.
+
+CSV feeds have a header row naming the columns reservation_id, hotel_id,
+customer_id, check_in and check_out; reservation_id and the dates may be
+empty. NDJSON feeds hold one JSON object per line with the same fields.
+
+Usage:
+    python -m app.importer feed.csv --report rejected.csv
+    python -m app.importer feed.ndjson --workers 8
+"""
+
+import argparse
+import concurrent.futures
+import csv
+import itertools
+import json
+import multiprocessing
+import os
+import time
+
+from app.hotel import decode_hotel, reserve_stay
+from app.reservation import NO_CUSTOMER, NO_ROOM, TAKEN, Reservation
+
+# Columns of a feed, in the order they are written to the report.
+FIELDS = ("reservation_id", "hotel_id", "customer_id", "check_in",
+          "check_out")
+
+# Number of tasks per worker, so partitions of uneven size balance out.
+TASKS_PER_WORKER = 4
+
+# Feeds with fewer rows are checked in this process, as starting the
+# workers would take longer than the checks.
+PARALLEL_ROWS = 20000
+
+_NO_HOTEL = "Hotel not found."
+
+
+def iter_rows(file_path, feed_format=None):
+    """
+    Stream the rows of a feed.
+
+    Args:
+        file_path (str): Path to the feed.
+        feed_format (str, optional): "csv" or "ndjson". Defaults to the
+            file's extension, CSV unless it ends in .ndjson or .jsonl.
+
+    Yields:
+        tuple: (line, row) pairs, line being the line number of the row in
+        the file and row a dictionary of its fields, or None if the line
+        is not a JSON object.
+    """
+    if feed_format is None:
+        extension = os.path.splitext(file_path)[1].lower()
+        feed_format = "ndjson" if extension in (".ndjson", ".jsonl") else "csv"
+    with open(file_path, "r", encoding="utf-8", newline="") as f:
+        if feed_format == "csv":
+            reader = csv.DictReader(f)
+            for row in reader:
+                yield reader.line_num, row
+            return
+        for line, text in enumerate(f, 1):
+            if not text.strip():
+                continue
+            try:
+                row = json.loads(text)
+            except json.JSONDecodeError:
+                row = None
+            yield line, row if isinstance(row, dict) else None
+
+
+def _parse_id(value, required=True):
+    """
+    Parse an ID field of a row.
+
+    Args:
+        value: The field, as read from the feed.
+        required (bool, optional): Whether the field may be empty.
+
+    Returns:
+        int or None: The ID, or None for an empty optional field.
+
+    Raises:
+        ValueError: If the field is missing or not an integer.
+    """
+    if value is None or value == "":
+        if required:
+            raise ValueError("missing")
+        return None
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        raise ValueError("not an integer")
+    return int(value)
+
+
+def _present(_record):
+    """
+    Tell that a record read from a snapshot exists.
+    """
+    return True
+
+
+def _partition(rows, snapshot):
+    """
+    Check the rows of a feed and group the valid ones by hotel.
+
+    Args:
+        rows (iterable): (line, row) pairs, see iter_rows.
+        snapshot (Snapshot): The view of the stores to check against.
+
+    Returns:
+        tuple: The number of rows; a dictionary mapping each hotel ID to
+        its rows, as (line, reservation_id, customer_id, check_in,
+        check_out) tuples, reservation_id being None for rows without
+        one; the set of reservation IDs given by the feed; and the (line,
+        reason, row) tuples of the rejected rows.
+    """
+    partitions = {}
+    given = set()
+    rejected = []
+    count = 0
+    for line, row in rows:
+        count += 1
+        if row is None:
+            rejected.append((line, "Invalid row.", {}))
+            continue
+        try:
+            reservation_id = _parse_id(row.get("reservation_id"), False)
+            hotel_id = _parse_id(row.get("hotel_id"))
+            customer_id = _parse_id(row.get("customer_id"))
+        except ValueError as e:
+            rejected.append((line, f"Invalid ID: {e}", row))
+            continue
+        if (hotel_id not in partitions
+                and snapshot.read("hotels", hotel_id, _present) is None):
+            rejected.append((line, _NO_HOTEL, row))
+            continue
+        if snapshot.read("customers", customer_id, _present) is None:
+            rejected.append((line, NO_CUSTOMER, row))
+            continue
+        if reservation_id is not None:
+            if (reservation_id in given or snapshot.read(
+                    "reservations", reservation_id, _present)):
+                rejected.append((line, TAKEN, row))
+                continue
+            given.add(reservation_id)
+        partitions.setdefault(hotel_id, []).append(
+            (line, reservation_id, customer_id,
+             row.get("check_in") or None, row.get("check_out") or None))
+    return count, partitions, given, rejected
+
+
+def _allocate(partitions, given):
+    """
+    Give the rows without a reservation ID one that neither the stores
+    nor the feed use.
+
+    Args:
+        partitions (dict): Maps each hotel ID to its rows, see _partition.
+            The rows are replaced in place.
+        given (set): The reservation IDs given by the feed.
+    """
+    missing = sum(entry[1] is None
+                  for entries in partitions.values() for entry in entries)
+    reservation_ids = iter(Reservation.allocate_ids(missing, given))
+    for entries in partitions.values():
+        entries[:] = [
+            entry if entry[1] is not None
+            else (entry[0], next(reservation_ids)) + entry[2:]
+            for entry in entries
+        ]
+
+
+def _reserve_partitions(partitions):
+    """
+    Apply the rows of several hotels to copies of the hotels. Runs in a
+    worker process.
+
+    Args:
+        partitions (list): (hotel_id, hotel_record, rows) tuples,
+            hotel_record being the hotel in stored form and rows as
+            returned by _partition, with their IDs.
+
+    Returns:
+        list: One (hotel, results) pair per partition, hotel being the
+        in-memory copy of the hotel after the accepted rows, sent back
+        whole so it need not be decoded again, and results holding, for
+        each row, None if its room was reserved, else the reason why not.
+    """
+    output = []
+    for hotel_id, hotel_record, entries in partitions:
+        hotel = decode_hotel(hotel_record)
+        results = []
+        for _, reservation_id, customer_id, check_in, check_out in entries:
+            try:
+                reservation = Reservation(reservation_id, hotel_id,
+                                          customer_id, check_in, check_out)
+            except ValueError as e:
+                results.append(f"Invalid dates: {e}")
+                continue
+            reserved = reserve_stay(hotel, reservation_id,
+                                    *reservation.stay())
+            results.append(None if reserved else NO_ROOM)
+        output.append((hotel, results))
+    return output
+
+
+def _tasks(partitions, count):
+    """
+    Spread partitions over tasks of about the same number of rows.
+
+    Args:
+        partitions (dict): Maps each hotel ID to its rows.
+        count (int): Number of tasks.
+
+    Returns:
+        list: The non-empty tasks, each a list of hotel IDs.
+    """
+    tasks = [[] for _ in range(count)]
+    sizes = [0] * count
+    for hotel_id in sorted(partitions,
+                           key=lambda hotel_id: -len(partitions[hotel_id])):
+        smallest = sizes.index(min(sizes))
+        tasks[smallest].append(hotel_id)
+        sizes[smallest] += len(partitions[hotel_id])
+    return [task for task in tasks if task]
+
+
+def _run(work, workers, parallel):
+    """
+    Run the capacity checks of each task, in a process pool if parallel.
+
+    Args:
+        work (list): The tasks, as taken by _reserve_partitions.
+        workers (int): Number of worker processes.
+        parallel (bool): Whether to use worker processes.
+
+    Returns:
+        list: The output of _reserve_partitions for each task.
+    """
+    if not parallel or workers < 2 or len(work) < 2:
+        return [_reserve_partitions(task) for task in work]
+    context = multiprocessing.get_context("spawn")
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers, mp_context=context) as executor:
+        return list(executor.map(_reserve_partitions, work))
+
+
+def _row(hotel_id, entry, given):
+    """
+    Rebuild the fields of a row from its tuple, for the report.
+    """
+    _, reservation_id, customer_id, check_in, check_out = entry
+    return {
+        "reservation_id": reservation_id if reservation_id in given else "",
+        "hotel_id": hotel_id,
+        "customer_id": customer_id,
+        "check_in": check_in or "",
+        "check_out": check_out or "",
+    }
+
+
+def _merge(work, outputs, given):
+    """
+    Create the reservations of the rows accepted by the workers, in a
+    single transaction.
+
+    Args:
+        work (list): The tasks, as taken by _reserve_partitions.
+        outputs (list): The output of _reserve_partitions for each task.
+        given (set): The reservation IDs given by the feed.
+
+    Returns:
+        tuple: The number of reservations created, and the (line, reason,
+        row) tuples of the rows rejected by the capacity checks or when
+        they were merged.
+    """
+    hotels = {}
+    accepted = []
+    rejected = []
+    for (hotel_id, base, entries), (hotel, results) in zip(
+            itertools.chain.from_iterable(work),
+            itertools.chain.from_iterable(outputs)):
+        hotels[hotel_id] = (base, hotel)
+        for entry, reason in zip(entries, results):
+            if reason is None:
+                accepted.append((hotel_id, entry))
+            else:
+                rejected.append(
+                    (entry[0], reason, _row(hotel_id, entry, given)))
+    errors = Reservation.merge_reservations(
+        [Reservation(entry[1], hotel_id, *entry[2:])
+         for hotel_id, entry in accepted],
+        hotels)
+    rejected.extend(
+        (entry[0], error, _row(hotel_id, entry, given))
+        for (hotel_id, entry), error in zip(accepted, errors)
+        if error is not None
+    )
+    return errors.count(None), rejected
+
+
+def import_feed(file_path, feed_format=None, workers=None):
+    """
+    Import a reservation feed in a single transaction.
+
+    Args:
+        file_path (str): Path to the feed.
+        feed_format (str, optional): "csv" or "ndjson". Defaults to the
+            file's extension.
+        workers (int, optional): Number of worker processes. Defaults to
+            the number of CPUs; 1 runs the capacity checks in this
+            process.
+
+    Returns:
+        dict: rows, the number of rows read; imported, the number of
+        reservations created; and rejected, the (line, reason, row)
+        tuples of the rows not imported, in file order.
+    """
+    workers = workers or os.cpu_count() or 1
+    snapshot = Reservation.snapshot()
+    count, partitions, given, rejected = _partition(
+        iter_rows(file_path, feed_format), snapshot)
+    _allocate(partitions, given)
+    work = [
+        [(hotel_id, snapshot.get("hotels", hotel_id), partitions[hotel_id])
+         for hotel_id in task]
+        for task in _tasks(partitions, workers * TASKS_PER_WORKER)
+    ]
+    outputs = _run(work, workers, count >= PARALLEL_ROWS)
+    imported, refused = _merge(work, outputs, given)
+    rejected.extend(refused)
+    rejected.sort(key=lambda entry: entry[0])
+    return {
+        "rows": count,
+        "imported": imported,
+        "rejected": rejected,
+    }
+
+
+def write_report(file_path, rejected):
+    """
+    Write the rejected rows of an import to a CSV file.
+
+    Args:
+        file_path (str): Path to the report.
+        rejected (list): (line, reason, row) tuples, see import_feed.
+    """
+    with open(file_path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(("line", "reason") + FIELDS)
+        for line, reason, row in rejected:
+            writer.writerow(
+                [line, reason] + [row.get(field, "") for field in FIELDS])
+
+
+def main(argv=None):
+    """
+    Run an import from the command line.
+
+    Args:
+        argv (list, optional): Command-line arguments.
+
+    Returns:
+        int: 1 if any row was rejected, else 0.
+    """
+    parser = argparse.ArgumentParser(
+        description="Import a reservation feed.")
+    parser.add_argument("file_path", help="CSV or NDJSON feed to import")
+    parser.add_argument("--format", choices=("csv", "ndjson"),
+                        help="format of the feed")
+    parser.add_argument("--workers", type=int,
+                        help="number of worker processes")
+    parser.add_argument("--report", help="CSV file for the rejected rows")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    result = import_feed(args.file_path, args.format, args.workers)
+    seconds = time.perf_counter() - start
+    print(f"{result['rows']} rows read, {result['imported']} imported, "
+          f"{len(result['rejected'])} rejected in {seconds:.2f} s")
+    if args.report:
+        write_report(args.report, result["rejected"])
+    return 1 if result["rejected"] else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,221 @@
+"""
+indexes.py
+
+This module defines secondary indexes that a Repository keeps up to date
+as its records change. An index is rebuilt from every record when a store
+is loaded, and then updated one record at a time on each mutation, so
+queries never scan the whole store. An index whose keys depend on the
+current date is also rebuilt before the first query of each day.
+"""
+
+import bisect
+
+from app.availability import today
+
+
+class Index:
+    """
+    Interface implemented by every secondary index.
+    """
+
+    def rebuild(self, records):
+        """
+        Rebuild the index from every record of a store.
+
+        Args:
+            records (dict): Maps each record ID to its in-memory record.
+        """
+        raise NotImplementedError
+
+    def update(self, record_id, record):
+        """
+        Update the index after a record was inserted, changed or deleted.
+
+        Args:
+            record_id: The ID of the record.
+            record (dict or None): The in-memory record, or None if it was
+                deleted.
+        """
+        raise NotImplementedError
+
+    def stale(self):
+        """
+        Check whether the index must be rebuilt before it is queried, even
+        though no record changed.
+
+        Returns:
+            bool: False unless overridden.
+        """
+        return False
+
+
+class GroupedRangeIndex(Index):
+    """
+    An index of records by group and integer score, answering "records in
+    group G with a score of at least N" in time proportional to the number
+    of results.
+
+    Each group keeps one bucket of record IDs per distinct score, and a
+    sorted list of the scores that have a non-empty bucket.
+    """
+
+    def __init__(self, keys, daily=False):
+        """
+        Initialize a GroupedRangeIndex instance.
+
+        Args:
+            keys (callable): Called with an in-memory record, returns the
+                (group, score) pairs under which it is indexed.
+            daily (bool, optional): Whether the keys depend on the current
+                date, so the index goes stale when the day changes.
+        """
+        self._keys = keys
+        self._daily = daily
+        self._day = None
+        self._groups = {}
+        self._entries = {}
+
+    def rebuild(self, records):
+        self._day = today()
+        self._groups = {}
+        self._entries = {}
+        for record_id, record in records.items():
+            self.update(record_id, record)
+
+    def update(self, record_id, record):
+        entries = self._keys(record) if record is not None else ()
+        entries = tuple(entries)
+        old_entries = self._entries.get(record_id, ())
+        if entries == old_entries:
+            return
+        for group, score in old_entries:
+            self._remove(group, score, record_id)
+        for group, score in entries:
+            self._add(group, score, record_id)
+        if entries:
+            self._entries[record_id] = entries
+        else:
+            self._entries.pop(record_id, None)
+
+    def stale(self):
+        return self._daily and self._day != today()
+
+    def _add(self, group, score, record_id):
+        """
+        Add a record ID to the bucket of a score.
+        """
+        scores, buckets = self._groups.setdefault(group, ([], {}))
+        bucket = buckets.get(score)
+        if bucket is None:
+            bucket = buckets[score] = {}
+            bisect.insort(scores, score)
+        bucket[record_id] = None
+
+    def _remove(self, group, score, record_id):
+        """
+        Remove a record ID from the bucket of a score.
+        """
+        scores, buckets = self._groups[group]
+        bucket = buckets[score]
+        del bucket[record_id]
+        if not bucket:
+            del buckets[score]
+            del scores[bisect.bisect_left(scores, score)]
+            if not scores:
+                del self._groups[group]
+
+    def query(self, group, min_score):
+        """
+        Return the IDs of the records in a group with a score of at least
+        min_score.
+
+        Args:
+            group: The group to search.
+            min_score (int): The smallest score to return.
+
+        Returns:
+            list: The matching record IDs, highest scores first.
+        """
+        if group not in self._groups:
+            return []
+        scores, buckets = self._groups[group]
+        start = bisect.bisect_left(scores, min_score)
+        return [
+            record_id
+            for score in reversed(scores[start:])
+            for record_id in buckets[score]
+        ]
+
+
+class FieldIndex(Index):
+    """
+    An index of records by the value of one field, answering "records
+    whose field equals V" in time proportional to the number of results.
+
+    Records without the field, or with an unhashable value, are not
+    indexed.
+    """
+
+    def __init__(self, field):
+        """
+        Initialize a FieldIndex instance.
+
+        Args:
+            field (str): Name of the indexed field.
+        """
+        self._field = field
+        # Maps each value to the IDs of its records, in insertion order.
+        self._groups = {}
+        self._values = {}
+
+    def _value(self, record):
+        """
+        Return the indexed value of a record, or None if not indexed.
+        """
+        value = record.get(self._field) if record is not None else None
+        try:
+            hash(value)
+        except TypeError:
+            return None
+        return value
+
+    def rebuild(self, records):
+        groups = {}
+        values = {}
+        for record_id, record in records.items():
+            value = self._value(record)
+            if value is not None:
+                values[record_id] = value
+                group = groups.get(value)
+                if group is None:
+                    group = groups[value] = {}
+                group[record_id] = None
+        self._groups = groups
+        self._values = values
+
+    def update(self, record_id, record):
+        value = self._value(record)
+        old_value = self._values.get(record_id)
+        if value == old_value:
+            return
+        if old_value is not None:
+            group = self._groups[old_value]
+            del group[record_id]
+            if not group:
+                del self._groups[old_value]
+            del self._values[record_id]
+        if value is not None:
+            self._groups.setdefault(value, {})[record_id] = None
+            self._values[record_id] = value
+
+    def query(self, value):
+        """
+        Return the IDs of the records whose field equals a value.
+
+        Args:
+            value: The value to look for.
+
+        Returns:
+            list: The matching record IDs, in the order they were indexed.
+        """
+        return list(self._groups.get(value, ()))
@@ -0,0 +1,125 @@
+"""
+locking.py
+
+This module provides advisory file locks that coordinate writers running
+in separate processes (and threads) against the same data directory.
+
+Each store has one store lock and a fixed number of record locks. A writer
+that rewrites a whole store takes the store lock exclusively. A writer that
+only touches some records takes the store lock shared, plus the record
+locks of those records exclusively, so writers working on unrelated records,
+such as bookings at different hotels, proceed in parallel.
+
+Locks are taken with fcntl.flock on files kept in a .locks directory next
+to the store. On platforms without fcntl the locks do nothing.
+"""
+
+import contextlib
+import os
+import zlib
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - not available on Windows.
+    fcntl = None
+
+# Number of record locks per store. Records are spread over them by hash.
+LOCK_STRIPES = 64
+
+LOCK_DIRECTORY = ".locks"
+
+
+def _lock_path(file_path, suffix):
+    """
+    Return the path of a lock file for the given store.
+    """
+    directory, name = os.path.split(file_path)
+    lock_directory = os.path.join(directory or ".", LOCK_DIRECTORY)
+    os.makedirs(lock_directory, exist_ok=True)
+    return os.path.join(lock_directory, f"{name}.{suffix}")
+
+
+def lock_stripe(record_id):
+    """
+    Return the record lock used for a record ID.
+
+    The stripe is derived from a stable hash, so every process maps the
+    same ID to the same lock.
+
+    Args:
+        record_id: The ID of the record.
+
+    Returns:
+        int: A stripe number between 0 and LOCK_STRIPES - 1.
+    """
+    return zlib.crc32(repr(record_id).encode("utf-8")) % LOCK_STRIPES
+
+
+@contextlib.contextmanager
+def _flock(path, operation):
+    """
+    Hold a flock on the given file for the duration of the block.
+    """
+    if fcntl is None:
+        yield
+        return
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, operation)
+        yield
+    finally:
+        # Closing the descriptor releases the lock.
+        os.close(fd)
+
+
+@contextlib.contextmanager
+def store_lock(file_path, record_ids=None):
+    """
+    Lock a store, or some of its records, for writing.
+
+    Args:
+        file_path (str): Path identifying the store.
+        record_ids (iterable, optional): IDs of the records to lock. If
+            omitted, the whole store is locked exclusively.
+    """
+    if fcntl is None:
+        yield
+        return
+    if record_ids is None:
+        with _flock(_lock_path(file_path, "lock"), fcntl.LOCK_EX):
+            yield
+        return
+    # Always take record locks in the same order to avoid deadlocks.
+    stripes = sorted({lock_stripe(record_id) for record_id in record_ids})
+    with contextlib.ExitStack() as stack:
+        stack.enter_context(
+            _flock(_lock_path(file_path, "lock"), fcntl.LOCK_SH))
+        for stripe in stripes:
+            stack.enter_context(
+                _flock(_lock_path(file_path, str(stripe)), fcntl.LOCK_EX))
+        yield
+
+
+def try_lock(path):
+    """
+    Take an exclusive lock on a file if no other process holds one.
+
+    The lock is held until the returned descriptor is closed. Without
+    fcntl, the lock always succeeds.
+
+    Args:
+        path (str): Path of the file to lock, created if missing.
+
+    Returns:
+        int or None: An open descriptor holding the lock, or None if the
+        file is locked by another process.
+    """
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    if fcntl is None:
+        return fd
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(fd)
+        return None
+    return fd
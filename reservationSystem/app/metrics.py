@@ -0,0 +1,211 @@
+"""
+metrics.py
+
+This module collects low-overhead metrics about the hot paths of the
+reservation system: how often each instrumented operation is called, how
+long it takes, as a total and as a latency histogram, and how many bytes it
+reads from and writes to disk.
+
+Operations are instrumented with the timed decorator and report their disk
+traffic with record_bytes. Metrics are disabled by default; while disabled
+an instrumented call costs one dictionary lookup on top of the call itself.
+They are enabled with enable(), or by setting the RESERVATION_METRICS
+environment variable to 1.
+
+Timings are inclusive: an operation that calls another instrumented
+operation, such as Reservation.create_reservation calling
+Hotel.reserve_room, also counts the time spent in it.
+
+The collected metrics are returned by snapshot() as a dictionary, or by
+prometheus() in the Prometheus text exposition format.
+"""
+
+import bisect
+import functools
+import os
+import threading
+import time
+
+# Upper bounds of the latency histogram buckets, in seconds. A last bucket
+# without upper bound is implied.
+BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+# Prefix of the metric names in the Prometheus output.
+PREFIX = "reservation"
+
+_settings = {
+    "enabled": os.environ.get("RESERVATION_METRICS") == "1",
+}
+
+# Maps each operation name to its statistics:
+# [calls, seconds, bucket counts, bytes read, bytes written].
+_metrics = {}
+_lock = threading.Lock()
+
+
+def enable():
+    """
+    Start collecting metrics.
+    """
+    _settings["enabled"] = True
+
+
+def disable():
+    """
+    Stop collecting metrics. Metrics collected so far are kept.
+    """
+    _settings["enabled"] = False
+
+
+def is_enabled():
+    """
+    Check whether metrics are being collected.
+
+    Returns:
+        bool: True if metrics are enabled.
+    """
+    return _settings["enabled"]
+
+
+def reset():
+    """
+    Drop every collected metric.
+    """
+    with _lock:
+        _metrics.clear()
+
+
+def _entry(name):
+    """
+    Return the statistics of an operation, creating them on first use.
+    Must be called with the lock held.
+    """
+    entry = _metrics.get(name)
+    if entry is None:
+        entry = _metrics[name] = [0, 0.0, [0] * (len(BUCKETS) + 1), 0, 0]
+    return entry
+
+
+def observe(name, seconds):
+    """
+    Record one call of an operation.
+
+    Args:
+        name (str): Name of the operation.
+        seconds (float): Duration of the call.
+    """
+    bucket = bisect.bisect_left(BUCKETS, seconds)
+    with _lock:
+        entry = _entry(name)
+        entry[0] += 1
+        entry[1] += seconds
+        entry[2][bucket] += 1
+
+
+def record_bytes(name, read=0, written=0):
+    """
+    Record disk traffic of an operation, if metrics are enabled.
+
+    Args:
+        name (str): Name of the operation.
+        read (int, optional): Number of bytes read.
+        written (int, optional): Number of bytes written.
+    """
+    if not _settings["enabled"]:
+        return
+    with _lock:
+        entry = _entry(name)
+        entry[3] += read
+        entry[4] += written
+
+
+def timed(name):
+    """
+    Decorate a function so each call is counted and timed under a name.
+
+    Args:
+        name (str): Name of the operation.
+
+    Returns:
+        callable: The decorator.
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _settings["enabled"]:
+                return function(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                observe(name, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+def snapshot():
+    """
+    Return the metrics collected so far.
+
+    Returns:
+        dict: Maps each operation name to a dictionary with its calls,
+        total seconds, bytes_read, bytes_written and buckets, a list of
+        (upper bound, cumulative count) pairs ending with ("+Inf", calls).
+    """
+    with _lock:
+        metrics = {
+            name: (calls, seconds, list(counts), read, written)
+            for name, (calls, seconds, counts, read, written)
+            in _metrics.items()
+        }
+    result = {}
+    for name, (calls, seconds, counts, read, written) in sorted(
+            metrics.items()):
+        buckets = []
+        total = 0
+        for bound, count in zip(BUCKETS + ("+Inf",), counts):
+            total += count
+            buckets.append((bound, total))
+        result[name] = {
+            "calls": calls,
+            "seconds": seconds,
+            "bytes_read": read,
+            "bytes_written": written,
+            "buckets": buckets,
+        }
+    return result
+
+
+def prometheus():
+    """
+    Return the metrics collected so far in the Prometheus text format.
+
+    Returns:
+        str: One histogram of call durations and two byte counters, each
+        labeled by operation.
+    """
+    metrics = snapshot()
+    lines = [
+        f"# HELP {PREFIX}_operation_seconds Duration of each operation.",
+        f"# TYPE {PREFIX}_operation_seconds histogram",
+    ]
+    for name, metric in metrics.items():
+        for bound, count in metric["buckets"]:
+            lines.append(
+                f'{PREFIX}_operation_seconds_bucket'
+                f'{{operation="{name}",le="{bound}"}} {count}')
+        lines.append(f'{PREFIX}_operation_seconds_sum'
+                     f'{{operation="{name}"}} {metric["seconds"]!r}')
+        lines.append(f'{PREFIX}_operation_seconds_count'
+                     f'{{operation="{name}"}} {metric["calls"]}')
+    for field, help_text in (("bytes_read", "Bytes read from disk."),
+                             ("bytes_written", "Bytes written to disk.")):
+        lines.append(f"# HELP {PREFIX}_{field}_total {help_text}")
+        lines.append(f"# TYPE {PREFIX}_{field}_total counter")
+        for name, metric in metrics.items():
+            lines.append(f'{PREFIX}_{field}_total'
+                         f'{{operation="{name}"}} {metric[field]}')
+    return "\n".join(lines) + "\n"
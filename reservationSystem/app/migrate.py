@@ -0,0 +1,144 @@
+"""
+migrate.py
+
+This module copies the JSON persistence files into a SQLite database used
+by SqliteBackend. Each file is streamed element by element and inserted in
+batches, so memory use does not depend on the size of the file. Any journal
+kept next to a file is applied after its snapshot.
+
+Usage:
+    python -m app.migrate path/to/reservations.db
+"""
+
+import argparse
+import json
+import os
+
+from app.persistence import (
+    iter_snapshot,
+    journal_path,
+    HOTEL_FILE,
+    CUSTOMER_FILE,
+    RESERVATION_FILE,
+)
+from app.storage import SqliteBackend
+
+# Stores migrated by default, with the field that identifies each record.
+STORES = {
+    HOTEL_FILE: "hotel_id",
+    CUSTOMER_FILE: "customer_id",
+    RESERVATION_FILE: "reservation_id",
+}
+
+# Number of records inserted per transaction.
+BATCH_SIZE = 1000
+
+
+def _batches(records, batch_size):
+    """
+    Group an iterable of records into lists of at most batch_size records.
+    """
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def migrate_file(backend, file_path, key, batch_size=BATCH_SIZE):
+    """
+    Copy one persistence file, in either format, and its journal, into a
+    SQLite store.
+
+    Records with an ID already in the store are replaced, so running the
+    migration twice is harmless. For duplicated IDs within the file, the
+    first record is kept, as the repositories do.
+
+    Args:
+        backend (SqliteBackend): The destination backend.
+        file_path (str): Path to the JSON file.
+        key (str): Name of the field that identifies each record.
+        batch_size (int, optional): Number of records per transaction.
+
+    Returns:
+        int: Number of records read from the file and its journal.
+    """
+    seen = set()
+    count = 0
+
+    def first_occurrences():
+        nonlocal count
+        for record in iter_snapshot(file_path):
+            count += 1
+            record_id = record.get(key)
+            if record_id not in seen:
+                seen.add(record_id)
+                yield record
+
+    for batch in _batches(first_occurrences(), batch_size):
+        backend.insert(file_path, key, batch)
+
+    if os.path.exists(journal_path(file_path)):
+        with open(journal_path(file_path), "r", encoding="utf-8") as f:
+            entries = []
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    break
+                entries.append(
+                    (entry["op"], entry["id"], entry.get("record")))
+                if len(entries) == batch_size:
+                    backend.write(file_path, key, entries, None)
+                    count += len(entries)
+                    entries = []
+            backend.write(file_path, key, entries, None)
+            count += len(entries)
+    return count
+
+
+def migrate(db_path, stores=None, batch_size=BATCH_SIZE):
+    """
+    Copy the JSON persistence files into a SQLite database.
+
+    Args:
+        db_path (str): Path to the SQLite database file.
+        stores (dict, optional): Maps each file path to the field that
+            identifies its records. Defaults to STORES.
+        batch_size (int, optional): Number of records per transaction.
+
+    Returns:
+        dict: Number of records read for each file path.
+    """
+    backend = SqliteBackend(db_path)
+    try:
+        return {
+            file_path: migrate_file(backend, file_path, key, batch_size)
+            for file_path, key in (stores or STORES).items()
+        }
+    finally:
+        backend.close()
+
+
+def main(argv=None):
+    """
+    Run the migration from the command line.
+
+    Args:
+        argv (list, optional): Command-line arguments.
+    """
+    parser = argparse.ArgumentParser(
+        description="Copy the JSON persistence files into SQLite.")
+    parser.add_argument("db_path", help="path to the SQLite database")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    args = parser.parse_args(argv)
+    for file_path, count in migrate(
+            args.db_path, batch_size=args.batch_size).items():
+        print(f"{file_path}: {count} records")
+
+
+if __name__ == "__main__":
+    main()
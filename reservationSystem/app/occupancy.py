@@ -0,0 +1,233 @@
+"""
+occupancy.py
+
+This module defines the Occupancy class, the in-memory representation of
+the reservations held by a hotel. It replaces the plain reserved_rooms list
+with an insertion-ordered hash set, so reserving, canceling and checking
+availability take constant time regardless of the size of the hotel, while
+still serializing to the same list of reservation IDs.
+
+Reservations may also be made for a date range (a stay). Stays only hold a
+room on their own nights, which are counted in a NightlyInventory, so
+checking and booking a stay take O(log n) time. Reservations without dates
+hold a room on every night, as they always have.
+
+Without dates, free and held rooms are counted over the nights from today
+on: a stay that has ended no longer holds a room.
+"""
+
+import datetime
+
+from app.availability import SPAN, NightlyInventory, stay_nights, today
+
+
+class Occupancy:
+    """
+    A class representing the set of reservations holding rooms at a hotel.
+    """
+
+    __slots__ = ("_reservations", "_stays", "_inventory")
+
+    def __init__(self, reservation_ids=None, stays=None):
+        """
+        Initialize an Occupancy instance.
+
+        Args:
+            reservation_ids (iterable, optional): Reservation IDs already
+                holding rooms. Duplicated IDs are counted once.
+            stays (iterable, optional): (reservation_id, check_in,
+                check_out) entries for the reservations made for a date
+                range. Their IDs are added to reservation_ids if missing.
+        """
+        # A dict keeps insertion order, so the serialized list is stable.
+        self._reservations = dict.fromkeys(reservation_ids or ())
+        self._stays = {}
+        self._inventory = None
+        for reservation_id, check_in, check_out in stays or ():
+            self._reservations.setdefault(reservation_id)
+            self._add_stay(reservation_id, check_in, check_out)
+
+    def _add_stay(self, reservation_id, check_in, check_out):
+        """
+        Record the nights held by a stay.
+        """
+        first, end = stay_nights(check_in, check_out)
+        if self._inventory is None:
+            self._inventory = NightlyInventory()
+        self._inventory.add(first, end, 1)
+        self._stays[reservation_id] = (first, end)
+
+    def _permanent(self):
+        """
+        Return the number of reservations holding a room on every night.
+        """
+        return len(self._reservations) - len(self._stays)
+
+    def _booked(self, first=None, end=None):
+        """
+        Return the peak number of rooms held by stays, over the nights in
+        [first, end) or over every night from today on.
+        """
+        if self._inventory is None:
+            return 0
+        if first is None:
+            return self._inventory.booked(today(), SPAN)
+        return self._inventory.booked(first, end)
+
+    def to_list(self):
+        """
+        Convert the occupancy to the list stored in reserved_rooms.
+
+        Returns:
+            list: Reservation IDs in the order they were reserved.
+        """
+        return list(self._reservations)
+
+    def stays_to_list(self):
+        """
+        Convert the stays to the list stored in stays.
+
+        Returns:
+            list: [reservation_id, check_in, check_out] entries, with the
+            dates in ISO 8601 format.
+        """
+        return [
+            [reservation_id, _iso(first), _iso(end)]
+            for reservation_id, (first, end) in self._stays.items()
+        ]
+
+    @staticmethod
+    def from_list(reservation_ids, stays=None):
+        """
+        Create an Occupancy instance from a reserved_rooms list.
+
+        Args:
+            reservation_ids (list): Reservation IDs holding rooms.
+            stays (list, optional): A stays list as returned by
+                stays_to_list.
+
+        Returns:
+            Occupancy: A new Occupancy instance.
+        """
+        return Occupancy(reservation_ids, stays)
+
+    def has_room(self, total_rooms, check_in=None, check_out=None):
+        """
+        Check whether another room can be reserved.
+
+        Args:
+            total_rooms (int): Total number of rooms in the hotel.
+            check_in (date or str, optional): Arrival date of the stay.
+            check_out (date or str, optional): Departure date of the stay.
+                Without dates, the room must be free on every night from
+                today on.
+
+        Returns:
+            bool: True if at least one room is free.
+        """
+        return self.free_rooms(total_rooms, check_in, check_out) > 0
+
+    def free_rooms(self, total_rooms, check_in=None, check_out=None):
+        """
+        Return the number of rooms that are not reserved.
+
+        Args:
+            total_rooms (int): Total number of rooms in the hotel.
+            check_in (date or str, optional): Arrival date of the stay.
+            check_out (date or str, optional): Departure date of the stay.
+                Without dates, rooms must be free on every night from
+                today on.
+
+        Returns:
+            int: Number of free rooms, never negative.
+        """
+        if check_in is None:
+            booked = self._booked()
+        else:
+            booked = self._booked(*stay_nights(check_in, check_out))
+        return max((total_rooms or 0) - self._permanent() - booked, 0)
+
+    def held_rooms(self):
+        """
+        Return the number of rooms held on the busiest night from today
+        on.
+
+        Returns:
+            int: Number of held rooms. It exceeds the total number of
+            rooms of a hotel that is over capacity.
+        """
+        return self._permanent() + self._booked()
+
+    def reserve(self, reservation_id, total_rooms,
+                check_in=None, check_out=None):
+        """
+        Hold a room for a reservation if one is free.
+
+        Args:
+            reservation_id (int): The reservation ID to add.
+            total_rooms (int): Total number of rooms in the hotel.
+            check_in (date or str, optional): Arrival date of the stay.
+            check_out (date or str, optional): Departure date of the stay.
+                Without dates, the room is held on every night.
+
+        Returns:
+            bool: True if the room was reserved, False if the hotel is
+            full or the reservation already holds a room.
+
+        Raises:
+            ValueError: If the dates are invalid.
+        """
+        if (
+            reservation_id in self._reservations
+            or not self.has_room(total_rooms, check_in, check_out)
+        ):
+            return False
+        if check_in is not None:
+            self._add_stay(reservation_id, check_in, check_out)
+        self._reservations[reservation_id] = None
+        return True
+
+    def cancel(self, reservation_id):
+        """
+        Release the room held by a reservation.
+
+        Args:
+            reservation_id (int): The reservation ID to remove.
+
+        Returns:
+            bool: True if the reservation held a room, False otherwise.
+        """
+        if reservation_id not in self._reservations:
+            return False
+        del self._reservations[reservation_id]
+        stay = self._stays.pop(reservation_id, None)
+        if stay is not None:
+            self._inventory.add(stay[0], stay[1], -1)
+            if not self._stays:
+                self._inventory = None
+        return True
+
+    def __contains__(self, reservation_id):
+        """
+        Check whether a reservation holds a room.
+        """
+        return reservation_id in self._reservations
+
+    def __len__(self):
+        """
+        Return the number of reservations holding rooms.
+        """
+        return len(self._reservations)
+
+    def __iter__(self):
+        """
+        Iterate over the reservation IDs in the order they were reserved.
+        """
+        return iter(self._reservations)
+
+
+def _iso(day):
+    """
+    Convert a day number to an ISO 8601 date string.
+    """
+    return datetime.date.fromordinal(day).isoformat()
@@ -3,54 +3,1156 @@ persistence.py
 
 This module contains functions for loading and saving data from JSON files.
 It also defines file path constants for hotels, customers, and reservations.
+
+Three storage modes are supported. In "json" mode every save rewrites the
+whole file. In "journal" mode single mutations are appended to a journal
+file next to the data file, and the data file itself is only rewritten as a
+periodic snapshot, after which the journal is truncated. In "ndjson" mode
+files hold one record per line, and mutations are applied by streaming the
+file through a temporary file, so memory use does not depend on its size.
+
+Outside ndjson mode, data files are written by a codec (see Codec): the
+default indented JSON, compact JSON without indentation, gzip-compressed
+compact JSON, or a binary pickle snapshot, which is the fastest to write
+and to load again on restart. The codec is chosen with set_codec or the
+RESERVATION_CODEC environment variable, and journals are always JSON.
+
+The format of a file is detected from its first bytes (see
+detect_format), so JSON files in any of their forms can be read in any
+mode. Pickle files are different: as loading a pickle runs code, they are
+only read while the pickle codec is selected. A store written with the
+pickle codec must be converted (see convert_file) before another codec is
+selected.
+
+A missing file loads as an empty list. A file that exists but cannot be
+decoded, or a pickle loaded under another codec, raises ValueError rather
+than loading as empty, which the next save would write over the file.
+iter_records reads a file one record at a time, so a scan can stop as soon
+as it finds what it is looking for.
+
+Saves are atomic: data is written to a temporary file which then replaces
+the data file, so readers never see a partially written file. Journal
+records are appended with a single write on a file opened in append mode,
+so records appended by several processes do not interleave.
+
+Parsed files are kept in a size-capped LRU cache, validated against the
+file's (mtime_ns, size, inode) on every load, so an unchanged file is only
+parsed once.
+
+Loads, saves and journal reads and writes are timed, and their disk
+traffic counted, when metrics are enabled (see metrics.py).
 """
 
+import collections
+import gzip
+import io
 import json
 import os
+import pickle
+import tempfile
+import threading
+import zlib
+
+from app.metrics import record_bytes, timed
 
 # Constants for file paths.
 HOTEL_FILE = "json/hotels.json"
 CUSTOMER_FILE = "json/customers.json"
 RESERVATION_FILE = "json/reservations.json"
 
+# Storage modes.
+JSON_MODE = "json"
+JOURNAL_MODE = "journal"
+NDJSON_MODE = "ndjson"
+STORAGE_MODES = (JSON_MODE, JOURNAL_MODE, NDJSON_MODE)
 
-def load_data(file_path):
+# Snapshot codecs.
+JSON_CODEC = "json"
+COMPACT_JSON_CODEC = "compact-json"
+GZIP_JSON_CODEC = "gzip-json"
+PICKLE_CODEC = "pickle"
+
+# Format of files holding one JSON record per line.
+NDJSON_FORMAT = "ndjson"
+
+# Compression level of gzip-json files. Level 1 writes about twice as fast
+# as the default level 6, for files less than a tenth larger.
+GZIP_LEVEL = 1
+
+# Suffix of the journal file kept next to each data file.
+JOURNAL_SUFFIX = ".journal"
+
+# Number of journal records after which a new snapshot is written.
+SNAPSHOT_INTERVAL = 1000
+
+_settings = {
+    "mode": os.environ.get("RESERVATION_STORAGE_MODE", JSON_MODE),
+    "snapshot_interval": SNAPSHOT_INTERVAL,
+    "codec": os.environ.get("RESERVATION_CODEC", JSON_CODEC),
+}
+
+# Number of records currently in each journal, keyed by data file path.
+_journal_lengths = {}
+
+# Default limit of the parse cache, in bytes of cached file content.
+CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+_cache = {
+    "entries": collections.OrderedDict(),
+    "bytes": 0,
+    "max_bytes": CACHE_MAX_BYTES,
+    "hits": 0,
+    "misses": 0,
+    "evictions": 0,
+}
+_cache_lock = threading.Lock()
+
+
+def set_storage_mode(mode, snapshot_interval=None):
     """
-    Load data from the given JSON file.
+    Select how mutations are persisted.
+
+    Args:
+        mode (str): One of "json", "journal" or "ndjson".
+        snapshot_interval (int, optional): Number of journal records after
+            which a snapshot is written. Defaults to SNAPSHOT_INTERVAL.
+
+    Raises:
+        ValueError: If the mode is not supported.
+    """
+    if mode not in STORAGE_MODES:
+        raise ValueError(f"Unknown storage mode: {mode}")
+    _settings["mode"] = mode
+    _settings["snapshot_interval"] = (
+        snapshot_interval
+        if snapshot_interval is not None
+        else SNAPSHOT_INTERVAL
+    )
+
+
+def get_storage_mode():
+    """
+    Return the current storage mode.
+
+    Returns:
+        str: One of "json", "journal" or "ndjson".
+    """
+    return _settings["mode"]
+
+
+class Codec:
+    """
+    Writes and reads the list of records held by a data file.
+    """
+
+    def __init__(self, name):
+        """
+        Initialize a Codec instance.
+
+        Args:
+            name (str): Name under which the codec is selected.
+        """
+        self.name = name
+
+    def dump(self, records, f):
+        """
+        Write records to a binary file object.
+
+        Args:
+            records (iterable): The records to write. A list is written
+                at once, other iterables may be written one record at a
+                time.
+            f: The file object to write to.
+        """
+        raise NotImplementedError
+
+    def load(self, f):
+        """
+        Read the records written by dump.
+
+        Args:
+            f: The binary file object to read from.
+
+        Returns:
+            list: The records.
+        """
+        raise NotImplementedError
+
+
+class JsonCodec(Codec):
+    """
+    Writes records as a JSON array, indented or compact.
+
+    Indented JSON goes through the pure-Python encoder, so it is several
+    times slower to write, and about twice as large, as compact JSON.
+    """
+
+    def __init__(self, name, indent=None):
+        """
+        Initialize a JsonCodec instance.
+
+        Args:
+            name (str): Name under which the codec is selected.
+            indent (int, optional): Indentation of the array. Defaults to
+                compact JSON without whitespace.
+        """
+        super().__init__(name)
+        self.indent = indent
+
+    def _dumps(self, value):
+        """
+        Encode a value as JSON text.
+        """
+        if self.indent is None:
+            return json.dumps(value, separators=(",", ":"))
+        return json.dumps(value, indent=self.indent)
+
+    def _write(self, records, f):
+        """
+        Write records to a text file object.
+        """
+        if isinstance(records, list):
+            f.write(self._dumps(records))
+            return
+        if self.indent is None:
+            separator = "["
+            for record in records:
+                f.write(separator)
+                f.write(self._dumps(record))
+                separator = ","
+            f.write("[]" if separator == "[" else "]")
+            return
+        # Same layout as json.dumps(records, indent=...), one record at a
+        # time.
+        padding = " " * self.indent
+        separator = "[\n" + padding
+        for record in records:
+            f.write(separator)
+            f.write(self._dumps(record).replace("\n", "\n" + padding))
+            separator = ",\n" + padding
+        f.write("[]" if separator.startswith("[") else "\n]")
+
+    def dump(self, records, f):
+        text = io.TextIOWrapper(f, encoding="utf-8")
+        self._write(records, text)
+        text.flush()
+        text.detach()
+
+    def load(self, f):
+        return json.loads(f.read())
+
+
+class GzipJsonCodec(JsonCodec):
+    """
+    Writes records as gzip-compressed compact JSON.
+    """
+
+    def __init__(self, name, level=GZIP_LEVEL):
+        """
+        Initialize a GzipJsonCodec instance.
+
+        Args:
+            name (str): Name under which the codec is selected.
+            level (int, optional): The gzip compression level.
+        """
+        super().__init__(name)
+        self.level = level
+
+    def dump(self, records, f):
+        # A fixed mtime keeps the output identical for identical records.
+        with gzip.GzipFile(fileobj=f, mode="wb", compresslevel=self.level,
+                           mtime=0) as compressed:
+            super().dump(records, compressed)
+
+    def load(self, f):
+        with gzip.GzipFile(fileobj=f, mode="rb") as compressed:
+            return super().load(compressed)
+
+
+class PickleCodec(Codec):
+    """
+    Writes records as a binary pickle, protocol 5.
+
+    Pickle files are the fastest to write and load, but are not readable
+    by other tools, and loading one runs whatever code it refers to. They
+    are therefore only loaded while the pickle codec is selected, which
+    tells that the data files were written by the system itself.
+    """
+
+    def dump(self, records, f):
+        records = records if isinstance(records, list) else list(records)
+        pickle.dump(records, f, protocol=5)
+
+    def load(self, f):
+        if get_codec() != self.name:
+            raise ValueError(
+                "Pickle files are only loaded with the pickle codec")
+        records = pickle.load(f)
+        if not isinstance(records, list):
+            raise ValueError("Pickle snapshot does not hold a list")
+        return records
+
+
+CODECS = {
+    codec.name: codec for codec in (
+        JsonCodec(JSON_CODEC, indent=4),
+        JsonCodec(COMPACT_JSON_CODEC),
+        GzipJsonCodec(GZIP_JSON_CODEC),
+        PickleCodec(PICKLE_CODEC),
+    )
+}
+
+
+def set_codec(name):
+    """
+    Select the codec used to write data files outside ndjson mode.
+
+    Args:
+        name (str): One of "json", "compact-json", "gzip-json" or
+            "pickle".
+
+    Raises:
+        ValueError: If the codec is not supported.
+    """
+    if name not in CODECS:
+        raise ValueError(f"Unknown codec: {name}")
+    _settings["codec"] = name
+
+
+def get_codec():
+    """
+    Return the name of the current codec.
+
+    Returns:
+        str: One of "json", "compact-json", "gzip-json" or "pickle".
+    """
+    return _settings["codec"]
 
-    If the file does not exist or contains invalid JSON, an error is
-    printed to the console and an empty list is returned.
+
+def _current_codec():
+    """
+    Return the current codec, falling back to indented JSON if the
+    environment names an unknown one.
+    """
+    return CODECS.get(_settings["codec"], CODECS[JSON_CODEC])
+
+
+def journal_path(file_path):
+    """
+    Return the path of the journal kept for the given data file.
 
     Args:
         file_path (str): Path to the JSON file.
 
     Returns:
-        list: The data loaded from the file.
+        str: Path to the journal file.
     """
-    if not os.path.exists(file_path):
+    return file_path + JOURNAL_SUFFIX
+
+
+def journal_length(file_path):
+    """
+    Return the number of records in the journal of the given data file,
+    as seen by the last load or append made by this process.
+
+    Args:
+        file_path (str): Path to the JSON file.
+
+    Returns:
+        int: Number of journal records.
+    """
+    return _journal_lengths.get(file_path, 0)
+
+
+def needs_snapshot(file_path):
+    """
+    Check whether the journal of the given file is long enough for a new
+    snapshot to be written.
+
+    Args:
+        file_path (str): Path to the JSON file.
+
+    Returns:
+        bool: True if a snapshot should be written.
+    """
+    return (
+        _settings["mode"] == JOURNAL_MODE
+        and journal_length(file_path) >= _settings["snapshot_interval"]
+    )
+
+
+def file_signature(file_path):
+    """
+    Return a cheap fingerprint of a data file and its journal, used to
+    detect changes without reading them.
+
+    The journal is only ever appended to between snapshots, so its size
+    alone tells how much of it has been read.
+
+    Args:
+        file_path (str): Path to the JSON file.
+
+    Returns:
+        tuple: (mtime_ns, size, inode) of the data file and (size, inode)
+        of the journal, each None if the file does not exist.
+    """
+    try:
+        stat = os.stat(file_path)
+        snapshot = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+    except OSError:
+        snapshot = None
+    try:
+        stat = os.stat(journal_path(file_path))
+        journal = (stat.st_size, stat.st_ino)
+    except OSError:
+        journal = None
+    return (snapshot, journal)
+
+
+@timed("read_journal_tail")
+def read_journal_tail(file_path, signature):
+    """
+    Read the journal records appended since a file signature was taken.
+
+    Args:
+        file_path (str): Path to the JSON file.
+        signature (tuple): A value returned by file_signature.
+
+    Returns:
+        tuple or None: (entries, signature), where entries are the new
+        journal records and signature covers exactly the records read, or
+        None if the data file was rewritten since and must be reloaded.
+    """
+    current = file_signature(file_path)
+    if signature is None or current[0] != signature[0]:
+        return None
+    if current[1] is None:
+        return None if signature[1] is not None else ([], current)
+    offset = 0
+    if signature[1] is not None:
+        if signature[1][1] != current[1][1] or signature[1][0] > current[1][0]:
+            return None
+        offset = signature[1][0]
+    entries = []
+    try:
+        with open(journal_path(file_path), "rb") as f:
+            f.seek(offset)
+            data = f.read()
+    except IOError as e:
+        print(f"Error reading {journal_path(file_path)}: {e}")
+        return None
+    record_bytes("read_journal_tail", read=len(data))
+    # Leave a line that is still being written for the next read.
+    data = data[:data.rfind(b"\n") + 1]
+    for line in data.splitlines():
+        entry = _decode_entry(journal_path(file_path), line)
+        if entry is not None:
+            entries.append(entry)
+    return entries, (current[0], (offset + len(data), current[1][1]))
+
+
+def configure_cache(max_bytes=CACHE_MAX_BYTES):
+    """
+    Set the memory limit of the parse cache.
+
+    The limit is measured in bytes of file content, which is a lower bound
+    of the memory used by the parsed data. Files larger than the limit are
+    never cached, and a limit of 0 disables the cache.
+
+    Args:
+        max_bytes (int, optional): The new limit. Defaults to
+            CACHE_MAX_BYTES.
+    """
+    with _cache_lock:
+        _cache["max_bytes"] = max_bytes
+        _evict()
+
+
+def clear_cache():
+    """
+    Drop every cached file and reset the cache counters.
+    """
+    with _cache_lock:
+        _cache["entries"].clear()
+        _cache["bytes"] = 0
+        _cache["hits"] = _cache["misses"] = _cache["evictions"] = 0
+
+
+def cache_stats():
+    """
+    Return the counters of the parse cache.
+
+    Returns:
+        dict: hits, misses, evictions, entries, bytes and max_bytes.
+    """
+    with _cache_lock:
+        return {
+            "hits": _cache["hits"],
+            "misses": _cache["misses"],
+            "evictions": _cache["evictions"],
+            "entries": len(_cache["entries"]),
+            "bytes": _cache["bytes"],
+            "max_bytes": _cache["max_bytes"],
+        }
+
+
+def _evict():
+    """
+    Drop the least recently used files until the cache fits its limit.
+    Must be called with the cache lock held.
+    """
+    entries = _cache["entries"]
+    while entries and _cache["bytes"] > _cache["max_bytes"]:
+        _, (_, _, size) = entries.popitem(last=False)
+        _cache["bytes"] -= size
+        _cache["evictions"] += 1
+
+
+def _cache_size(signature):
+    """
+    Return the number of bytes of file content behind a signature.
+    """
+    snapshot, journal = signature
+    return (snapshot[1] if snapshot else 0) + (journal[0] if journal else 0)
+
+
+def _cache_get(file_path, signature):
+    """
+    Return the cached data of a file if it is still valid, else None.
+    """
+    with _cache_lock:
+        entry = _cache["entries"].get(file_path)
+        if entry is None or entry[0] != signature:
+            _cache["misses"] += 1
+            return None
+        _cache["entries"].move_to_end(file_path)
+        _cache["hits"] += 1
+        return entry[1]
+
+
+def _cache_put(file_path, signature, data):
+    """
+    Store the parsed data of a file under its signature.
+    """
+    size = _cache_size(signature)
+    with _cache_lock:
+        _cache_drop(file_path)
+        if size > _cache["max_bytes"]:
+            return
+        _cache["entries"][file_path] = (signature, data, size)
+        _cache["bytes"] += size
+        _evict()
+
+
+def _cache_drop(file_path):
+    """
+    Remove a file from the cache. Must be called with the cache lock held.
+    """
+    entry = _cache["entries"].pop(file_path, None)
+    if entry is not None:
+        _cache["bytes"] -= entry[2]
+
+
+def _decode_entry(path, line):
+    """
+    Decode one journal line, returning None for blank or damaged lines.
+    """
+    if not line.strip():
+        return None
+    try:
+        return json.loads(line)
+    except (json.JSONDecodeError, UnicodeDecodeError) as e:
+        print(f"Error reading {path}: {e}")
+        return None
+
+
+def detect_format(file_path):
+    """
+    Detect the format of a data file from its first bytes.
+
+    Compact and indented JSON arrays are both reported as "json", and are
+    read the same way. A file reported as "pickle" is only loaded if the
+    pickle codec is selected (see PickleCodec).
+
+    Args:
+        file_path (str): Path to the data file.
+
+    Returns:
+        str or None: "json", "ndjson", "gzip-json" or "pickle", or None if
+        the file does not exist or holds only whitespace.
+
+    Raises:
+        OSError: If the file exists but cannot be read.
+    """
+    try:
+        with open(file_path, "rb") as f:
+            chunk = f.read(64)
+            if chunk.startswith(b"\x1f\x8b"):
+                return GZIP_JSON_CODEC
+            if chunk.startswith(b"\x80"):
+                return PICKLE_CODEC
+            while chunk:
+                chunk = chunk.lstrip()
+                if chunk:
+                    if chunk.startswith(b"["):
+                        return JSON_CODEC
+                    return NDJSON_FORMAT
+                chunk = f.read(64)
+            return None
+    except FileNotFoundError:
+        return None
+
+
+def is_ndjson(file_path):
+    """
+    Check whether a data file holds one JSON record per line rather than a
+    JSON array.
+
+    Args:
+        file_path (str): Path to the data file.
+
+    Returns:
+        bool: True if the file exists and is in the ndjson format.
+    """
+    return detect_format(file_path) == NDJSON_FORMAT
+
+
+def _iter_ndjson(file_path):
+    """
+    Iterate over the records of a newline-delimited JSON file, skipping
+    blank lines.
+
+    Raises:
+        ValueError: If a line is not valid JSON.
+    """
+    with open(file_path, "rb") as f:
+        for number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except (json.JSONDecodeError, UnicodeDecodeError) as e:
+                raise ValueError(
+                    f"Invalid record on line {number} of {file_path}: {e}"
+                ) from e
+
+
+def _load_snapshot(file_path):
+    """
+    Load the list stored in the given data file, in any format.
+
+    Args:
+        file_path (str): Path to the data file.
+
+    Returns:
+        list: The data loaded from the file, or an empty list if it does
+        not exist.
+
+    Raises:
+        ValueError: If the file cannot be decoded, or is a pickle and the
+            pickle codec is not selected.
+        OSError: If the file exists but cannot be read.
+    """
+    file_format = detect_format(file_path)
+    if file_format is None:
         return []
+    if file_format == PICKLE_CODEC and get_codec() != PICKLE_CODEC:
+        raise ValueError(
+            f"{file_path} was written with the pickle codec, which is not "
+            "selected")
+    if file_format == NDJSON_FORMAT:
+        return list(_iter_ndjson(file_path))
     try:
-        # Check if the file is empty.
-        if os.path.getsize(file_path) == 0:
-            return []
-        with open(file_path, "r", encoding="utf-8") as f:
-            data = json.load(f)
+        with open(file_path, "rb") as f:
+            return CODECS[file_format].load(f)
+    except (EOFError, pickle.UnpicklingError, gzip.BadGzipFile,
+            zlib.error) as e:
+        raise ValueError(f"Cannot decode {file_path}: {e}") from e
+
+
+def _replay_journal(file_path, data):
+    """
+    Apply the journal of the given data file on top of its snapshot.
+
+    Journal records carry the full state of a record rather than a delta,
+    so replaying a record that is already part of the snapshot is harmless.
+    Damaged lines, left by an interrupted append, are skipped.
+
+    Args:
+        file_path (str): Path to the JSON file.
+        data (list): The records loaded from the snapshot.
+
+    Returns:
+        list: The records with the journal applied.
+    """
+    path = journal_path(file_path)
+    _journal_lengths[file_path] = 0
+    if not os.path.exists(path):
         return data
-    except (json.JSONDecodeError, IOError) as e:
-        print(f"Error reading {file_path}: {e}")
-        return []
+    records = []
+    positions = None
+    count = 0
+    try:
+        with open(path, "rb") as f:
+            for line in f:
+                entry = _decode_entry(path, line)
+                if entry is None:
+                    continue
+                if positions is None:
+                    # Index the snapshot by the journal's key, keeping the
+                    # first record of duplicated IDs.
+                    positions = {}
+                    for record in data:
+                        record_id = record.get(entry["key"])
+                        if record_id not in positions:
+                            positions[record_id] = len(records)
+                            records.append(record)
+                record_id = entry["id"]
+                position = positions.get(record_id)
+                if entry["op"] == "put":
+                    if position is None:
+                        positions[record_id] = len(records)
+                        records.append(entry["record"])
+                    else:
+                        records[position] = entry["record"]
+                elif position is not None:
+                    records[position] = None
+                    del positions[record_id]
+                count += 1
+    except IOError as e:
+        print(f"Error reading {path}: {e}")
+    _journal_lengths[file_path] = count
+    if positions is None:
+        return data
+    return [record for record in records if record is not None]
 
 
-def save_data(file_path, data):
+def iter_json_array(file_path, chunk_size=65536):
     """
-    Save data to the given JSON file.
+    Iterate over the elements of a JSON array file without loading the
+    whole file, reading it in fixed-size chunks.
 
     Args:
         file_path (str): Path to the JSON file.
-        data (list): Data to be saved.
+        chunk_size (int, optional): Number of characters read at a time.
+
+    Yields:
+        The decoded elements of the array, in order.
+
+    Raises:
+        ValueError: If the file does not contain a valid JSON array.
     """
+    if not os.path.exists(file_path):
+        return
+    with open(file_path, "r", encoding="utf-8") as f:
+        yield from _iter_array(f, file_path, chunk_size)
+
+
+def _iter_array(f, file_path, chunk_size):
+    """
+    Iterate over the elements of a JSON array read from a text file
+    object. See iter_json_array.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    position = 0
+    opened = False
+    need_more = True
+    while True:
+        if need_more:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                if not opened and not buffer[position:].strip():
+                    return
+                raise ValueError(f"Invalid JSON array in {file_path}")
+            buffer = buffer[position:] + chunk
+            position = 0
+            need_more = False
+        # Skip whitespace, and the commas between elements.
+        separators = " \t\r\n," if opened else " \t\r\n"
+        while position < len(buffer) and buffer[position] in separators:
+            position += 1
+        if position == len(buffer):
+            need_more = True
+            continue
+        if not opened:
+            if buffer[position] != "[":
+                raise ValueError(f"{file_path} is not a JSON array")
+            opened = True
+            position += 1
+            continue
+        if buffer[position] == "]":
+            return
+        try:
+            element, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            need_more = True
+            continue
+        # A number cut at the end of a chunk still decodes, so only
+        # accept an element once the character after it has been read.
+        if end == len(buffer):
+            need_more = True
+            continue
+        position = end
+        yield element
+
+
+def iter_snapshot(file_path):
+    """
+    Iterate over the records stored in a data file, in any format. The
+    journal is not applied.
+
+    JSON files, compressed or not, are read without loading the whole
+    file. Pickle files can only be loaded whole, and only while the pickle
+    codec is selected.
+
+    Args:
+        file_path (str): Path to the data file.
+
+    Yields:
+        The records of the file, in order.
+
+    Raises:
+        ValueError: If a JSON array file is not valid, or the file is a
+            pickle and the pickle codec is not selected.
+    """
+    file_format = detect_format(file_path)
+    if file_format == NDJSON_FORMAT:
+        yield from _iter_ndjson(file_path)
+    elif file_format == GZIP_JSON_CODEC:
+        with gzip.open(file_path, "rt", encoding="utf-8") as f:
+            yield from _iter_array(f, file_path, 65536)
+    elif file_format == PICKLE_CODEC:
+        with open(file_path, "rb") as f:
+            yield from CODECS[PICKLE_CODEC].load(f)
+    elif file_format is not None:
+        yield from iter_json_array(file_path)
+
+
+def _read_journal_state(file_path):
+    """
+    Return the last journaled state of each record, as a dict mapping each
+    ID to its record or to None if it was deleted, and the journal's key.
+    """
+    path = journal_path(file_path)
+    states = {}
+    key = None
+    if not os.path.exists(path):
+        return states, key
     try:
-        with open(file_path, "w", encoding="utf-8") as f:
-            json.dump(data, f, indent=4)
+        with open(path, "rb") as f:
+            for line in f:
+                entry = _decode_entry(path, line)
+                if entry is None:
+                    continue
+                key = entry["key"]
+                states[entry["id"]] = (
+                    entry["record"] if entry["op"] == "put" else None)
     except IOError as e:
+        print(f"Error reading {path}: {e}")
+    return states, key
+
+
+def iter_records(file_path):
+    """
+    Iterate over the records of a data file one at a time, with its journal
+    applied, so callers can stop as soon as they find what they need.
+
+    Memory use is bounded by the size of the journal, not of the file.
+    Records the journal changes are yielded in their journaled state, and
+    records it adds are yielded after those of the file.
+
+    Args:
+        file_path (str): Path to the data file.
+
+    Yields:
+        dict: The records, in the order load_data returns them.
+
+    Raises:
+        ValueError: If a JSON array file is not valid.
+    """
+    states, key = _read_journal_state(file_path)
+    seen = set()
+    for record in iter_snapshot(file_path):
+        if key is None:
+            yield record
+            continue
+        record_id = record.get(key)
+        if record_id not in states:
+            yield record
+        elif record_id not in seen:
+            # Later duplicates are hidden behind the first occurrence.
+            seen.add(record_id)
+            if states[record_id] is not None:
+                yield states[record_id]
+    for record_id, record in states.items():
+        if record_id not in seen and record is not None:
+            yield record
+
+
+def find_record(file_path, key, record_id):
+    """
+    Find a record by its ID, stopping at the first match.
+
+    Args:
+        file_path (str): Path to the data file.
+        key (str): Name of the field that identifies each record.
+        record_id: The ID of the record.
+
+    Returns:
+        dict or None: The record if found, else None.
+    """
+    for record in iter_records(file_path):
+        if record.get(key) == record_id:
+            return record
+    return None
+
+
+@timed("load_data")
+def load_data(file_path):
+    """
+    Load data from the given JSON file.
+
+    If the file does not exist, an empty list is returned. A file that
+    exists but cannot be decoded raises rather than loading as empty, as
+    the next save would write the empty list over it. If a journal exists
+    for the file, it is replayed on top of the loaded data.
+
+    The file is only parsed if it changed since it was last loaded or
+    saved. The returned list and its records are copies, but nested values
+    are shared with the cache and must not be modified in place.
+
+    Args:
+        file_path (str): Path to the JSON file.
+
+    Returns:
+        list: The data loaded from the file.
+
+    Raises:
+        ValueError: If the file cannot be decoded, or is a pickle and the
+            pickle codec is not selected.
+        OSError: If the file exists but cannot be read.
+    """
+    signature = file_signature(file_path)
+    data = _cache_get(file_path, signature)
+    if data is None:
+        data = _replay_journal(file_path, _load_snapshot(file_path))
+        _cache_put(file_path, signature, data)
+        record_bytes("load_data", read=_cache_size(signature))
+    return [dict(record) if isinstance(record, dict) else record
+            for record in data]
+
+
+def _write_file(file_path, write, binary=False):
+    """
+    Atomically replace a data file with the output of a writer.
+
+    The writer is called with a file object in the same directory, which
+    then replaces the data file once it is flushed to disk. The new file
+    is a complete snapshot, so any journal kept for the file is removed
+    afterwards.
+
+    Args:
+        file_path (str): Path to the data file.
+        write (callable): Called with the file object to write to.
+        binary (bool, optional): Whether the file object is opened in
+            binary mode rather than as UTF-8 text.
+
+    Returns:
+        bool: True if the file was replaced, False if an error was printed.
+    """
+    directory, name = os.path.split(file_path)
+    temp_path = None
+    try:
+        fd, temp_path = tempfile.mkstemp(
+            dir=directory or ".", prefix=f".{name}.", suffix=".tmp")
+        # mkstemp creates the file private; keep the data file's mode.
+        try:
+            mode = os.stat(file_path).st_mode & 0o777
+        except OSError:
+            mode = 0o644
+        os.chmod(temp_path, mode)
+        with (os.fdopen(fd, "wb") if binary
+              else os.fdopen(fd, "w", encoding="utf-8")) as f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, file_path)
+        temp_path = None
+        if os.path.exists(journal_path(file_path)):
+            os.remove(journal_path(file_path))
+        _journal_lengths[file_path] = 0
+        return True
+    except (IOError, ValueError, pickle.PicklingError) as e:
         print(f"Error writing to {file_path}: {e}")
+        return False
+    finally:
+        if temp_path is not None and os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def _write_ndjson(f, records):
+    """
+    Write records to a file object, one compact JSON document per line.
+    """
+    for record in records:
+        f.write(json.dumps(record, separators=(",", ":")))
+        f.write("\n")
+
+
+@timed("save_data")
+def save_data(file_path, data):
+    """
+    Save data to the given data file.
+
+    The data is written to a temporary file in the same directory, which
+    then atomically replaces the data file. The saved data is a complete
+    snapshot, so any journal kept for the file is removed afterwards. In
+    ndjson mode the file holds one record per line; otherwise it is
+    written by the current codec.
+
+    Args:
+        file_path (str): Path to the data file.
+        data (list): Data to be saved.
+    """
+    if _settings["mode"] == NDJSON_MODE:
+        saved = _write_file(file_path, lambda f: _write_ndjson(f, data))
+    else:
+        codec = _current_codec()
+        saved = _write_file(file_path, lambda f: codec.dump(data, f),
+                            binary=True)
+    if saved:
+        signature = file_signature(file_path)
+        record_bytes("save_data", written=_cache_size(signature))
+        _cache_put(file_path, signature, [
+            dict(record) if isinstance(record, dict) else record
+            for record in data
+        ])
+
+
+@timed("rewrite_records")
+def rewrite_records(file_path, key, mutations=(), ndjson=None, codec=None):
+    """
+    Apply mutations to a data file by streaming it through a temporary
+    file, so that memory use depends on the number of mutations rather
+    than on the size of the file.
+
+    A put replaces the first record with the same ID, or is appended if
+    there is none; a delete removes every record with the ID. The journal,
+    if any, is folded into the new file.
+
+    Args:
+        file_path (str): Path to the data file.
+        key (str): Name of the field that identifies each record.
+        mutations (iterable, optional): (op, record_id, record) tuples, as
+            for append_journal_batch.
+        ndjson (bool, optional): Whether to write one record per line.
+            Defaults to True in ndjson mode, False otherwise.
+        codec (str, optional): Name of the codec writing the file when
+            ndjson is False. Defaults to the current codec. Pickle files
+            are built in memory before they are written.
+    """
+    if ndjson is None:
+        ndjson = _settings["mode"] == NDJSON_MODE
+    codec = CODECS[codec] if codec is not None else _current_codec()
+    states = {
+        record_id: record if op == "put" else None
+        for op, record_id, record in mutations
+    }
+
+    def records():
+        seen = set()
+        for record in iter_records(file_path):
+            record_id = record.get(key) if states else None
+            if record_id not in states:
+                yield record
+            elif record_id not in seen:
+                seen.add(record_id)
+                if states[record_id] is not None:
+                    yield states[record_id]
+        for record_id, record in states.items():
+            if record_id not in seen and record is not None:
+                yield record
+
+    with _cache_lock:
+        _cache_drop(file_path)
+    read = _cache_size(file_signature(file_path))
+    if ndjson:
+        written = _write_file(file_path,
+                              lambda f: _write_ndjson(f, records()))
+    else:
+        written = _write_file(file_path,
+                              lambda f: codec.dump(records(), f),
+                              binary=True)
+    if written:
+        record_bytes("rewrite_records", read=read,
+                     written=_cache_size(file_signature(file_path)))
+
+
+def convert_file(file_path, ndjson=True, codec=None):
+    """
+    Convert a data file between the newline-delimited format and the
+    formats written by the codecs, streaming it one record at a time.
+
+    Args:
+        file_path (str): Path to the data file.
+        ndjson (bool, optional): True to write one record per line, False
+            to write the file with a codec.
+        codec (str, optional): Name of the codec to write the file with.
+            Defaults to the current codec.
+    """
+    rewrite_records(file_path, None, (), ndjson, codec)
+
+
+def append_journal(file_path, key, op, record_id, record=None):
+    """
+    Append a single mutation to the journal of the given data file.
+
+    Args:
+        file_path (str): Path to the JSON file.
+        key (str): Name of the field that identifies each record.
+        op (str): Either "put" or "delete".
+        record_id: The ID of the mutated record.
+        record (dict, optional): The full record for "put" operations.
+    """
+    append_journal_batch(file_path, key, [(op, record_id, record)])
+
+
+@timed("append_journal")
+def append_journal_batch(file_path, key, mutations):
+    """
+    Append several mutations to the journal of the given data file with a
+    single write.
+
+    Args:
+        file_path (str): Path to the JSON file.
+        key (str): Name of the field that identifies each record.
+        mutations (list): (op, record_id, record) tuples, where op is
+            either "put" or "delete" and record is only used for "put".
+    """
+    lines = []
+    for op, record_id, record in mutations:
+        entry = {"op": op, "key": key, "id": record_id}
+        if op == "put":
+            entry["record"] = record
+        lines.append(json.dumps(entry) + "\n")
+    if not lines:
+        return
+    path = journal_path(file_path)
+    data = "".join(lines).encode("utf-8")
+    try:
+        fd = os.open(path, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            size = os.fstat(fd).st_size
+            # Start on a fresh line if an earlier append was interrupted.
+            if size and os.pread(fd, 1, size - 1) != b"\n":
+                data = b"\n" + data
+            os.write(fd, data)
+        finally:
+            os.close(fd)
+        record_bytes("append_journal", written=len(data))
+        with _cache_lock:
+            _cache_drop(file_path)
+        _journal_lengths[file_path] = journal_length(file_path) + len(lines)
+    except OSError as e:
+        print(f"Error writing to {path}: {e}")
@@ -0,0 +1,190 @@
+"""
+records.py
+
+This module defines CompactRecord, a memory-lean in-memory form for the
+records of a store. A record keeps each known field in a __slots__ entry
+instead of a per-record dictionary, which more than halves the memory held
+per record for stores with millions of small records, such as customers
+and reservations.
+
+Compact records behave like the dictionaries they replace (get, item
+access, update, iteration), so repositories, indexes and mutators work on
+them directly. Fields missing from the stored record stay missing, and
+fields the class does not know about are kept aside, so converting back
+with to_dict gives the stored record unchanged. String fields holding
+values that repeat across records, such as dates, can be interned so every
+record shares one copy.
+"""
+
+import sys
+
+# Marks a known field that is absent from the record.
+_MISSING = object()
+
+
+class CompactRecord:
+    """
+    Base class of the compact record types. Subclasses list their fields
+    in both __slots__ and FIELDS.
+    """
+
+    __slots__ = ("_extra",)
+
+    # Names of the fields kept in slots, in stored order.
+    FIELDS = ()
+
+    # Names of the string fields whose values are interned.
+    INTERNED = ()
+
+    def __init__(self, data=()):
+        """
+        Initialize a record from a dictionary.
+
+        Args:
+            data (dict, optional): The stored record.
+        """
+        data = data if isinstance(data, dict) else dict(data)
+        present = 0
+        for field in self.FIELDS:
+            value = data.get(field, _MISSING)
+            if value is not _MISSING:
+                present += 1
+                if field in self.INTERNED and isinstance(value, str):
+                    value = sys.intern(value)
+            setattr(self, field, value)
+        self._extra = None
+        if len(data) > present:
+            self._extra = {
+                key: value for key, value in data.items()
+                if key not in self.FIELDS
+            }
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Create a record from its stored form.
+
+        Args:
+            data (dict): The stored record.
+
+        Returns:
+            CompactRecord: A new record.
+        """
+        return cls(data)
+
+    def to_dict(self):
+        """
+        Convert the record back to its stored form.
+
+        Returns:
+            dict: A new dictionary with the fields of the record.
+        """
+        data = {}
+        for field in self.FIELDS:
+            value = getattr(self, field)
+            if value is not _MISSING:
+                data[field] = value
+        if self._extra:
+            data.update(self._extra)
+        return data
+
+    def get(self, key, default=None):
+        """
+        Return the value of a field, or default if it is absent.
+        """
+        if key in self.FIELDS:
+            value = getattr(self, key)
+            return default if value is _MISSING else value
+        return self._extra.get(key, default) if self._extra else default
+
+    def __getitem__(self, key):
+        """
+        Return the value of a field.
+
+        Raises:
+            KeyError: If the field is absent.
+        """
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        """
+        Set the value of a field.
+        """
+        if key in self.FIELDS:
+            if key in self.INTERNED and isinstance(value, str):
+                value = sys.intern(value)
+            setattr(self, key, value)
+        elif self._extra is None:
+            self._extra = {key: value}
+        else:
+            self._extra[key] = value
+
+    def __contains__(self, key):
+        """
+        Check whether a field is present.
+        """
+        return self.get(key, _MISSING) is not _MISSING
+
+    def keys(self):
+        """
+        Return the names of the present fields.
+        """
+        return self.to_dict().keys()
+
+    def items(self):
+        """
+        Return the (name, value) pairs of the present fields.
+        """
+        return self.to_dict().items()
+
+    def __iter__(self):
+        """
+        Iterate over the names of the present fields.
+        """
+        return iter(self.keys())
+
+    def __len__(self):
+        """
+        Return the number of present fields.
+        """
+        return len(self.keys())
+
+    def update(self, data):
+        """
+        Set several fields from a dictionary or another record.
+        """
+        for key, value in data.items():
+            self[key] = value
+
+    def __eq__(self, other):
+        """
+        Compare with another record or a dictionary, field by field.
+        """
+        if isinstance(other, (CompactRecord, dict)):
+            return self.to_dict() == dict(other.items())
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        """
+        Return the representation of the record as a dictionary.
+        """
+        return f"{type(self).__name__}({self.to_dict()!r})"
+
+
+def encode(record):
+    """
+    Convert a compact record to its stored form. Usable as the encode
+    function of a Repository.
+
+    Args:
+        record (CompactRecord): The in-memory record.
+
+    Returns:
+        dict: The stored record.
+    """
+    return record.to_dict()
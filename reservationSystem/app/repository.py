@@ -0,0 +1,938 @@
+"""
+repository.py
+
+This module defines the Repository class, an in-memory view of a
+persistence store indexed by record ID. Each store is loaded once and kept
+in an ID-keyed dictionary, so single-record reads and writes are O(1).
+Every mutation is written through to disk immediately, and the store is
+re-read only when it has been changed by someone else.
+
+Records are read and written through the active storage backend (see
+storage.py). With the JSON backend in journal mode, a mutation appends a
+single record to the file's journal instead of rewriting the whole file,
+and changes made by other processes are picked up by reading only the
+records they appended.
+
+Mutations hold the backend's write lock for the records they touch (see
+locking.py) and re-check the store before applying, so concurrent writers
+in other processes never overwrite each other's changes.
+
+Records may be kept in memory in a richer form than the one stored on disk
+by passing decode and encode functions, which convert between the two.
+Secondary indexes (see indexes.py) are kept up to date with every change.
+
+Reads never wait for writers: get, read, contains and len use the latest
+published version of the records (see snapshot.py). Writers change
+private copies of the records and publish a new version once their change
+is written, so readers only ever see committed records, and always a
+whole record. Index queries and all() still take the repository lock.
+
+A transaction (see transaction.py) changes several repositories through
+the staging methods, which change the records in memory and leave writing
+and publishing them to the transaction.
+
+New records may be given IDs by the repository (see ids.py). IDs are
+checked for uniqueness with a single lookup, under the write lock, so two
+writers can never create records with the same ID.
+"""
+
+import contextlib
+import os
+import threading
+
+from app.ids import get_allocator
+from app.snapshot import EMPTY, RecordMap, current, forget, publish
+from app.storage import get_backend
+
+# Counts the stores whose write locks each thread holds.
+_held = threading.local()
+
+
+class Repository:  # pylint: disable=too-many-public-methods
+    """
+    An ID-indexed, write-through cache of the records of one store.
+    """
+
+    def __init__(self, file_path, key, decode=None, encode=None,
+                 indexes=None):
+        """
+        Initialize a Repository instance.
+
+        Args:
+            file_path (str): Path identifying the store backing the
+                repository.
+            key (str): Name of the field that identifies each record.
+            decode (callable, optional): Converts a stored record, or a
+                partial record used as an update, to its in-memory form.
+                Must return a new dictionary, or a dict-like object such
+                as a CompactRecord (see records.py). Defaults to a shallow
+                copy.
+            encode (callable, optional): Converts an in-memory record back
+                to its stored form. Must return a new dictionary.
+                Defaults to a shallow copy. A record about to be changed in
+                place is first copied with encode then decode, so together
+                they must copy every value that mutators change in place.
+            indexes (dict, optional): Maps names to the Index instances
+                maintained over the records.
+        """
+        self.file_path = file_path
+        self.key = key
+        self._decode = decode or dict
+        self._encode = encode or dict
+        self._records = {}
+        self._backend = None
+        self._signature = None
+        self._indexes = dict(indexes or {})
+        self._lock = threading.RLock()
+        # Changes not published yet: the changed IDs, whether the records
+        # were reloaded as a whole, and the records already copied.
+        self._dirty = {}
+        self._rebuilt = False
+        self._private = set()
+        # Number of open write sections that publish when their
+        # transaction ends.
+        self._deferred = 0
+
+    def _sync(self):
+        """
+        Bring the records up to date with the backing store if it changed
+        since the last time it was read or written by this repository, or
+        if another storage backend was selected.
+        """
+        backend = get_backend()
+        signature = backend.signature(self.file_path)
+        if backend is self._backend and signature == self._signature:
+            return
+        if backend is self._backend:
+            changes = backend.changes(self.file_path, self._signature,
+                                      self.key)
+            if changes is not None:
+                mutations, self._signature = changes
+                self._apply(mutations)
+                return
+        records = {}
+        for record in backend.load(self.file_path, self.key):
+            # Keep the first record for duplicated IDs, which is the one
+            # a linear scan would have found.
+            record_id = record.get(self.key)
+            if record_id not in records:
+                records[record_id] = self._decode(record)
+        self._records = records
+        self._backend = backend
+        self._signature = signature
+        self._dirty = {}
+        self._rebuilt = True
+        for index in self._indexes.values():
+            index.rebuild(records)
+
+    def _apply(self, mutations):
+        """
+        Apply mutations made by another writer to the in-memory records.
+
+        Args:
+            mutations (list): (op, record_id, record) tuples in stored form.
+        """
+        for op, record_id, record in mutations:
+            if op == "put":
+                self._records[record_id] = self._decode(record)
+            else:
+                self._records.pop(record_id, None)
+        self._reindex(record_id for _, record_id, _ in mutations)
+
+    def _reindex(self, record_ids):
+        """
+        Update the secondary indexes after records changed, and mark the
+        records for the next published version.
+
+        Args:
+            record_ids (iterable): IDs of the changed records.
+        """
+        for record_id in record_ids:
+            self._dirty[record_id] = None
+            if self._indexes:
+                record = self._records.get(record_id)
+                for index in self._indexes.values():
+                    index.update(record_id, record)
+
+    def _writable(self, record_id):
+        """
+        Return a record that may be changed in place, first replacing it
+        with a copy if a published version may still hold it.
+
+        Args:
+            record_id: The ID of the record.
+
+        Returns:
+            The in-memory record, or None if it does not exist.
+        """
+        record = self._records.get(record_id)
+        if (record is not None and record_id not in self._private
+                and record_id not in self._dirty):
+            record = self._decode(self._encode(record))
+            self._records[record_id] = record
+            self._private.add(record_id)
+        return record
+
+    def _next_version(self):
+        """
+        Return the version of the records to publish, and start tracking
+        changes anew.
+
+        Returns:
+            RecordMap: The new version.
+        """
+        if self._rebuilt:
+            version = RecordMap.from_dict(self._records)
+        else:
+            version = (current(self) or EMPTY).evolve({
+                record_id: self._records.get(record_id)
+                for record_id in self._dirty
+            })
+        self._dirty = {}
+        self._rebuilt = False
+        self._private = set()
+        return version
+
+    def _publish(self):
+        """
+        Publish the changes made since the last version, if any.
+        """
+        if self._dirty or self._rebuilt:
+            publish({self: self._next_version()})
+
+    def _undo(self):
+        """
+        Restore the records changed since the last published version,
+        after a change failed before it was published.
+        """
+        version = current(self) or EMPTY
+        for record_id in set(self._dirty) | self._private:
+            record = version.get(record_id)
+            if record is None:
+                self._records.pop(record_id, None)
+            else:
+                self._records[record_id] = record
+            for index in self._indexes.values():
+                index.update(record_id, record)
+        self._dirty = {}
+        self._private = set()
+
+    def _refresh(self):
+        """
+        Bring the records up to date, and publish them unless the calling
+        thread is inside a transaction that has not ended yet. Must be
+        called with the lock held.
+        """
+        self._sync()
+        if not self._deferred:
+            self._publish()
+
+    def invalidate(self):
+        """
+        Forget which version of the store the records hold, so that they
+        are reloaded as a whole on the next access. Must be called with
+        the lock held, such as inside a staging block.
+        """
+        self._backend = None
+        self._signature = None
+
+    @contextlib.contextmanager
+    def _writing(self, record_ids=None, publish_changes=True):
+        """
+        Lock the given records, or the whole store, and bring the records
+        up to date before they are changed.
+
+        Args:
+            record_ids (list, optional): IDs of the records to be changed.
+                If omitted, the whole store is locked.
+            publish_changes (bool, optional): Publish the changes at the
+                end of the block. A transaction passes False and publishes
+                the changes of all its stores together instead.
+        """
+        with self._lock:
+            with self._locked(record_ids):
+                self._sync()
+                if publish_changes:
+                    # Publish what the sync read first, so that a change
+                    # failing part way can be undone from that version.
+                    self._publish()
+                    try:
+                        yield
+                    except BaseException:
+                        self._undo()
+                        raise
+                    self._publish()
+                else:
+                    self._deferred += 1
+                    try:
+                        yield
+                    finally:
+                        self._deferred -= 1
+            self._compact()
+
+    @contextlib.contextmanager
+    def _locked(self, record_ids):
+        """
+        Take the backend's write lock for the given records, or the whole
+        store.
+
+        A process that died while committing a transaction releases its
+        locks before its commit log is replayed, so a thread that holds no
+        other lock replays the logs it finds first. Otherwise it could
+        change records the log would later overwrite.
+
+        Args:
+            record_ids (list): IDs of the records to lock, or None.
+        """
+        # Imported here, as transactions are built on repositories.
+        from app.transaction import pending, recover
+
+        directory = os.path.dirname(self.file_path)
+        depth = getattr(_held, "depth", 0)
+        with contextlib.ExitStack() as stack:
+            stack.enter_context(
+                get_backend().lock(self.file_path, record_ids))
+            while not depth and pending(directory):
+                stack.close()
+                recover(directory)
+                stack.enter_context(
+                    get_backend().lock(self.file_path, record_ids))
+            _held.depth = depth + 1
+            try:
+                yield
+            finally:
+                _held.depth = depth
+
+    def _compact(self):
+        """
+        Rewrite the store as a whole if the backend asks for it, such as
+        when the JSON journal has grown past the snapshot interval.
+        """
+        backend = self._backend
+        if backend is None or not backend.needs_compaction(self.file_path):
+            return
+        with backend.lock(self.file_path):
+            self._refresh()
+            backend.save(self.file_path, self.key,
+                         [self._encode(r) for r in self._records.values()])
+            self._signature = backend.signature(self.file_path)
+
+    def _write_many(self, mutations):
+        """
+        Persist a batch of mutations, already applied in memory and
+        indexed, with a single write.
+
+        Args:
+            mutations (list): (op, record_id) tuples, where op is either
+                "put" or "delete".
+        """
+        if mutations:
+            self._persist(self.encode_mutations(mutations))
+
+    def encode_mutations(self, mutations):
+        """
+        Convert mutations to the (op, record_id, record) tuples written by
+        the backends, with records in stored form.
+
+        Args:
+            mutations (list): (op, record_id) tuples.
+
+        Returns:
+            list: (op, record_id, record) tuples, record being None for
+            deletions.
+        """
+        return [
+            (op, record_id, self._encode(self._records[record_id])
+             if op == "put" else None)
+            for op, record_id in mutations
+        ]
+
+    def _persist(self, mutations):
+        """
+        Write mutations, already applied in memory, to the backend.
+
+        Args:
+            mutations (list): (op, record_id, record) tuples in stored
+                form, as returned by encode_mutations.
+        """
+        signature = self._backend.write(
+            self.file_path,
+            self.key,
+            mutations,
+            lambda: [self._encode(r) for r in self._records.values()],
+            self._signature
+        )
+        if signature is not None:
+            self._signature = signature
+
+    def _first_free_id(self):
+        """
+        Return the lowest integer ID above every existing record.
+        """
+        return max(
+            (record_id for record_id in self._records
+             if isinstance(record_id, int)),
+            default=0
+        ) + 1
+
+    # A transaction (see transaction.py) changes several repositories and
+    # writes them together through the methods below. The stage_* methods
+    # change and index the records in memory only, and must be called
+    # inside a staging block holding the lock of every record they touch.
+    # They return the (op, record_id) changes to write.
+
+    @contextlib.contextmanager
+    def staging(self, record_ids):
+        """
+        Lock records for a transaction and bring them up to date. Changes
+        made in the block are not published when it ends, but by the
+        transaction, through staged_version.
+
+        Args:
+            record_ids (list): IDs of the records to be changed.
+
+        Yields:
+            dict: Maps each ID to its record in stored form, or None if
+            it does not exist, to restore them on rollback.
+        """
+        with self._writing(record_ids, publish_changes=False):
+            checkpoint = {}
+            for record_id in record_ids:
+                if record_id not in checkpoint:
+                    record = self._records.get(record_id)
+                    checkpoint[record_id] = (
+                        self._encode(record) if record is not None else None)
+            yield checkpoint
+
+    def restore(self, states):
+        """
+        Set records to the given states, such as those of a checkpoint
+        when a transaction is rolled back.
+
+        Args:
+            states (dict): Maps record IDs to records in stored form, or
+                to None for records that must not exist.
+        """
+        self._apply([
+            ("put", record_id, record) if record is not None
+            else ("delete", record_id, None)
+            for record_id, record in states.items()
+        ])
+
+    def stage_put_many(self, records):
+        """
+        Insert records, replacing any records with the same IDs. See
+        put_many.
+
+        Args:
+            records (list): The records to store.
+
+        Returns:
+            list: The changes to write.
+        """
+        changes = []
+        for record in records:
+            record_id = record.get(self.key)
+            self._records[record_id] = self._decode(record)
+            changes.append(("put", record_id))
+        self._reindex(record_id for _, record_id in changes)
+        return changes
+
+    def stage_insert_many(self, records):
+        """
+        Insert new records, skipping those whose ID is taken. See
+        insert_many.
+
+        Args:
+            records (list): The records to store.
+
+        Returns:
+            tuple: One bool per record, True if it was inserted, and the
+            changes to write.
+        """
+        inserted = []
+        changes = []
+        for record in records:
+            record_id = record.get(self.key)
+            free = record_id is not None and record_id not in self._records
+            if free:
+                self._records[record_id] = self._decode(record)
+                changes.append(("put", record_id))
+            inserted.append(free)
+        self._reindex(record_id for _, record_id in changes)
+        return inserted, changes
+
+    def stage_mutate_many(self, mutations):
+        """
+        Change records in place. See mutate_many.
+
+        Args:
+            mutations (list): (record_id, mutator) pairs.
+
+        Returns:
+            tuple: The value returned by each mutator, and the changes to
+            write.
+        """
+        results = []
+        changed = {}
+        for record_id, mutator in mutations:
+            record = self._writable(record_id)
+            result = mutator(record) if record is not None else None
+            if result:
+                changed[record_id] = None
+            results.append(result)
+        self._reindex(changed)
+        return results, [("put", record_id) for record_id in changed]
+
+    def stage_update_many(self, patches):
+        """
+        Update existing records. See update_many.
+
+        Args:
+            patches (dict): Maps record IDs to attributes to update.
+
+        Returns:
+            tuple: The IDs of the records that were found and updated, and
+            the changes to write.
+        """
+        updated = []
+        for record_id, new_data in patches.items():
+            if new_data.get(self.key, record_id) != record_id:
+                continue
+            record = self._writable(record_id)
+            if record is not None:
+                record.update(self._decode(new_data))
+                updated.append(record_id)
+        self._reindex(updated)
+        return updated, [("put", record_id) for record_id in updated]
+
+    def stage_delete_many(self, record_ids):
+        """
+        Delete records. See delete_many.
+
+        Args:
+            record_ids (list): The IDs of the records to delete.
+
+        Returns:
+            tuple: The IDs of the records that were found, and the changes
+            to write.
+        """
+        deleted = [
+            record_id for record_id in record_ids
+            if self._records.pop(record_id, None) is not None
+        ]
+        self._reindex(deleted)
+        return deleted, [("delete", record_id) for record_id in deleted]
+
+    def stage_contains_many(self, record_ids):
+        """
+        Check which records exist, counting the changes staged so far.
+
+        Args:
+            record_ids (list): The IDs of the records to check.
+
+        Returns:
+            list: One bool per ID, True if the record exists.
+        """
+        return [record_id in self._records for record_id in record_ids]
+
+    def commit_staged(self, mutations):
+        """
+        Write staged changes to the backend.
+
+        Args:
+            mutations (list): (op, record_id, record) tuples in stored
+                form, as returned by encode_mutations.
+        """
+        self._persist(mutations)
+
+    def staged_version(self):
+        """
+        Return the version of the records to publish once a transaction
+        has ended, and start tracking changes anew.
+
+        Returns:
+            RecordMap or None: The new version, or None if the records did
+            not change.
+        """
+        if not self._dirty and not self._rebuilt:
+            return None
+        return self._next_version()
+
+    def view(self):
+        """
+        Return the latest published version of the records, without
+        waiting for writers.
+
+        The store is re-read first if it was changed by another process,
+        unless a writer of this process is busy with it; the writer then
+        publishes the change itself.
+
+        Returns:
+            RecordMap: An immutable map from record IDs to in-memory
+            records, which must not be modified.
+        """
+        version = current(self)
+        backend = get_backend()
+        if (version is not None and backend is self._backend
+                and backend.signature(self.file_path) == self._signature):
+            return version
+        if self._lock.acquire(blocking=version is None):
+            try:
+                self._refresh()
+            finally:
+                self._lock.release()
+        return current(self) or EMPTY
+
+    def get(self, record_id):
+        """
+        Look up a record by its ID.
+
+        Args:
+            record_id: The ID of the record.
+
+        Returns:
+            dict or None: A shallow copy of the record if found, else None.
+        """
+        record = self.view().get(record_id)
+        return self._encode(record) if record is not None else None
+
+    def read(self, record_id, reader):
+        """
+        Compute a value from a record without copying it.
+
+        Args:
+            record_id: The ID of the record.
+            reader (callable): Called with the in-memory record. It must
+                not modify the record.
+
+        Returns:
+            The value returned by the reader, or None if the record does
+            not exist.
+        """
+        record = self.view().get(record_id)
+        return reader(record) if record is not None else None
+
+    def find(self, name, *args):
+        """
+        Query a secondary index and return the matching records.
+
+        Args:
+            name (str): Name of the index.
+            *args: Arguments passed to the index's query method.
+
+        Returns:
+            list: Shallow copies of the matching records.
+        """
+        with self._lock:
+            self._refresh()
+            return [
+                self._encode(self._records[record_id])
+                for record_id in self._index(name).query(*args)
+            ]
+
+    def contains(self, record_id):
+        """
+        Check whether a record with the given ID exists.
+
+        Args:
+            record_id: The ID of the record.
+
+        Returns:
+            bool: True if the record exists, False otherwise.
+        """
+        return record_id in self.view()
+
+    def all(self):
+        """
+        Return every record in file order.
+
+        Returns:
+            list: Shallow copies of all records.
+        """
+        with self._lock:
+            self._refresh()
+            return [self._encode(r) for r in self._records.values()]
+
+    def add_index(self, name, index):
+        """
+        Start keeping a secondary index up to date, unless one is already
+        registered under the name.
+
+        Args:
+            name (str): Name of the index.
+            index (Index): The index, built here from the current records.
+
+        Returns:
+            Index: The index registered under the name.
+        """
+        with self._lock:
+            self._refresh()
+            if name not in self._indexes:
+                index.rebuild(self._records)
+                self._indexes[name] = index
+            return self._indexes[name]
+
+    def query_index(self, name, query):
+        """
+        Run a query against a secondary index, with the store up to date
+        and no writer changing it meanwhile.
+
+        Args:
+            name (str): Name of the index.
+            query (callable): Called with the index. It must not modify it.
+
+        Returns:
+            The value returned by the query.
+        """
+        with self._lock:
+            self._refresh()
+            return query(self._index(name))
+
+    def _index(self, name):
+        """
+        Return a secondary index, rebuilt first if it went stale. Must be
+        called with the lock held and the records refreshed.
+        """
+        index = self._indexes[name]
+        if index.stale():
+            index.rebuild(self._records)
+        return index
+
+    def allocate_ids(self, count, reserved=()):
+        """
+        Return new IDs that no record uses yet.
+
+        Args:
+            count (int): Number of IDs to return.
+            reserved (collection, optional): Other IDs not to return, such
+                as those of records the caller is about to insert.
+
+        Returns:
+            list: count distinct integer IDs.
+        """
+        def taken(record_id):
+            return record_id in self._records or record_id in reserved
+
+        with self._lock:
+            self._refresh()
+            return get_allocator(self.file_path).allocate(
+                count, taken, self._first_free_id)
+
+    def insert_many(self, records):
+        """
+        Insert several new records and persist them with a single write.
+        Records whose ID is already taken, or appears earlier in the
+        batch, are not inserted.
+
+        Args:
+            records (iterable): The records to store.
+
+        Returns:
+            list: One bool per record, True if it was inserted.
+        """
+        records = list(records)
+        with self._writing([record.get(self.key) for record in records]):
+            inserted, changes = self.stage_insert_many(records)
+            self._write_many(changes)
+        return inserted
+
+    def create_many(self, records, insert=None):
+        """
+        Insert several new records, giving an ID to those without one.
+
+        A record whose ID was given by the caller is rejected if the ID
+        is taken. A record given an allocated ID that was taken meanwhile
+        by another writer is retried with a new ID.
+
+        Args:
+            records (iterable): The records to store. Those given an ID
+                are updated with it.
+            insert (callable, optional): Called with a list of records,
+                inserts them and returns one bool per record, True if it
+                was inserted, such as a function doing so in a
+                transaction. Defaults to insert_many.
+
+        Returns:
+            list: The ID of each record, or None if it was rejected.
+        """
+        records = list(records)
+        ids = [None] * len(records)
+        pending = list(range(len(records)))
+        allocated = {
+            index for index in pending if records[index].get(self.key) is None
+        }
+        while pending:
+            missing = [index for index in pending
+                       if records[index].get(self.key) is None]
+            for index, record_id in zip(missing,
+                                        self.allocate_ids(len(missing))):
+                records[index][self.key] = record_id
+            inserted = (insert or self.insert_many)(
+                [records[index] for index in pending])
+            retry = []
+            for index, created in zip(pending, inserted):
+                if created:
+                    ids[index] = records[index][self.key]
+                elif index in allocated:
+                    records[index][self.key] = None
+                    retry.append(index)
+            pending = retry
+        return ids
+
+    def put(self, record):
+        """
+        Insert a record, replacing any record with the same ID.
+
+        Args:
+            record (dict): The record to store.
+        """
+        self.put_many([record])
+
+    def update(self, record_id, new_data):
+        """
+        Update the fields of an existing record.
+
+        Args:
+            record_id: The ID of the record to modify.
+            new_data (dict): A dictionary of attributes to update.
+
+        Returns:
+            bool: True if the record was found and updated, else False.
+        """
+        return bool(self.update_many({record_id: new_data}))
+
+    def mutate(self, record_id, mutator):
+        """
+        Change a record in place and persist it if the change succeeded.
+
+        Args:
+            record_id: The ID of the record to change.
+            mutator (callable): Called with the in-memory record. It may
+                modify the record and returns a truthy value if it did.
+
+        Returns:
+            The value returned by the mutator, or None if the record does
+            not exist.
+        """
+        return self.mutate_many([(record_id, mutator)])[0]
+
+    def mutate_many(self, mutations):
+        """
+        Change several records in place and persist the changed ones with
+        a single write.
+
+        Args:
+            mutations (iterable): (record_id, mutator) pairs, applied in
+                order. See mutate.
+
+        Returns:
+            list: The value returned by each mutator, or None for records
+            that do not exist.
+        """
+        mutations = list(mutations)
+        with self._writing([record_id for record_id, _ in mutations]):
+            results, changes = self.stage_mutate_many(mutations)
+            self._write_many(changes)
+        return results
+
+    def delete(self, record_id):
+        """
+        Delete a record by its ID.
+
+        Args:
+            record_id: The ID of the record to delete.
+
+        Returns:
+            bool: True if the record was found and deleted, else False.
+        """
+        return bool(self.delete_many([record_id]))
+
+    def put_many(self, records):
+        """
+        Insert several records, replacing any records with the same IDs,
+        and persist them with a single write.
+
+        Args:
+            records (iterable): The records to store.
+        """
+        records = list(records)
+        with self._writing([record.get(self.key) for record in records]):
+            self._write_many(self.stage_put_many(records))
+
+    def update_many(self, patches):
+        """
+        Update several existing records and persist them with a single
+        write. A patch that would change the ID of its record is ignored,
+        as IDs are only checked for uniqueness when records are created.
+
+        Args:
+            patches (dict): Maps each record ID to a dictionary of
+                attributes to update.
+
+        Returns:
+            list: The IDs of the records that were found and updated.
+        """
+        with self._writing(list(patches)):
+            updated, changes = self.stage_update_many(patches)
+            self._write_many(changes)
+        return updated
+
+    def delete_many(self, record_ids):
+        """
+        Delete several records and persist the deletions with a single
+        write.
+
+        Args:
+            record_ids (iterable): The IDs of the records to delete.
+
+        Returns:
+            list: The IDs of the records that were found and deleted.
+        """
+        record_ids = list(record_ids)
+        with self._writing(record_ids):
+            deleted, changes = self.stage_delete_many(record_ids)
+            self._write_many(changes)
+        return deleted
+
+    def __len__(self):
+        """
+        Return the number of records in the repository.
+        """
+        return len(self.view())
+
+
+# Repositories are shared per store so every caller sees the same index.
+_REPOSITORIES = {}
+
+
+def get_repository(file_path, key, decode=None, encode=None, indexes=None):
+    """
+    Return the shared repository for the given store, creating it on first
+    use.
+
+    Args:
+        file_path (str): Path identifying the store backing the repository.
+        key (str): Name of the field that identifies each record.
+        decode (callable, optional): See Repository.
+        encode (callable, optional): See Repository.
+        indexes (callable, optional): Returns the indexes of a new
+            repository. See Repository.
+
+    Returns:
+        Repository: The repository for the store.
+    """
+    repository = _REPOSITORIES.get(file_path)
+    if repository is None:
+        repository = Repository(file_path, key, decode, encode,
+                                indexes() if indexes else None)
+        _REPOSITORIES[file_path] = repository
+    return repository
+
+
+def reset_repositories():
+    """
+    Drop every shared repository so the next access re-reads from disk.
+    """
+    forget(list(_REPOSITORIES.values()))
+    _REPOSITORIES.clear()
@@ -4,10 +4,400 @@ reservation.py
 This module defines the Reservation class which represents a reservation
 entity. It provides methods to create and cancel reservations.
 Creating a reservation automatically reserves a room at the associated hotel.
+A reservation may be limited to the nights from check_in to check_out.
+
+Reservations are indexed by customer and by hotel, so listing those of one
+customer or hotel takes time proportional to the number of results.
+
+Referential integrity is enforced through the ID-keyed repositories and
+these indexes: a reservation is only created for an existing customer,
+checked with a single lookup, and deleting a customer or hotel either
+cancels its reservations or is refused if it has any (see
+delete_with_reservations). Either way the cost depends on the number of
+reservations affected, not on the size of the stores.
+
+Creating and canceling a reservation change the hotel and the reservation
+in one transaction (see transaction.py), so a crash never leaves a room
+held without its reservation. Reservations created concurrently by several
+threads are grouped into shared transactions. Reservation.snapshot returns
+a consistent view of every store, in which each transaction is either
+fully visible or not at all.
+
+The events of a transaction are emitted on the change feed (see events.py)
+in the same commit as its changes; a cascading delete emits the rooms
+released and the canceled reservations before the deleted customer or
+hotel.
 """
 
-from app.persistence import load_data, save_data, RESERVATION_FILE
-from app.hotel import Hotel
+from app.availability import stay_nights, to_date
+from app.persistence import RESERVATION_FILE
+from app.metrics import timed
+from app.indexes import FieldIndex
+from app.records import CompactRecord, encode
+from app.repository import get_repository
+from app.customer import _customers
+from app.events import (
+    CUSTOMER_DELETED,
+    HOTEL_DELETED,
+    RESERVATION_CANCELED,
+    RESERVATION_CREATED,
+    ROOM_RESERVED,
+)
+from app.hotel import (
+    Hotel,
+    _hotels,
+    encode_hotel,
+    hotel_occupancy,
+    reserve_stay,
+)
+from app.snapshot import Snapshot
+from app.transaction import GroupCommit, Transaction
+
+# What deleting a customer or hotel does to its reservations: cancel them
+# too, or keep the customer or hotel if it has any.
+CASCADE = "cascade"
+RESTRICT = "restrict"
+
+# Event emitted for a deleted owner, by reservation index.
+_DELETED_EVENTS = {"customer": CUSTOMER_DELETED, "hotel": HOTEL_DELETED}
+
+# Reasons a reservation is not created.
+NO_CUSTOMER = "Customer not found."
+NO_ROOM = "Failed to create reservation due to room unavailability."
+TAKEN = "Reservation ID already exists."
+
+
+class _ReservationRecord(CompactRecord):
+    """
+    The in-memory form of a stored reservation record. Dates repeat across
+    reservations, so they are interned.
+    """
+
+    __slots__ = FIELDS = ("reservation_id", "hotel_id", "customer_id",
+                          "check_in", "check_out")
+    INTERNED = ("check_in", "check_out")
+
+
+def _indexes():
+    """
+    Return the secondary indexes of a new reservation repository.
+    """
+    return {
+        "customer": FieldIndex("customer_id"),
+        "hotel": FieldIndex("hotel_id"),
+    }
+
+
+def _reservations():
+    """
+    Return the shared repository of reservation records.
+    """
+    return get_repository(RESERVATION_FILE, "reservation_id",
+                          _ReservationRecord.from_dict, encode, _indexes)
+
+
+class _Conflict(Exception):
+    """
+    Raised when a concurrent writer invalidated the checks a transaction
+    made before locking its records. The transaction is rolled back and
+    retried.
+    """
+
+
+def _check_reservations(reservations, allocated, reserved=()):
+    """
+    Check which reservations can be created, giving new IDs to those that
+    need one.
+
+    Args:
+        reservations (list): The Reservation instances to be added.
+        allocated (list): One bool per reservation, True if its ID is given
+            by the repository.
+        reserved (collection, optional): IDs not to give, see
+            Reservation.try_create_reservations.
+
+    Returns:
+        list: One result per reservation: None if it can be created, else
+        the reason why not.
+    """
+    customers = _customers()
+    repository = _reservations()
+    missing = [reservation for reservation, given in
+               zip(reservations, allocated)
+               if given and reservation.reservation_id is None]
+    for reservation, reservation_id in zip(
+            missing, repository.allocate_ids(len(missing), reserved)):
+        reservation.reservation_id = reservation_id
+    errors = []
+    seen = set()
+    for reservation, given in zip(reservations, allocated):
+        # An allocated ID may have been taken by a concurrent writer.
+        while given and repository.contains(reservation.reservation_id):
+            reservation.reservation_id = repository.allocate_ids(
+                1, reserved)[0]
+        if not customers.contains(reservation.customer_id):
+            errors.append(NO_CUSTOMER)
+        elif (reservation.reservation_id in seen
+              or repository.contains(reservation.reservation_id)):
+            errors.append(TAKEN)
+        else:
+            seen.add(reservation.reservation_id)
+            errors.append(None)
+    return errors
+
+
+def _commit_reservations(reservations, reserved=()):
+    """
+    Reserve the rooms of several reservations and store them, in a single
+    transaction. Reservations without an ID are given a new one.
+
+    The customers of the reservations are locked until the transaction
+    commits, so they cannot be deleted while their reservations are
+    created, and the IDs of the reservations are checked for uniqueness
+    under the write lock.
+
+    Args:
+        reservations (list): The Reservation instances to be added.
+        reserved (collection, optional): IDs not to give, see
+            Reservation.try_create_reservations.
+
+    Returns:
+        list: One result per reservation: None if it was created, else the
+        reason why not.
+    """
+    customers = _customers()
+    allocated = [reservation.reservation_id is None
+                 for reservation in reservations]
+    while True:
+        errors = _check_reservations(reservations, allocated, reserved)
+        valid = [
+            reservation
+            for reservation, error in zip(reservations, errors)
+            if error is None
+        ]
+        try:
+            with Transaction() as transaction:
+                created = Hotel.reserve_rooms(
+                    (
+                        (reservation.hotel_id, reservation.reservation_id)
+                        + reservation.stay()
+                        for reservation in valid
+                    ),
+                    transaction
+                )
+                if valid and not all(transaction.stage(customers)
+                                     .contains_many(reservation.customer_id
+                                                    for reservation in valid)):
+                    raise _Conflict
+                records = [
+                    reservation.to_dict()
+                    for reservation, done in zip(valid, created)
+                    if done
+                ]
+                if records and not all(
+                        transaction.stage(_reservations())
+                        .insert_many(records)):
+                    raise _Conflict
+                transaction.emit(RESERVATION_CREATED, _reservations(),
+                                 [record["reservation_id"]
+                                  for record in records])
+        except _Conflict:
+            continue
+        created = iter(created)
+        return [
+            error if error is not None
+            else None if next(created) else NO_ROOM
+            for error in errors
+        ]
+
+
+def _merge_reservations(reservations, hotels):
+    """
+    Store reservations whose rooms were reserved ahead of time on copies
+    of their hotels, in a single transaction.
+
+    A hotel that is unchanged since its copy was taken, and keeps all its
+    reservations, takes over the rooms held by the copy. The reservations of
+    any other hotel have their rooms reserved again, in order, against its
+    current state.
+
+    Args:
+        reservations (list): The Reservation instances to be added, with
+            their IDs.
+        hotels (dict): Maps hotel IDs to (base, result) pairs: the hotel
+            the rooms were reserved on, in stored form, and the in-memory
+            copy of it in which the rooms of all its reservations were
+            reserved.
+
+    Returns:
+        list: One result per reservation: None if it was created, else the
+        reason why not.
+    """
+    customers = _customers()
+    allocated = [False] * len(reservations)
+    counts = {}
+    for reservation in reservations:
+        counts[reservation.hotel_id] = counts.get(reservation.hotel_id, 0) + 1
+    reserved = {}
+
+    def merger(hotel_id, stays):
+        def merge(hotel):
+            base, result = hotels.get(hotel_id, (None, None))
+            if len(stays) == counts[hotel_id] and encode_hotel(hotel) == base:
+                hotel["reserved_rooms"] = hotel_occupancy(result)
+                done = [True] * len(stays)
+            else:
+                # Changed since the copy was taken: reserve again.
+                done = [
+                    reserve_stay(hotel, reservation.reservation_id,
+                                 *reservation.stay())
+                    for reservation in stays
+                ]
+            reserved[hotel_id] = done
+            return any(done)
+        return merge
+
+    while True:
+        errors = _check_reservations(reservations, allocated)
+        stays = {}
+        for reservation, error in zip(reservations, errors):
+            if error is None:
+                stays.setdefault(reservation.hotel_id, []).append(
+                    reservation)
+        reserved.clear()
+        try:
+            with Transaction() as transaction:
+                transaction.stage(_hotels()).mutate_many(
+                    (hotel_id, merger(hotel_id, hotel_stays))
+                    for hotel_id, hotel_stays in stays.items())
+                valid = [
+                    reservation
+                    for hotel_id, done in reserved.items()
+                    for reservation, created in zip(stays[hotel_id], done)
+                    if created
+                ]
+                if valid and not all(transaction.stage(customers)
+                                     .contains_many(reservation.customer_id
+                                                    for reservation in valid)):
+                    raise _Conflict
+                if valid and not all(
+                        transaction.stage(_reservations())
+                        .insert_many(reservation.to_dict()
+                                     for reservation in valid)):
+                    raise _Conflict
+                _emit_created(transaction, valid)
+        except _Conflict:
+            continue
+        created = {reservation.reservation_id for reservation in valid}
+        return [
+            error if error is not None
+            else None if reservation.reservation_id in created else NO_ROOM
+            for reservation, error in zip(reservations, errors)
+        ]
+
+
+def _emit_created(transaction, reservations):
+    """
+    Emit the events of newly created reservations: the room reserved at
+    each hotel, then the reservations themselves.
+
+    Args:
+        transaction (Transaction): The transaction creating them.
+        reservations (list): The Reservation instances created.
+    """
+    transaction.emit(
+        ROOM_RESERVED, _hotels(),
+        [reservation.hotel_id for reservation in reservations],
+        [{"reservation_id": reservation.reservation_id}
+         for reservation in reservations])
+    transaction.emit(
+        RESERVATION_CREATED, _reservations(),
+        [reservation.reservation_id for reservation in reservations])
+
+
+def _referencing(index, owner_ids):
+    """
+    Return the reservations of each customer or hotel.
+
+    Args:
+        index (str): Name of the reservation index, "customer" or "hotel".
+        owner_ids (list): The IDs of the customers or hotels.
+
+    Returns:
+        dict: Maps each ID to the list of its reservations.
+    """
+    reservations = _reservations()
+    return {
+        owner_id: reservations.find(index, owner_id)
+        for owner_id in owner_ids
+    }
+
+
+def delete_with_reservations(owners, index, owner_ids, on_delete=CASCADE):
+    """
+    Delete customers or hotels, and with CASCADE their reservations, in a
+    single transaction.
+
+    The reservations are found through the index by customer or by hotel,
+    so the cost depends on the number of reservations affected. Canceling
+    the reservations of a customer also releases their rooms; those of a
+    deleted hotel need no release, as the hotel record is gone.
+
+    Args:
+        owners (Repository): The repository of the customers or hotels.
+        index (str): Name of the reservation index by owner, "customer" or
+            "hotel".
+        owner_ids (iterable): The IDs of the customers or hotels to delete.
+        on_delete (str, optional): CASCADE to cancel their reservations
+            too, or RESTRICT to keep those that have reservations.
+
+    Returns:
+        list: The IDs of the customers or hotels that were found and
+        deleted.
+
+    Raises:
+        ValueError: If on_delete is neither CASCADE nor RESTRICT.
+    """
+    if on_delete not in (CASCADE, RESTRICT):
+        raise ValueError(f"Unknown on_delete policy: {on_delete!r}")
+    owner_ids = list(owner_ids)
+    while True:
+        found = _referencing(index, owner_ids)
+        if on_delete == RESTRICT:
+            doomed_ids = [owner_id for owner_id in owner_ids
+                          if not found[owner_id]]
+            canceled = []
+        else:
+            doomed_ids = owner_ids
+            canceled = [record for owner_id in owner_ids
+                        for record in found[owner_id]]
+        try:
+            with Transaction() as transaction:
+                if canceled and index != "hotel":
+                    Hotel.cancel_reservations(
+                        [(record.get("hotel_id"),
+                          record.get("reservation_id"))
+                         for record in canceled],
+                        transaction)
+                deleted = transaction.stage(owners).delete_many(doomed_ids)
+                # New reservations may have been made before the owners
+                # were locked.
+                if _referencing(index, owner_ids) != found:
+                    raise _Conflict
+                if canceled:
+                    transaction.emit(
+                        RESERVATION_CANCELED, _reservations(),
+                        transaction.stage(_reservations()).delete_many(
+                            record.get("reservation_id")
+                            for record in canceled))
+                transaction.emit(_DELETED_EVENTS[index], owners, deleted)
+        except _Conflict:
+            continue
+        return deleted
+
+
+# Batches concurrent create_reservation calls into shared transactions.
+_bookings = GroupCommit(_commit_reservations)
 
 
 class Reservation:
@@ -15,18 +405,48 @@ class Reservation:
     A class representing a reservation.
     """
 
-    def __init__(self, reservation_id, hotel_id, customer_id):
+    __slots__ = ("reservation_id", "hotel_id", "customer_id",
+                 "check_in", "check_out")
+
+    def __init__(self, reservation_id, hotel_id, customer_id,
+                 check_in=None, check_out=None):
         """
         Initialize a Reservation instance.
 
         Args:
-            reservation_id (int): Unique identifier for the reservation.
+            reservation_id (int): Unique identifier for the reservation,
+                or None to have one given when it is created.
             hotel_id (int): ID of the hotel where the reservation is made.
             customer_id (int): ID of the customer who made the reservation.
+            check_in (date or str, optional): Arrival date.
+            check_out (date or str, optional): Departure date. Without
+                dates, the reservation holds a room on every night.
+
+        Raises:
+            ValueError: If only one date is given, a date is invalid, or
+                check_out is not after check_in.
         """
         self.reservation_id = reservation_id
         self.hotel_id = hotel_id
         self.customer_id = customer_id
+        self.check_in = None
+        self.check_out = None
+        if check_in is not None or check_out is not None:
+            if check_in is None or check_out is None:
+                raise ValueError("check_in and check_out go together")
+            stay_nights(check_in, check_out)
+            self.check_in = to_date(check_in).isoformat()
+            self.check_out = to_date(check_out).isoformat()
+
+    def stay(self):
+        """
+        Return the dates of the reservation.
+
+        Returns:
+            tuple: (check_in, check_out), both None for reservations
+            without dates.
+        """
+        return self.check_in, self.check_out
 
     def to_dict(self):
         """
@@ -35,11 +455,15 @@ class Reservation:
         Returns:
             dict: Dictionary representation of the reservation.
         """
-        return {
+        data = {
             "reservation_id": self.reservation_id,
             "hotel_id": self.hotel_id,
             "customer_id": self.customer_id
         }
+        if self.check_in is not None:
+            data["check_in"] = self.check_in
+            data["check_out"] = self.check_out
+        return data
 
     @staticmethod
     def from_dict(data):
@@ -55,51 +479,208 @@ class Reservation:
         return Reservation(
             reservation_id=data.get("reservation_id"),
             hotel_id=data.get("hotel_id"),
-            customer_id=data.get("customer_id")
+            customer_id=data.get("customer_id"),
+            check_in=data.get("check_in"),
+            check_out=data.get("check_out")
         )
 
     @staticmethod
+    @timed("Reservation.create_reservation")
     def create_reservation(reservation):
         """
         Create a new reservation linking a customer and a hotel.
 
         Args:
             reservation (Reservation): The Reservation instance to be added.
+
+        Returns:
+            bool: True if the reservation was created, False if the
+            customer does not exist, the ID is already taken or the hotel
+            had no available rooms.
         """
-        # First, attempt to reserve a room in the hotel.
-        if Hotel.reserve_room(
-            reservation.hotel_id,
-            reservation.reservation_id
-        ):
-            reservations = load_data(RESERVATION_FILE)
-            reservations.append(reservation.to_dict())
-            save_data(RESERVATION_FILE, reservations)
-        else:
-            print("Failed to create reservation due to room unavailability.")
+        error = _bookings.submit(reservation)
+        if error is None:
+            return True
+        print(error)
+        return False
+
+    @staticmethod
+    @timed("Reservation.create_reservations")
+    def create_reservations(reservations):
+        """
+        Create several reservations, reserving their rooms and storing
+        them in a single transaction, with one write per store.
+
+        Args:
+            reservations (iterable): The Reservation instances to be added.
+
+        Returns:
+            list: One result per reservation: True if it was created,
+            False if its hotel had no available rooms, and None if it was
+            rejected because its customer does not exist or its ID is
+            already taken.
+        """
+        errors = _commit_reservations(list(reservations))
+        return [
+            True if error is None else False if error == NO_ROOM else None
+            for error in errors
+        ]
+
+    @staticmethod
+    @timed("Reservation.try_create_reservations")
+    def try_create_reservations(reservations, reserved=()):
+        """
+        Create several reservations in a single transaction, as
+        create_reservations does, telling why each rejected one was not
+        created.
+
+        Args:
+            reservations (iterable): The Reservation instances to be added.
+                Those without an ID are given one, and keep it.
+            reserved (collection, optional): IDs not to give to
+                reservations without one, such as the IDs of reservations
+                the caller is about to create.
+
+        Returns:
+            list: One result per reservation: None if it was created, else
+            the reason why not: NO_CUSTOMER, TAKEN or NO_ROOM.
+        """
+        return _commit_reservations(list(reservations), reserved)
+
+    @staticmethod
+    @timed("Reservation.merge_reservations")
+    def merge_reservations(reservations, hotels):
+        """
+        Create reservations whose rooms were reserved ahead of time on
+        copies of their hotels, such as those taken from a snapshot, in a
+        single transaction.
+
+        Hotels changed by another writer since their copy was taken have
+        the rooms of their reservations reserved again, in order, so
+        capacity is never exceeded whatever the copies hold.
+
+        Args:
+            reservations (iterable): The Reservation instances to be added.
+                They must have IDs, see Reservation.allocate_ids.
+            hotels (dict): Maps hotel IDs to (base, result) pairs: the
+                hotel the rooms were reserved on, in stored form, and the
+                in-memory copy of it (see decode_hotel) in which the rooms
+                of all the reservations given here were reserved, with
+                reserve_stay. The copies are taken over, not copied.
+
+        Returns:
+            list: One result per reservation: None if it was created, else
+            the reason why not: NO_CUSTOMER, TAKEN or NO_ROOM.
+        """
+        return _merge_reservations(list(reservations), hotels)
+
+    @staticmethod
+    def allocate_ids(count, reserved=()):
+        """
+        Return new reservation IDs that no reservation uses yet.
+
+        Args:
+            count (int): Number of IDs to return.
+            reserved (collection, optional): Other IDs not to return, such
+                as those of reservations the caller is about to create.
+
+        Returns:
+            list: count distinct integer IDs.
+        """
+        return _reservations().allocate_ids(count, reserved)
 
     @staticmethod
+    @timed("Reservation.cancel_reservation")
     def cancel_reservation(reservation_id):
         """
         Cancel an existing reservation.
 
         Args:
             reservation_id (int): The reservation ID to cancel.
+
+        Returns:
+            bool: True if the reservation was found and canceled.
         """
-        reservations = load_data(RESERVATION_FILE)
-        reservation_to_cancel = None
-        for reservation in reservations:
-            if reservation.get("reservation_id") == reservation_id:
-                reservation_to_cancel = reservation
-                break
+        reservations = _reservations()
+        reservation_to_cancel = reservations.get(reservation_id)
 
         if reservation_to_cancel:
-            Hotel.cancel_reservation(
-                reservation_to_cancel.get("hotel_id"), reservation_id)
-            reservations = [
-                r
-                for r in reservations
-                if r.get("reservation_id") != reservation_id
-            ]
-            save_data(RESERVATION_FILE, reservations)
-        else:
-            print("Reservation not found.")
+            hotel_id = reservation_to_cancel.get("hotel_id")
+            try:
+                with Transaction() as transaction:
+                    Hotel.cancel_reservation(
+                        hotel_id, reservation_id, transaction)
+                    # A concurrent cancel may have deleted the record since
+                    # it was read.
+                    if not transaction.stage(reservations).delete_many(
+                            [reservation_id]):
+                        raise _Conflict
+                    transaction.emit(RESERVATION_CANCELED, reservations,
+                                     [reservation_id])
+            except _Conflict:
+                print("Reservation not found.")
+                return False
+            return True
+        print("Reservation not found.")
+        return False
+
+    @staticmethod
+    @timed("Reservation.display_reservation")
+    def display_reservation(reservation_id):
+        """
+        Display information for a reservation with the given ID.
+
+        Args:
+            reservation_id (int): The ID of the reservation.
+
+        Returns:
+            dict or None: Reservation information if found, else None.
+        """
+        return _reservations().get(reservation_id)
+
+    @staticmethod
+    @timed("Reservation.for_customer")
+    def for_customer(customer_id):
+        """
+        List the reservations of a customer.
+
+        Args:
+            customer_id (int): The ID of the customer.
+
+        Returns:
+            list: Information of the customer's reservations, in the order
+            they were made.
+        """
+        return _reservations().find("customer", customer_id)
+
+    @staticmethod
+    @timed("Reservation.for_hotel")
+    def for_hotel(hotel_id):
+        """
+        List the reservations made at a hotel.
+
+        Args:
+            hotel_id (int): The ID of the hotel.
+
+        Returns:
+            list: Information of the hotel's reservations, in the order
+            they were made.
+        """
+        return _reservations().find("hotel", hotel_id)
+
+    @staticmethod
+    @timed("Reservation.snapshot")
+    def snapshot():
+        """
+        Take a consistent, immutable point-in-time view of the hotels,
+        customers and reservations, without waiting for writers.
+
+        Returns:
+            Snapshot: The view, whose stores are named "hotels",
+            "customers" and "reservations".
+        """
+        return Snapshot({
+            "hotels": _hotels(),
+            "customers": _customers(),
+            "reservations": _reservations(),
+        })
@@ -0,0 +1,131 @@
+"""
+service.py
+
+This module defines AsyncReservationService, an asyncio facade over the
+reservation operations for callers running in an event loop, such as an
+async web server.
+
+The synchronous operations are run in an executor, so their disk I/O never
+blocks the event loop. Requests for the same hotel are serialized by a
+per-hotel asyncio.Lock before they reach the executor, so at most one
+executor thread works on a given hotel at a time and waiting requests cost
+nothing but a suspended coroutine. Requests for different hotels run
+concurrently.
+
+The per-hotel locks are created on demand and dropped once no request is
+using them, so the lock table stays as small as the number of hotels with
+requests in flight. The service is meant to be used from a single event
+loop.
+"""
+
+import asyncio
+import contextlib
+import functools
+
+from app.hotel import Hotel
+from app.reservation import Reservation
+
+_settings = {
+    "executor": None,
+}
+
+# Maps each hotel ID with requests in flight to [lock, number of users].
+_hotel_locks = {}
+
+
+def set_executor(executor):
+    """
+    Select the executor the blocking operations run in.
+
+    Args:
+        executor (concurrent.futures.Executor or None): The executor to
+            use, or None for the event loop's default executor.
+    """
+    _settings["executor"] = executor
+
+
+async def _run(function, *args):
+    """
+    Run a blocking function in the executor and wait for its result.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        _settings["executor"], functools.partial(function, *args))
+
+
+@contextlib.asynccontextmanager
+async def _hotel_lock(hotel_id):
+    """
+    Hold the lock of a hotel for the duration of the block.
+    """
+    entry = _hotel_locks.get(hotel_id)
+    if entry is None:
+        entry = _hotel_locks[hotel_id] = [asyncio.Lock(), 0]
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            yield
+    finally:
+        entry[1] -= 1
+        if not entry[1]:
+            del _hotel_locks[hotel_id]
+
+
+class AsyncReservationService:
+    """
+    A class exposing the reservation operations as coroutines.
+    """
+
+    @staticmethod
+    async def create_reservation(reservation):
+        """
+        Create a new reservation linking a customer and a hotel.
+
+        Args:
+            reservation (Reservation): The Reservation instance to be added.
+
+        Returns:
+            bool: True if the reservation was created, False if the
+            customer does not exist, the ID is already taken or the hotel
+            had no available rooms.
+        """
+        async with _hotel_lock(reservation.hotel_id):
+            return await _run(Reservation.create_reservation, reservation)
+
+    @staticmethod
+    async def reserve_room(hotel_id, reservation_id,
+                           check_in=None, check_out=None):
+        """
+        Reserve a room in a hotel.
+
+        Args:
+            hotel_id (int): The ID of the hotel.
+            reservation_id (int): The reservation ID to add.
+            check_in (date or str, optional): Arrival date of the stay.
+            check_out (date or str, optional): Departure date of the stay.
+
+        Returns:
+            bool: True if the room was reserved, False otherwise.
+        """
+        async with _hotel_lock(hotel_id):
+            return await _run(Hotel.reserve_room, hotel_id, reservation_id,
+                              check_in, check_out)
+
+    @staticmethod
+    async def cancel_reservation(reservation_id):
+        """
+        Cancel an existing reservation.
+
+        Args:
+            reservation_id (int): The reservation ID to cancel.
+
+        Returns:
+            bool: True if the reservation was found and canceled.
+        """
+        reservation = await _run(
+            Reservation.display_reservation, reservation_id)
+        if reservation is None:
+            print("Reservation not found.")
+            return False
+        async with _hotel_lock(reservation.get("hotel_id")):
+            return await _run(Reservation.cancel_reservation, reservation_id)
@@ -0,0 +1,294 @@
+"""
+snapshot.py
+
+This module provides the copy-on-write versions of the stores that readers
+use without taking locks, and Snapshot, a consistent point-in-time view of
+several stores at once.
+
+Each repository publishes the committed state of its records as a
+RecordMap, an immutable map from record IDs to records. A new version is
+made from the previous one by copying only the buckets that hold changed
+records, so publishing a change costs a few small copies whatever the size
+of the store, and every earlier version stays valid for the readers still
+holding it.
+
+The published versions of every store are kept together in one catalog,
+which is replaced as a whole on each publication. A writer that changed
+several stores in one transaction publishes them with a single
+replacement, so a reader that takes a Snapshot sees either all of the
+transaction or none of it. Readers only ever read the catalog and the maps
+it refers to, neither of which is changed after publication.
+
+Records held by a published version must not be changed in place: writers
+copy a record before changing it (see Repository._writable).
+"""
+
+import threading
+
+# Number of buckets per node, and of nodes per map.
+FANOUT = 64
+
+_EMPTY_BUCKET = {}
+
+# Maps each repository to its published RecordMap. Replaced, never
+# changed, on each publication.
+_catalog = {}
+_publish_lock = threading.Lock()
+
+
+def _slot(record_id):
+    """
+    Return the (node, bucket) position of a record ID.
+    """
+    position = hash(record_id) % (FANOUT * FANOUT)
+    return divmod(position, FANOUT)
+
+
+class RecordMap:
+    """
+    An immutable map from record IDs to in-memory records.
+
+    The records are spread over FANOUT * FANOUT buckets, grouped in FANOUT
+    nodes. Buckets and nodes are shared between versions until a change
+    touches them.
+    """
+
+    __slots__ = ("_nodes", "_size")
+
+    def __init__(self, nodes=None, size=0):
+        """
+        Initialize a RecordMap instance.
+
+        Args:
+            nodes (tuple, optional): The nodes, each a tuple of buckets.
+                Defaults to an empty map.
+            size (int, optional): Number of records in the map.
+        """
+        self._nodes = nodes or (None,) * FANOUT
+        self._size = size
+
+    @classmethod
+    def from_dict(cls, records):
+        """
+        Create a map holding the given records.
+
+        Args:
+            records (dict): Maps each record ID to its in-memory record.
+
+        Returns:
+            RecordMap: A new map.
+        """
+        nodes = [None] * FANOUT
+        for record_id, record in records.items():
+            node, bucket = _slot(record_id)
+            if nodes[node] is None:
+                nodes[node] = [None] * FANOUT
+            if nodes[node][bucket] is None:
+                nodes[node][bucket] = {}
+            nodes[node][bucket][record_id] = record
+        return cls(
+            tuple(tuple(node) if node is not None else None
+                  for node in nodes),
+            len(records)
+        )
+
+    def evolve(self, changes):
+        """
+        Return a new version of the map with some records changed.
+
+        Args:
+            changes (dict): Maps each changed record ID to its record, or
+                to None if it was deleted.
+
+        Returns:
+            RecordMap: The new version. This map is left unchanged.
+        """
+        if not changes:
+            return self
+        nodes = list(self._nodes)
+        copied_nodes = set()
+        copied_buckets = set()
+        size = self._size
+        for record_id, record in changes.items():
+            node, bucket = _slot(record_id)
+            if node not in copied_nodes:
+                nodes[node] = list(nodes[node] or (None,) * FANOUT)
+                copied_nodes.add(node)
+            if (node, bucket) not in copied_buckets:
+                nodes[node][bucket] = dict(nodes[node][bucket] or ())
+                copied_buckets.add((node, bucket))
+            records = nodes[node][bucket]
+            existed = record_id in records
+            if record is not None:
+                records[record_id] = record
+                size += not existed
+            elif existed:
+                del records[record_id]
+                size -= 1
+        for node in copied_nodes:
+            nodes[node] = tuple(nodes[node])
+        return RecordMap(tuple(nodes), size)
+
+    def _bucket(self, record_id):
+        """
+        Return the bucket that holds a record ID.
+        """
+        node, bucket = _slot(record_id)
+        buckets = self._nodes[node]
+        if buckets is None:
+            return _EMPTY_BUCKET
+        return buckets[bucket] or _EMPTY_BUCKET
+
+    def get(self, record_id, default=None):
+        """
+        Return the record with the given ID, or default if there is none.
+        """
+        try:
+            return self._bucket(record_id).get(record_id, default)
+        except TypeError:
+            # Unhashable IDs are never stored.
+            return default
+
+    def __contains__(self, record_id):
+        """
+        Check whether a record with the given ID exists.
+        """
+        return self.get(record_id) is not None
+
+    def __len__(self):
+        """
+        Return the number of records.
+        """
+        return self._size
+
+    def items(self):
+        """
+        Iterate over the (record_id, record) pairs, in no particular order.
+        """
+        for buckets in self._nodes:
+            for records in buckets or ():
+                yield from (records or _EMPTY_BUCKET).items()
+
+    def __iter__(self):
+        """
+        Iterate over the record IDs, in no particular order.
+        """
+        return (record_id for record_id, _ in self.items())
+
+
+EMPTY = RecordMap()
+
+
+def current(repository):
+    """
+    Return the published version of a repository's records.
+
+    Args:
+        repository (Repository): The repository.
+
+    Returns:
+        RecordMap or None: The published version, or None if the
+        repository has not published one.
+    """
+    return _catalog.get(repository)
+
+
+def publish(versions):
+    """
+    Publish new versions of several repositories at once.
+
+    Args:
+        versions (dict): Maps each repository to its new RecordMap.
+    """
+    global _catalog
+    if not versions:
+        return
+    with _publish_lock:
+        catalog = dict(_catalog)
+        catalog.update(versions)
+        _catalog = catalog
+
+
+def forget(repositories):
+    """
+    Drop the published versions of repositories that are no longer used.
+
+    Args:
+        repositories (iterable): The repositories to drop.
+    """
+    global _catalog
+    with _publish_lock:
+        catalog = dict(_catalog)
+        for repository in repositories:
+            catalog.pop(repository, None)
+        _catalog = catalog
+
+
+class Snapshot:
+    """
+    A consistent, immutable point-in-time view of several stores.
+
+    The view never changes, whatever is written after it was taken.
+    Records are returned as copies in stored form.
+    """
+
+    def __init__(self, repositories):
+        """
+        Take a snapshot of the current versions of several repositories.
+
+        Args:
+            repositories (dict): Maps the name by which each store is
+                read from the snapshot to its repository.
+        """
+        # Bring every store up to date before reading the catalog once.
+        for repository in repositories.values():
+            repository.view()
+        catalog = _catalog
+        self._stores = {
+            name: (repository, catalog.get(repository, EMPTY))
+            for name, repository in repositories.items()
+        }
+
+    def get(self, store, record_id):
+        """
+        Look up a record of a store by its ID.
+
+        Args:
+            store (str): Name of the store.
+            record_id: The ID of the record.
+
+        Returns:
+            dict or None: A copy of the record if found, else None.
+        """
+        repository, records = self._stores[store]
+        record = records.get(record_id)
+        return repository._encode(record) if record is not None else None
+
+    def read(self, store, record_id, reader):
+        """
+        Compute a value from a record without copying it.
+
+        Args:
+            store (str): Name of the store.
+            record_id: The ID of the record.
+            reader (callable): Called with the in-memory record. It must
+                not modify the record.
+
+        Returns:
+            The value returned by the reader, or None if the record does
+            not exist.
+        """
+        record = self._stores[store][1].get(record_id)
+        return reader(record) if record is not None else None
+
+    def count(self, store):
+        """
+        Return the number of records of a store.
+
+        Args:
+            store (str): Name of the store.
+
+        Returns:
+            int: The number of records.
+        """
+        return len(self._stores[store][1])
@@ -0,0 +1,867 @@
+"""
+storage.py
+
+This module defines the storage backends used by the repositories. A
+backend stores the records of each persistence file, identified by its
+path (HOTEL_FILE, CUSTOMER_FILE or RESERVATION_FILE).
+
+Three backends are provided: JsonBackend, which keeps one JSON file per
+store through the persistence module, ShardedBackend, which splits each
+store over several JSON files by record ID, and SqliteBackend, which keeps
+one table per store in a SQLite database. The active backend is chosen
+with set_backend, by setting the RESERVATION_DATABASE environment variable
+to the path of a SQLite database, or by setting RESERVATION_SHARDS to a
+number of shards.
+"""
+
+import collections
+import contextlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import zlib
+
+from app.locking import store_lock
+from app.persistence import (
+    iter_records,
+    journal_path,
+    load_data,
+    save_data,
+    append_journal_batch,
+    rewrite_records,
+    needs_snapshot,
+    file_signature,
+    read_journal_tail,
+    get_storage_mode,
+    JOURNAL_MODE,
+    NDJSON_MODE,
+    HOTEL_FILE,
+    CUSTOMER_FILE,
+    RESERVATION_FILE,
+)
+
+
+class StorageBackend:
+    """
+    Interface implemented by every storage backend.
+    """
+
+    def load(self, file_path, key=None):
+        """
+        Load every record of a store.
+
+        Args:
+            file_path (str): Path identifying the store.
+            key (str, optional): Name of the field that identifies each
+                record.
+
+        Returns:
+            list: The records in insertion order.
+        """
+        raise NotImplementedError
+
+    def iter_records(self, file_path):
+        """
+        Iterate over the records of a store, without necessarily loading
+        the whole store.
+
+        Args:
+            file_path (str): Path identifying the store.
+
+        Returns:
+            iterator: The records in insertion order.
+        """
+        return iter(self.load(file_path))
+
+    def size(self, file_path):
+        """
+        Return the approximate size of the data held by a store.
+
+        Args:
+            file_path (str): Path identifying the store.
+
+        Returns:
+            int: A number of bytes.
+        """
+        raise NotImplementedError
+
+    def save(self, file_path, key, records):
+        """
+        Replace every record of a store.
+
+        Args:
+            file_path (str): Path identifying the store.
+            key (str): Name of the field that identifies each record.
+            records (list): The records to store.
+        """
+        raise NotImplementedError
+
+    def write(self, file_path, key, mutations, records, signature=None):
+        """
+        Persist a batch of mutations to a store.
+
+        Args:
+            file_path (str): Path identifying the store.
+            key (str): Name of the field that identifies each record.
+            mutations (list): (op, record_id, record) tuples, where op is
+                either "put" or "delete" and record is only used for "put".
+            records (callable): Returns every record of the store, for
+                backends that can only rewrite a store as a whole.
+            signature (optional): The signature of the store when the
+                caller last read it, for backends that can tell which
+                parts of the store the caller has seen.
+
+        Returns:
+            The signature of the store after the write if it now holds
+            exactly the caller's records, or None if other writers may
+            have changed it concurrently.
+        """
+        raise NotImplementedError
+
+    def signature(self, file_path):
+        """
+        Return a value that changes whenever the store is changed by
+        another writer.
+
+        Args:
+            file_path (str): Path identifying the store.
+
+        Returns:
+            A comparable fingerprint of the store.
+        """
+        raise NotImplementedError
+
+    def changes(self, file_path, signature, key=None):
+        """
+        Return the mutations made to a store since a signature was taken,
+        for backends that can tell them apart from a full reload.
+
+        Args:
+            file_path (str): Path identifying the store.
+            signature: A value returned by signature.
+            key (str, optional): Name of the field that identifies each
+                record.
+
+        Returns:
+            tuple or None: (mutations, signature) as for write, or None if
+            the store must be reloaded as a whole.
+        """
+        # Backends that keep no record of changes always reload the store.
+        del file_path, signature, key
+
+    def lock(self, file_path, record_ids=None):
+        """
+        Return a context manager that locks records of a store, or the
+        whole store, against other writers.
+
+        Args:
+            file_path (str): Path identifying the store.
+            record_ids (list, optional): IDs of the records to lock. If
+                omitted, the whole store is locked.
+        """
+        return store_lock(file_path, record_ids)
+
+    def needs_compaction(self, file_path):
+        """
+        Check whether a store should be rewritten as a whole with save.
+
+        Args:
+            file_path (str): Path identifying the store.
+
+        Returns:
+            bool: True if the store should be compacted.
+        """
+        del file_path
+        return False
+
+
+class JsonBackend(StorageBackend):
+    """
+    Backend keeping each store in its JSON file, optionally with a journal.
+
+    In json mode every write rewrites the file, so writers lock the whole
+    store. In ndjson mode writes also rewrite the file, but stream it
+    through a temporary file instead of serializing every record. In
+    journal mode writers only append, so they lock just the records they
+    change and read each other's appends incrementally.
+    """
+
+    def load(self, file_path, key=None):
+        return load_data(file_path)
+
+    def iter_records(self, file_path):
+        return iter_records(file_path)
+
+    def size(self, file_path):
+        return sum(
+            os.path.getsize(path)
+            for path in (file_path, journal_path(file_path))
+            if os.path.exists(path)
+        )
+
+    def save(self, file_path, key, records):
+        save_data(file_path, records)
+
+    def write(self, file_path, key, mutations, records, signature=None):
+        if get_storage_mode() == JOURNAL_MODE:
+            append_journal_batch(file_path, key, mutations)
+            return None
+        if get_storage_mode() == NDJSON_MODE:
+            rewrite_records(file_path, key, mutations)
+            return file_signature(file_path)
+        save_data(file_path, records())
+        return file_signature(file_path)
+
+    def signature(self, file_path):
+        return file_signature(file_path)
+
+    def changes(self, file_path, signature, key=None):
+        tail = read_journal_tail(file_path, signature)
+        if tail is None:
+            return None
+        entries, signature = tail
+        return [
+            (entry["op"], entry["id"], entry.get("record"))
+            for entry in entries
+        ], signature
+
+    def lock(self, file_path, record_ids=None):
+        if get_storage_mode() == JOURNAL_MODE:
+            return store_lock(file_path, record_ids)
+        return store_lock(file_path)
+
+    def needs_compaction(self, file_path):
+        return needs_snapshot(file_path)
+
+
+# Default number of shard files per store.
+SHARDS = 16
+
+
+def shard_of(record_id, shards):
+    """
+    Return the shard holding a record ID.
+
+    The shard is derived from a stable hash, so every process maps the same
+    ID to the same shard.
+
+    Args:
+        record_id: The ID of the record.
+        shards (int): Number of shards of the store.
+
+    Returns:
+        int: A shard number between 0 and shards - 1.
+    """
+    return zlib.crc32(repr(record_id).encode("utf-8")) % shards
+
+
+class ShardedBackend(StorageBackend):
+    """
+    Backend splitting each store over a fixed number of JSON files, by a
+    hash of the record ID.
+
+    A write rewrites, and locks, only the shards holding the records it
+    changes, so writers to different shards proceed in parallel and a
+    booking rewrites one shard instead of every hotel. Changes made by
+    other processes are picked up by reloading only the shards whose
+    files changed.
+
+    Shards are written through the persistence module, so they follow the
+    json or ndjson storage mode; the journal mode does not apply to them.
+    """
+
+    def __init__(self, shards=SHARDS):
+        """
+        Initialize a ShardedBackend instance.
+
+        Args:
+            shards (int, optional): Number of shards per store.
+
+        Raises:
+            ValueError: If shards is less than 1.
+        """
+        if shards < 1:
+            raise ValueError("shards must be at least 1")
+        self.shards = shards
+        self._lock = threading.Lock()
+        # Maps (file_path, shard) to the IDs held by the last versions of
+        # the shard seen by this process, keyed by shard signature. They
+        # tell which records a changed shard no longer holds.
+        self._versions = {}
+
+    def shard_path(self, file_path, shard):
+        """
+        Return the path of one shard of a store.
+
+        Args:
+            file_path (str): Path identifying the store.
+            shard (int): The shard number.
+
+        Returns:
+            str: The path of the shard file, such as
+            json/hotels-001-of-016.json.
+        """
+        root, extension = os.path.splitext(file_path)
+        return f"{root}-{shard + 1:03d}-of-{self.shards:03d}{extension}"
+
+    def _shard_signature(self, file_path, shard):
+        """
+        Return the signature of one shard file.
+        """
+        return file_signature(self.shard_path(file_path, shard))[0]
+
+    def _remember(self, file_path, shard, signature, record_ids):
+        """
+        Record the IDs held by a version of a shard. The two latest
+        versions are kept: the one a writer started from, and its own.
+        """
+        with self._lock:
+            versions = self._versions.setdefault(
+                (file_path, shard), collections.OrderedDict())
+            versions[signature] = record_ids
+            versions.move_to_end(signature)
+            while len(versions) > 2:
+                versions.popitem(last=False)
+
+    def _known(self, file_path, shard, signature):
+        """
+        Return the IDs held by a version of a shard, or None if unknown.
+        """
+        with self._lock:
+            versions = self._versions.get((file_path, shard))
+            return versions.get(signature) if versions else None
+
+    def _load_shard(self, file_path, key, shard):
+        """
+        Load the records of one shard, remembering the IDs it holds.
+        """
+        signature = self._shard_signature(file_path, shard)
+        records = load_data(self.shard_path(file_path, shard))
+        if key is not None:
+            self._remember(file_path, shard, signature,
+                           {record.get(key) for record in records})
+        return records
+
+    def iter_records(self, file_path):
+        """
+        Iterate over the records of a store one shard at a time, without
+        loading the whole store.
+
+        Args:
+            file_path (str): Path identifying the store.
+
+        Yields:
+            dict: The records, shard by shard.
+        """
+        for shard in range(self.shards):
+            yield from iter_records(self.shard_path(file_path, shard))
+
+    def size(self, file_path):
+        return sum(
+            os.path.getsize(path)
+            for path in (self.shard_path(file_path, shard)
+                         for shard in range(self.shards))
+            if os.path.exists(path)
+        )
+
+    def split(self, file_path, key):
+        """
+        Distribute the records of an unsharded JSON file over the shards
+        of its store, replacing their contents. For duplicated IDs, the
+        first record is kept.
+
+        Args:
+            file_path (str): Path of the JSON file, which also identifies
+                the store.
+            key (str): Name of the field that identifies each record.
+
+        Returns:
+            int: Number of records distributed.
+        """
+        records = []
+        seen = set()
+        for record in iter_records(file_path):
+            record_id = record.get(key)
+            if record_id not in seen:
+                seen.add(record_id)
+                records.append(record)
+        with self.lock(file_path):
+            self.save(file_path, key, records)
+        return len(records)
+
+    def load(self, file_path, key=None):
+        return [
+            record
+            for shard in range(self.shards)
+            for record in self._load_shard(file_path, key, shard)
+        ]
+
+    def save(self, file_path, key, records):
+        shards = [[] for _ in range(self.shards)]
+        for record in records:
+            shards[shard_of(record.get(key), self.shards)].append(record)
+        for shard, shard_records in enumerate(shards):
+            save_data(self.shard_path(file_path, shard), shard_records)
+            self._remember(file_path, shard,
+                           self._shard_signature(file_path, shard),
+                           {record.get(key) for record in shard_records})
+
+    def write(self, file_path, key, mutations, records, signature=None):
+        shards = collections.defaultdict(list)
+        for mutation in mutations:
+            shards[shard_of(mutation[1], self.shards)].append(mutation)
+        if signature is not None and len(signature) == self.shards:
+            signature = list(signature)
+        else:
+            signature = None
+        for shard, shard_mutations in shards.items():
+            path = self.shard_path(file_path, shard)
+            before = self._shard_signature(file_path, shard)
+            record_ids = self._known(file_path, shard, before)
+            rewrite_records(path, key, shard_mutations)
+            after = self._shard_signature(file_path, shard)
+            if signature is not None and signature[shard] == before:
+                # The caller had seen the shard, so it now holds exactly
+                # the caller's records.
+                signature[shard] = after
+            if record_ids is not None:
+                record_ids = set(record_ids)
+                for op, record_id, _ in shard_mutations:
+                    if op == "put":
+                        record_ids.add(record_id)
+                    else:
+                        record_ids.discard(record_id)
+                self._remember(file_path, shard, after, record_ids)
+        # The other shards keep the caller's signatures, so those written
+        # concurrently by others are still picked up by changes().
+        return tuple(signature) if signature is not None else None
+
+    def signature(self, file_path):
+        return tuple(
+            self._shard_signature(file_path, shard)
+            for shard in range(self.shards)
+        )
+
+    def changes(self, file_path, signature, key=None):
+        if key is None or signature is None or len(signature) != self.shards:
+            return None
+        current = self.signature(file_path)
+        mutations = []
+        for shard in range(self.shards):
+            if current[shard] == signature[shard]:
+                continue
+            old_ids = self._known(file_path, shard, signature[shard])
+            if old_ids is None:
+                return None
+            seen = set()
+            for record in load_data(self.shard_path(file_path, shard)):
+                record_id = record.get(key)
+                if record_id not in seen:
+                    seen.add(record_id)
+                    mutations.append(("put", record_id, record))
+            mutations.extend(
+                ("delete", record_id, None)
+                for record_id in old_ids - seen
+            )
+            self._remember(file_path, shard, current[shard], seen)
+        return mutations, current
+
+    def lock(self, file_path, record_ids=None):
+        if record_ids is None:
+            shards = range(self.shards)
+        else:
+            shards = sorted({
+                shard_of(record_id, self.shards) for record_id in record_ids
+            })
+        return self._lock_shards(file_path, shards)
+
+    @contextlib.contextmanager
+    def _lock_shards(self, file_path, shards):
+        """
+        Hold the locks of the given shards, in order, for the duration of
+        the block.
+        """
+        with contextlib.ExitStack() as stack:
+            # Always take shard locks in the same order to avoid deadlocks.
+            for shard in shards:
+                stack.enter_context(
+                    store_lock(self.shard_path(file_path, shard)))
+            yield
+
+
+# Table names for the known stores; other paths use their base name.
+TABLES = {
+    HOTEL_FILE: "hotels",
+    CUSTOMER_FILE: "customers",
+    RESERVATION_FILE: "reservations",
+}
+
+# Fields copied to indexed columns so they can be looked up efficiently.
+INDEXED_FIELDS = {
+    "reservations": ("hotel_id", "customer_id"),
+}
+
+
+def table_name(file_path):
+    """
+    Return the SQLite table used for the store at the given path.
+
+    Args:
+        file_path (str): Path identifying the store.
+
+    Returns:
+        str: A valid SQL identifier.
+    """
+    if file_path in TABLES:
+        return TABLES[file_path]
+    name = os.path.splitext(os.path.basename(file_path))[0]
+    return re.sub(r"\W", "_", name) or "records"
+
+
+# Number of entries of the change log kept per table. Readers further
+# behind reload the whole table.
+CHANGE_LOG_SIZE = 10000
+
+# Number of rows read at a time when iterating over a table.
+ITER_PAGE_SIZE = 1000
+
+
+class SqliteBackend(StorageBackend):
+    """
+    Backend keeping each store in a table of a SQLite database.
+
+    Each table holds the record ID as its primary key, the record itself as
+    JSON, and indexed copies of the foreign-key fields listed in
+    INDEXED_FIELDS. The database runs in WAL mode so readers in other
+    processes are not blocked by a writer.
+
+    Every write also appends the IDs it changed to the _changes table, in
+    the same SQLite transaction. The signature of a store is the sequence
+    number of its latest change, so a reader behind by a few commits only
+    reads the rows they changed. Replacing a store as a whole, and
+    trimming the log to CHANGE_LOG_SIZE entries, raise the floor in
+    _change_floors below which readers must reload the table.
+    """
+
+    def __init__(self, db_path):
+        """
+        Initialize a SqliteBackend instance.
+
+        Args:
+            db_path (str): Path to the SQLite database file.
+        """
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._tables = set()
+        self._connection = sqlite3.connect(db_path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS _changes "
+                "(seq INTEGER PRIMARY KEY AUTOINCREMENT, "
+                "store TEXT NOT NULL, id)"
+            )
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS _changes_store "
+                "ON _changes (store, seq)"
+            )
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS _change_floors "
+                "(store TEXT PRIMARY KEY, seq INTEGER NOT NULL)"
+            )
+
+    def close(self):
+        """
+        Close the database connection.
+        """
+        with self._lock:
+            self._connection.close()
+
+    def _table(self, file_path):
+        """
+        Return the table of a store, creating it and its indexes on first
+        use.
+
+        Args:
+            file_path (str): Path identifying the store.
+
+        Returns:
+            str: The table name.
+        """
+        table = table_name(file_path)
+        if table in self._tables:
+            return table
+        fields = INDEXED_FIELDS.get(table, ())
+        columns = "".join(f", {field}" for field in fields)
+        with self._connection:
+            self._connection.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} "
+                f"(id PRIMARY KEY, data TEXT NOT NULL{columns})"
+            )
+            for field in fields:
+                self._connection.execute(
+                    f"CREATE INDEX IF NOT EXISTS {table}_{field} "
+                    f"ON {table} ({field})"
+                )
+        self._tables.add(table)
+        return table
+
+    @staticmethod
+    def _row(table, record_id, record):
+        """
+        Build the parameters of an upsert for a record.
+        """
+        return (record_id, json.dumps(record)) + tuple(
+            record.get(field) for field in INDEXED_FIELDS.get(table, ())
+        )
+
+    @staticmethod
+    def _upsert(table):
+        """
+        Return the upsert statement of a table. The statement text is
+        constant per table, so sqlite3 reuses the prepared statement.
+        """
+        fields = ("id", "data") + INDEXED_FIELDS.get(table, ())
+        placeholders = ", ".join("?" for _ in fields)
+        updates = ", ".join(f"{field} = excluded.{field}"
+                            for field in fields[1:])
+        return (
+            f"INSERT INTO {table} ({', '.join(fields)}) "
+            f"VALUES ({placeholders}) "
+            f"ON CONFLICT(id) DO UPDATE SET {updates}"
+        )
+
+    def get(self, file_path, record_id):
+        """
+        Look up a single record by its primary key.
+
+        Args:
+            file_path (str): Path identifying the store.
+            record_id: The ID of the record.
+
+        Returns:
+            dict or None: The record if found, else None.
+        """
+        with self._lock:
+            table = self._table(file_path)
+            row = self._connection.execute(
+                f"SELECT data FROM {table} WHERE id = ?", (record_id,)
+            ).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def find(self, file_path, field, value):
+        """
+        Return the records whose indexed field has the given value.
+
+        Args:
+            file_path (str): Path identifying the store.
+            field (str): One of the INDEXED_FIELDS of the store's table.
+            value: The value to look for.
+
+        Returns:
+            list: The matching records in insertion order.
+        """
+        with self._lock:
+            table = self._table(file_path)
+            if field not in INDEXED_FIELDS.get(table, ()):
+                raise ValueError(f"{table}.{field} is not indexed")
+            rows = self._connection.execute(
+                f"SELECT data FROM {table} WHERE {field} = ? ORDER BY rowid",
+                (value,)
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def _log(self, table, record_ids):
+        """
+        Append changed record IDs to the change log, within the current
+        transaction, trimming the log when it grows too long.
+        """
+        before = self._last_change(table)
+        self._connection.executemany(
+            "INSERT INTO _changes (store, id) VALUES (?, ?)",
+            ((table, record_id) for record_id in record_ids))
+        last = self._last_change(table)
+        if last // CHANGE_LOG_SIZE > before // CHANGE_LOG_SIZE:
+            self._connection.execute(
+                "DELETE FROM _changes WHERE store = ? AND seq <= ?",
+                (table, last - CHANGE_LOG_SIZE))
+            self._set_floor(table, last - CHANGE_LOG_SIZE)
+
+    def _last_change(self, table):
+        """
+        Return the sequence number of the latest change to a table.
+        """
+        return self._connection.execute(
+            "SELECT COALESCE(MAX(seq), 0) FROM _changes WHERE store = ?",
+            (table,)).fetchone()[0]
+
+    def _set_floor(self, table, seq):
+        """
+        Make readers whose signature is older than seq reload a table.
+        """
+        self._connection.execute(
+            "INSERT INTO _change_floors (store, seq) VALUES (?, ?) "
+            "ON CONFLICT(store) DO UPDATE SET seq = MAX(seq, excluded.seq)",
+            (table, seq))
+
+    def load(self, file_path, key=None):
+        with self._lock:
+            table = self._table(file_path)
+            rows = self._connection.execute(
+                f"SELECT data FROM {table} ORDER BY rowid"
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def iter_records(self, file_path):
+        # Rows are read a page at a time, so other threads may use the
+        # connection in between.
+        position = 0
+        while True:
+            with self._lock:
+                table = self._table(file_path)
+                rows = self._connection.execute(
+                    f"SELECT rowid, data FROM {table} WHERE rowid > ? "
+                    f"ORDER BY rowid LIMIT {ITER_PAGE_SIZE}", (position,)
+                ).fetchall()
+            if not rows:
+                return
+            for position, data in rows:
+                yield json.loads(data)
+
+    def size(self, file_path):
+        with self._lock:
+            table = self._table(file_path)
+            return self._connection.execute(
+                f"SELECT COALESCE(SUM(LENGTH(data)), 0) FROM {table}"
+            ).fetchone()[0]
+
+    def save(self, file_path, key, records):
+        with self._lock:
+            table = self._table(file_path)
+            with self._connection:
+                self._connection.execute(f"DELETE FROM {table}")
+                self._insert(table, key, records)
+                self._connection.execute(
+                    "INSERT INTO _changes (store, id) VALUES (?, NULL)",
+                    (table,))
+                self._set_floor(table, self._last_change(table))
+
+    def insert(self, file_path, key, records):
+        """
+        Upsert records into a store in a single transaction without
+        reading it first.
+
+        Args:
+            file_path (str): Path identifying the store.
+            key (str): Name of the field that identifies each record.
+            records (iterable): The records to store.
+        """
+        with self._lock:
+            table = self._table(file_path)
+            with self._connection:
+                self._insert(table, key, records)
+
+    def _insert(self, table, key, records):
+        """
+        Upsert records into a table within the current transaction.
+        """
+        rows = [self._row(table, record.get(key), record)
+                for record in records]
+        self._connection.executemany(self._upsert(table), rows)
+        self._log(table, [row[0] for row in rows])
+
+    def write(self, file_path, key, mutations, records, signature=None):
+        with self._lock:
+            table = self._table(file_path)
+            upsert = self._upsert(table)
+            with self._connection:
+                for op, record_id, record in mutations:
+                    if op == "put":
+                        self._connection.execute(
+                            upsert, self._row(table, record_id, record))
+                    else:
+                        self._connection.execute(
+                            f"DELETE FROM {table} WHERE id = ?",
+                            (record_id,)
+                        )
+                self._log(table, [mutation[1] for mutation in mutations])
+        # No signature is returned: other processes may have committed
+        # since the caller last read the store, and changes() returns
+        # their rows along with these.
+
+    def lock(self, file_path, record_ids=None):
+        # SQLite serializes the writes themselves; these locks make the
+        # read-check-write cycle of a record atomic across processes.
+        return store_lock(f"{self.db_path}-{table_name(file_path)}",
+                          record_ids)
+
+    def signature(self, file_path):
+        with self._lock:
+            return self._last_change(self._table(file_path))
+
+    def changes(self, file_path, signature, key=None):
+        if not isinstance(signature, int):
+            return None
+        with self._lock:
+            table = self._table(file_path)
+            current = self._last_change(table)
+            floor = self._connection.execute(
+                "SELECT seq FROM _change_floors WHERE store = ?",
+                (table,)).fetchone()
+            if floor is not None and signature < floor[0]:
+                return None
+            record_ids = [row[0] for row in self._connection.execute(
+                "SELECT DISTINCT id FROM _changes "
+                "WHERE store = ? AND seq > ? AND seq <= ?",
+                (table, signature, current))]
+            records = {}
+            # Rows may be newer than current; their own changes are then
+            # applied again on the next call, which is harmless.
+            for start in range(0, len(record_ids), 500):
+                chunk = record_ids[start:start + 500]
+                placeholders = ", ".join("?" for _ in chunk)
+                records.update(self._connection.execute(
+                    f"SELECT id, data FROM {table} "
+                    f"WHERE id IN ({placeholders})", chunk))
+        return [
+            ("put", record_id, json.loads(records[record_id]))
+            if record_id in records else ("delete", record_id, None)
+            for record_id in record_ids
+        ], current
+
+
+_settings = {"backend": None}
+
+
+def set_backend(backend):
+    """
+    Select the storage backend used by the repositories.
+
+    Args:
+        backend (StorageBackend): The backend to use, or None to go back
+            to the default backend.
+    """
+    _settings["backend"] = backend
+
+
+def get_backend():
+    """
+    Return the active storage backend, creating the default one on first
+    use.
+
+    Returns:
+        StorageBackend: The active backend.
+    """
+    if _settings["backend"] is None:
+        db_path = os.environ.get("RESERVATION_DATABASE")
+        shards = os.environ.get("RESERVATION_SHARDS")
+        if db_path:
+            _settings["backend"] = SqliteBackend(db_path)
+        elif shards:
+            _settings["backend"] = ShardedBackend(int(shards))
+        else:
+            _settings["backend"] = JsonBackend()
+    return _settings["backend"]
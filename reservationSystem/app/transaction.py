@@ -0,0 +1,763 @@
+"""
+transaction.py
+
+This module defines the Transaction class, a unit of work that changes
+records of several stores and commits them together, and GroupCommit,
+which batches concurrent requests into a single transaction.
+
+A transaction stages its changes one repository at a time: the records are
+locked, checkpointed and changed in memory, so later steps of the same
+transaction see them. Nothing is written until the transaction commits. If
+it fails before then, every staged record is restored from its checkpoint.
+Readers see none of the changes until the transaction ends, and then all
+of them at once: the new versions of every store it changed are published
+together (see snapshot.py).
+
+A commit first appends every change, for every store, as one line to the
+process's commit log and flushes it with a single fsync. From then on the
+transaction is durable. The changes are then written to each store through
+its backend, and the log is cleared. If the process dies in between, the
+stores may hold only part of the transaction; recover() replays the logs
+left by dead processes. A thread that takes a write lock while holding no
+other first replays any log a dead process left (see repository.py), so
+the records of a logged transaction are not changed again before it is
+replayed. recover() may also be called when the system starts.
+
+Along with the new state of every record it changes, a logged transaction
+holds the state each record it locked had before. A transaction is only
+replayed if each of its records is still in its earlier or its new state;
+otherwise the store was changed by other means, and replaying it would
+overwrite newer writes. If writing the stores fails while the process is
+running, the log is handed over to recover() as if the process had died,
+and the records are reloaded from the stores.
+
+Events emitted through a transaction (see events.py) are logged with its
+changes and appended to the event log right after the stores are written,
+while their records are still locked. A replayed transaction appends its
+events too, unless the log already holds them. A transaction that changes
+a single store and has no events to log skips the commit log, and is
+written like any other change to that store.
+
+With the JSON backend in journal mode, writing the stores only appends to
+their journals, so a commit costs a single fsync. In json mode each
+rewritten store file is still flushed before it replaces the old one.
+"""
+
+import contextlib
+import itertools
+import json
+import os
+import threading
+import time
+import uuid
+
+from app.events import ChangeFeed, Event, get_feed
+from app.locking import try_lock
+from app.persistence import RESERVATION_FILE
+from app.repository import Repository
+from app.snapshot import publish
+
+# Directory, next to the stores, holding one commit log per process.
+COMMIT_DIRECTORY = ".transactions"
+
+# Commit logs of this process, keyed by data directory.
+_logs = {}
+_logs_lock = threading.Lock()
+
+# Numbers the logs this process hands over to recover().
+_abandoned = itertools.count(1)
+
+
+class _CommitLog:
+    """
+    The commit log of this process for one data directory.
+
+    The process holds an exclusive lock on its log for as long as it runs,
+    which tells recover() that the log is still in use. Commits of the
+    process are serialized, so the log holds at most one transaction.
+    """
+
+    def __init__(self, directory):
+        """
+        Create and lock the commit log of this process.
+
+        Args:
+            directory (str): The data directory.
+        """
+        log_directory = os.path.join(directory or ".", COMMIT_DIRECTORY)
+        os.makedirs(log_directory, exist_ok=True)
+        self.pid = os.getpid()
+        self.path = os.path.join(log_directory, f"{self.pid}.log")
+        self._fd = try_lock(self.path)
+        self._lock = threading.Lock()
+
+    def commit(self, data, apply):
+        """
+        Make a transaction durable, apply it, and clear it from the log.
+
+        Args:
+            data (bytes): The encoded transaction.
+            apply (callable): Writes the transaction to the stores.
+
+        Raises:
+            Exception: Any error raised by apply, after the log was handed
+                over to recover().
+        """
+        with self._lock:
+            os.pwrite(self._fd, data, 0)
+            # Cut off whatever an earlier, longer transaction left behind.
+            os.ftruncate(self._fd, len(data))
+            os.fsync(self._fd)
+            try:
+                apply()
+            except Exception:
+                self._abandon()
+                raise
+            os.ftruncate(self._fd, 0)
+
+    def _abandon(self):
+        """
+        Hand the current transaction over to recover(), as if this process
+        had died, and start an empty log.
+        """
+        root, extension = os.path.splitext(self.path)
+        os.rename(self.path, f"{root}-{next(_abandoned)}{extension}")
+        os.close(self._fd)
+        self._fd = try_lock(self.path)
+
+
+def _commit_log(directory):
+    """
+    Return the commit log of this process for a data directory.
+    """
+    with _logs_lock:
+        log = _logs.get(directory)
+        if log is None or log.pid != os.getpid():
+            log = _logs[directory] = _CommitLog(directory)
+        return log
+
+
+def _stored(record):
+    """
+    Return a record in the form it has once logged.
+    """
+    return json.loads(json.dumps(record))
+
+
+def _superseded(checkpoint, before, mutations):
+    """
+    Check whether a record of a logged transaction is in neither its state
+    before the transaction nor its state after it.
+    """
+    after = {record_id: record for _, record_id, record in mutations}
+    for record_id, record in before:
+        current = checkpoint.get(record_id)
+        if current is not None:
+            current = _stored(current)
+        if current != record and (
+                record_id not in after or current != after[record_id]):
+            return True
+    return False
+
+
+def _replay(transaction):
+    """
+    Write every change of a logged transaction to its store, unless it was
+    superseded.
+
+    Returns:
+        bool: True if the transaction was replayed.
+    """
+    stores = []
+    with contextlib.ExitStack() as stack:
+        # The stores are locked in the order the transaction locked them.
+        for store in transaction["stores"]:
+            repository = Repository(store["file_path"], store["key"])
+            mutations = [tuple(mutation) for mutation in store["mutations"]]
+            # Logs written before the states were logged have no "before".
+            before = [tuple(entry) for entry in store.get("before", ())]
+            checkpoint = stack.enter_context(repository.staging(
+                [mutation[1] for mutation in mutations]
+                + [record_id for record_id, _ in before]))
+            if _superseded(checkpoint, before, mutations):
+                return False
+            stores.append((repository, mutations))
+        for repository, mutations in stores:
+            repository.restore({record_id: record
+                                for _, record_id, record in mutations})
+            if mutations:
+                repository.commit_staged(mutations)
+        logged = transaction.get("events")
+        if logged is not None:
+            # Unless the process died after appending them.
+            ChangeFeed(logged["log"]).append(
+                [Event.from_dict(event) for event in logged["events"]],
+                logged["id"], logged["offset"])
+    return True
+
+
+def recover(directory=os.path.dirname(RESERVATION_FILE)):
+    """
+    Replay the commit logs left by processes that died while committing.
+
+    Changes carry the full state of each record, so replaying a transaction
+    that was already partly or fully written is harmless. A transaction
+    whose records were changed since by other writers is skipped, and an
+    error is printed. A log line that was not completely written belongs
+    to a transaction that never committed, and is ignored.
+
+    It must not be called while holding locks on the stores.
+
+    Args:
+        directory (str, optional): The data directory. Defaults to the
+            directory of the JSON files.
+
+    Returns:
+        int: Number of transactions replayed.
+    """
+    log_directory = os.path.join(directory or ".", COMMIT_DIRECTORY)
+    if not os.path.isdir(log_directory):
+        return 0
+    count = 0
+    for name in sorted(os.listdir(log_directory)):
+        if not name.endswith(".log"):
+            continue
+        path = os.path.join(log_directory, name)
+        fd = try_lock(path)
+        if fd is None:
+            # The process that owns the log is still running.
+            continue
+        try:
+            with os.fdopen(os.dup(fd), "rb") as f:
+                lines = f.read().splitlines()
+            for line in lines:
+                try:
+                    transaction = json.loads(line)
+                except (json.JSONDecodeError, UnicodeDecodeError):
+                    continue
+                if _replay(transaction):
+                    count += 1
+                else:
+                    print(f"Skipped a transaction of {path}: its records "
+                          "were changed since it was logged.")
+            os.remove(path)
+        finally:
+            os.close(fd)
+    return count
+
+
+def pending(directory=os.path.dirname(RESERVATION_FILE)):
+    """
+    Check whether a process died while committing a transaction that
+    recover() has yet to replay.
+
+    Args:
+        directory (str, optional): The data directory. Defaults to the
+            directory of the JSON files.
+
+    Returns:
+        bool: True if a dead process left a transaction in its log.
+    """
+    log_directory = os.path.join(directory or ".", COMMIT_DIRECTORY)
+    try:
+        names = os.listdir(log_directory)
+    except FileNotFoundError:
+        return False
+    for name in names:
+        path = os.path.join(log_directory, name)
+        try:
+            # A running process clears its log after each commit.
+            if not name.endswith(".log") or not os.path.getsize(path):
+                continue
+        except FileNotFoundError:
+            continue
+        fd = try_lock(path)
+        if fd is not None:
+            os.close(fd)
+            return True
+    return False
+
+
+class _Stage:
+    """
+    The changes a transaction makes to one repository.
+    """
+
+    def __init__(self, stack, repository):
+        """
+        Initialize a _Stage instance.
+
+        Args:
+            stack (ExitStack): Holds the locks of the owning transaction.
+            repository (Repository): The repository to change.
+        """
+        self._stack = stack
+        self.repository = repository
+        self.checkpoint = {}
+        self.mutations = []
+        self.begun = False
+
+    def _begin(self, record_ids):
+        """
+        Lock and checkpoint the records about to change.
+
+        Raises:
+            ValueError: If the repository was already changed by this
+                transaction.
+        """
+        if self.begun:
+            raise ValueError(
+                "A repository can only be changed once per transaction")
+        self.begun = True
+        self.checkpoint = self._stack.enter_context(
+            self.repository.staging(record_ids))
+
+    def put_many(self, records):
+        """
+        Stage the insertion of several records. See Repository.put_many.
+
+        Args:
+            records (iterable): The records to store.
+        """
+        records = list(records)
+        self._begin([record.get(self.repository.key) for record in records])
+        self.mutations = self.repository.stage_put_many(records)
+
+    def insert_many(self, records):
+        """
+        Stage the insertion of several new records. See
+        Repository.insert_many.
+
+        Args:
+            records (iterable): The records to store.
+
+        Returns:
+            list: One bool per record, True if it will be inserted.
+        """
+        records = list(records)
+        self._begin([record.get(self.repository.key) for record in records])
+        inserted, self.mutations = self.repository.stage_insert_many(
+            records)
+        return inserted
+
+    def mutate_many(self, mutations):
+        """
+        Stage changes made by mutators. See Repository.mutate_many.
+
+        Args:
+            mutations (iterable): (record_id, mutator) pairs.
+
+        Returns:
+            list: The value returned by each mutator, or None for records
+            that do not exist.
+        """
+        mutations = list(mutations)
+        self._begin([record_id for record_id, _ in mutations])
+        results, self.mutations = self.repository.stage_mutate_many(
+            mutations)
+        return results
+
+    def mutate(self, record_id, mutator):
+        """
+        Stage a change made by a mutator. See Repository.mutate.
+
+        Args:
+            record_id: The ID of the record to change.
+            mutator (callable): Called with the in-memory record.
+
+        Returns:
+            The value returned by the mutator, or None if the record does
+            not exist.
+        """
+        return self.mutate_many([(record_id, mutator)])[0]
+
+    def contains_many(self, record_ids):
+        """
+        Lock records without changing them, so they cannot be deleted or
+        changed by others before the transaction ends, and check which of
+        them exist.
+
+        Args:
+            record_ids (iterable): The IDs of the records to check.
+
+        Returns:
+            list: One bool per ID, True if the record exists.
+        """
+        record_ids = list(record_ids)
+        self._begin(record_ids)
+        return self.repository.stage_contains_many(record_ids)
+
+    def update_many(self, patches):
+        """
+        Stage updates of several existing records. See
+        Repository.update_many.
+
+        Args:
+            patches (dict): Maps each record ID to a dictionary of
+                attributes to update.
+
+        Returns:
+            list: The IDs of the records that were found and will be
+            updated.
+        """
+        self._begin(list(patches))
+        updated, self.mutations = self.repository.stage_update_many(patches)
+        return updated
+
+    def delete_many(self, record_ids):
+        """
+        Stage the deletion of several records. See Repository.delete_many.
+
+        Args:
+            record_ids (iterable): The IDs of the records to delete.
+
+        Returns:
+            list: The IDs of the records that were found.
+        """
+        record_ids = list(record_ids)
+        self._begin(record_ids)
+        deleted, self.mutations = self.repository.stage_delete_many(
+            record_ids)
+        return deleted
+
+
+class Transaction:
+    """
+    A unit of work over several repositories, committed atomically.
+
+    Used as a context manager, it commits when the block exits normally
+    and rolls back if it raises:
+
+        with Transaction() as transaction:
+            transaction.stage(hotels).mutate(hotel_id, reserve)
+            transaction.stage(reservations).put_many([record])
+
+    Each repository may be changed by one call per transaction. To avoid
+    deadlocks, transactions must change repositories in the same order:
+    hotels, then customers, then reservations.
+
+    Events emitted with emit are written to the commit log with the
+    changes, and appended to the event log while the stores are written.
+    """
+
+    def __init__(self):
+        """
+        Initialize an empty Transaction instance.
+        """
+        self._stack = contextlib.ExitStack()
+        self._stages = {}
+        self._logged = False
+        self._directory = None
+        # (event_type, repository, record_id, details) of each event, and
+        # the feed that sequenced them.
+        self._events = []
+        self._feed = None
+
+    def stage(self, repository):
+        """
+        Return the object through which a repository is changed.
+
+        Args:
+            repository (Repository): The repository to change.
+
+        Returns:
+            The staging object, with put_many, insert_many, mutate,
+            mutate_many, update_many and delete_many methods mirroring
+            those of the repository, and contains_many to lock records
+            that must not change.
+        """
+        stage = self._stages.get(id(repository))
+        if stage is None:
+            if not self._stages:
+                self._directory = os.path.dirname(repository.file_path)
+            stage = self._stages[id(repository)] = _Stage(
+                self._stack, repository)
+        return stage
+
+    def emit(self, event_type, repository, record_ids, details=None):
+        """
+        Emit one event per record when the transaction commits, if the
+        feed is enabled. See events.emit.
+
+        Args:
+            event_type (str): The type of the events.
+            repository (Repository): The repository holding the records.
+            record_ids (iterable): The IDs of the changed records.
+            details (iterable, optional): The details of each event, in
+                the order of the IDs. Defaults to None for every event.
+        """
+        if get_feed() is None:
+            return
+        if details is None:
+            details = itertools.repeat(None)
+        self._events.extend(
+            (event_type, repository, record_id, detail)
+            for record_id, detail in zip(record_ids, details)
+        )
+
+    def _build_events(self, stores):
+        """
+        Return the events emitted so far, each with the state the
+        transaction leaves its record in.
+        """
+        self._feed = get_feed()
+        if self._feed is None or not self._events:
+            return []
+        states = {
+            (id(stage.repository), record_id): record
+            for stage, mutations in stores
+            for _, record_id, record in mutations
+        }
+        events = []
+        for event_type, repository, record_id, details in self._events:
+            key = (id(repository), record_id)
+            if key in states:
+                record = states[key]
+                record = dict(record) if record is not None else None
+            else:
+                record = repository.get(record_id)
+            events.append(Event(None, event_type, record_id, record,
+                                details))
+        return events
+
+    def commit(self):
+        """
+        Write every staged change, and the events emitted, durably, then
+        to the stores and the event log.
+        """
+        if not any(stage.mutations for stage in self._stages.values()):
+            return
+        # Stages that only locked records are logged too, as their records
+        # must still be unchanged for the transaction to be replayed.
+        stores = [
+            (stage, stage.repository.encode_mutations(stage.mutations))
+            for stage in self._stages.values()
+            if stage.begun
+        ]
+        events = self._build_events(stores)
+        log = self._feed.log if events else None
+        transaction_id = uuid.uuid4().hex if log is not None else None
+
+        def apply():
+            for stage, mutations in stores:
+                if mutations:
+                    stage.repository.commit_staged(mutations)
+            if events:
+                self._feed.append(events, transaction_id)
+
+        if len(stores) == 1 and log is None:
+            # A single store is written as a plain write would write it,
+            # and no events must reach a log with it.
+            apply()
+            return
+        logged = {"stores": [
+            {
+                "file_path": stage.repository.file_path,
+                "key": stage.repository.key,
+                "mutations": mutations,
+                "before": list(stage.checkpoint.items()),
+            }
+            for stage, mutations in stores
+        ]}
+        if log is not None:
+            logged["events"] = {
+                "log": log.path,
+                "offset": log.size(),
+                "id": transaction_id,
+                "events": [event.to_dict() for event in events],
+            }
+        data = json.dumps(logged).encode("utf-8") + b"\n"
+
+        def logged_apply():
+            self._logged = True
+            apply()
+
+        _commit_log(self._directory).commit(data, logged_apply)
+
+    def rollback(self):
+        """
+        Restore every staged record to its state before the transaction.
+        """
+        for stage in reversed(list(self._stages.values())):
+            stage.repository.restore(stage.checkpoint)
+
+    def __enter__(self):
+        """
+        Start the transaction.
+        """
+        return self
+
+    def _publish(self):
+        """
+        Publish the records of every store changed by the transaction
+        together, while their locks are still held.
+        """
+        versions = {}
+        for stage in self._stages.values():
+            if stage.begun:
+                version = stage.repository.staged_version()
+                if version is not None:
+                    versions[stage.repository] = version
+        publish(versions)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """
+        Commit the transaction, or roll it back on error, publish the
+        resulting records and release the locks the transaction holds.
+        """
+        failed = False
+        try:
+            if exc_type is None:
+                try:
+                    self.commit()
+                except BaseException as error:
+                    # Once logged, the transaction is recovered instead.
+                    if not self._logged:
+                        self.rollback()
+                        raise
+                    # The stores may hold only part of the transaction.
+                    for stage in self._stages.values():
+                        stage.repository.invalidate()
+                    failed = isinstance(error, Exception)
+                    raise
+            else:
+                self.rollback()
+        finally:
+            try:
+                self._publish()
+            finally:
+                self._stack.close()
+                if failed:
+                    # The log was handed over by the commit log.
+                    recover(self._directory)
+                if self._events and self._feed is not None:
+                    # Only now that the locks are released, as subscribers
+                    # may need them to catch up.
+                    self._feed.wait_for_room()
+        return False
+
+
+def in_transaction(transaction=None):
+    """
+    Return a context manager for changes made in a transaction.
+
+    Args:
+        transaction (Transaction, optional): The transaction to stage the
+            changes in. Defaults to a new one, committed when the block
+            exits.
+
+    Returns:
+        A context manager yielding the transaction.
+    """
+    if transaction is not None:
+        return contextlib.nullcontext(transaction)
+    return Transaction()
+
+
+def inserter(repository, event_type):
+    """
+    Return a function inserting records in a transaction that emits an
+    event for each record inserted, to pass to Repository.create_many.
+
+    Args:
+        repository (Repository): The repository to insert into.
+        event_type (str): The type of the events.
+
+    Returns:
+        callable: Called with a list of records, returns one bool per
+        record, True if it was inserted.
+    """
+    def insert(records):
+        with Transaction() as transaction:
+            inserted = transaction.stage(repository).insert_many(records)
+            transaction.emit(event_type, repository, [
+                record.get(repository.key)
+                for record, created in zip(records, inserted) if created
+            ])
+        return inserted
+    return insert
+
+
+class _Request:
+    """
+    A request waiting in a GroupCommit.
+    """
+
+    __slots__ = ("value", "done", "result", "error")
+
+    def __init__(self, value):
+        self.value = value
+        self.done = False
+        self.result = None
+        self.error = None
+
+
+class GroupCommit:
+    """
+    Batches requests submitted concurrently by several threads, so they are
+    handled by a single transaction and share a single fsync.
+
+    The first thread to arrive becomes the leader: it takes every request
+    queued so far and handles them as one batch, while the threads that
+    arrive meanwhile queue up for the next batch. A single caller is
+    therefore never delayed, and the batches grow with the load.
+    """
+
+    def __init__(self, handler, window=0.0, max_batch=1000):
+        """
+        Initialize a GroupCommit instance.
+
+        Args:
+            handler (callable): Called with a list of requests, returns the
+                list of their results.
+            window (float, optional): Seconds a leader waits for more
+                requests before handling a batch. Defaults to 0.
+            max_batch (int, optional): Largest number of requests handled
+                in one batch.
+        """
+        self._handler = handler
+        self.window = window
+        self.max_batch = max_batch
+        self._queue = []
+        self._queue_lock = threading.Lock()
+        self._commit_lock = threading.Lock()
+
+    def submit(self, value):
+        """
+        Handle a request, possibly batched with concurrent ones.
+
+        Args:
+            value: The request passed to the handler.
+
+        Returns:
+            The result of the request, as returned by the handler.
+        """
+        request = _Request(value)
+        with self._queue_lock:
+            self._queue.append(request)
+        while not request.done:
+            with self._commit_lock:
+                if request.done:
+                    break
+                if self.window:
+                    time.sleep(self.window)
+                with self._queue_lock:
+                    batch = self._queue[:self.max_batch]
+                    del self._queue[:self.max_batch]
+                # Left to the others of the batch if the leader is
+                # interrupted.
+                failure = RuntimeError("The batch was interrupted")
+                try:
+                    results = self._handler([r.value for r in batch])
+                    for waiting, result in zip(batch, results):
+                        waiting.result = result
+                    failure = None
+                except Exception as error:  # pylint: disable=broad-except
+                    failure = error
+                finally:
+                    for waiting in batch:
+                        waiting.error = failure
+                        waiting.done = True
+        if request.error is not None:
+            raise request.error
+        return request.result
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+test_analytics.py
+
+Unit tests for the occupancy analytics.
+Tests include the occupancy by hotel and by location, the distribution of
+free rooms and the incremental update of the columns. They are skipped
+when NumPy is not installed.
+"""
+
+import datetime
+import math
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from app import analytics
+from app import hotel as hotel_module
+from app.hotel import Hotel
+from app.repository import reset_repositories
+
+
+@unittest.skipIf(analytics.np is None, "NumPy is not installed")
+class TestAnalytics(unittest.TestCase):
+    """
+    Test cases for the analytics queries.
+    """
+
+    def setUp(self):
+        """
+        Point the hotel store at a temporary directory and create hotels
+        with some reserved rooms.
+        """
+        self.tmp_dir = tempfile.mkdtemp()
+        self.patch = mock.patch.object(
+            hotel_module, "HOTEL_FILE",
+            os.path.join(self.tmp_dir, "hotels.json"))
+        self.patch.start()
+        reset_repositories()
+        Hotel.create_hotels([
+            Hotel(1, "Harbor Inn", "Seaside", 4, [10, 11]),
+            Hotel(2, "Bay Hotel", "Seaside", 2, [12, 13]),
+            Hotel(3, "Lakeside Resort", "Lakeview", 10),
+            Hotel(4, "Closed Inn", "Lakeview", 0),
+        ])
+
+    def tearDown(self):
+        """
+        Restore the hotel store and remove the directory.
+        """
+        self.patch.stop()
+        reset_repositories()
+        shutil.rmtree(self.tmp_dir)
+
+    def rates(self, location=None):
+        """
+        Return the occupancy rates by hotel ID.
+        """
+        hotel_ids, rates = analytics.occupancy_by_hotel(location)
+        return dict(zip(hotel_ids.tolist(), rates.tolist()))
+
+    def test_occupancy_by_hotel(self):
+        """
+        Test the occupancy rate of each hotel, NaN without rooms.
+        """
+        rates = self.rates()
+        self.assertEqual({k: rates[k] for k in (1, 2, 3)},
+                         {1: 0.5, 2: 1.0, 3: 0.0})
+        self.assertTrue(math.isnan(rates[4]))
+        self.assertEqual(self.rates("Seaside"), {1: 0.5, 2: 1.0})
+        self.assertEqual(self.rates("Nowhere"), {})
+
+    def test_occupancy_by_location(self):
+        """
+        Test the occupancy aggregated by location.
+        """
+        self.assertEqual(analytics.occupancy_by_location(), {
+            "Seaside": {"hotels": 2, "total_rooms": 6, "held_rooms": 4,
+                        "occupancy_rate": 4 / 6},
+            "Lakeview": {"hotels": 2, "total_rooms": 10, "held_rooms": 0,
+                         "occupancy_rate": 0.0},
+        })
+
+    def test_free_rooms_distribution(self):
+        """
+        Test the histogram and statistics of free rooms.
+        """
+        distribution = analytics.free_rooms_distribution(
+            percentiles=(0, 100))
+        self.assertEqual(distribution["hotels"], 4)
+        self.assertEqual(distribution["histogram"].tolist(),
+                         [2, 0, 1] + [0] * 7 + [1])
+        self.assertEqual(distribution["mean"], 3.0)
+        self.assertEqual(distribution["percentiles"], {0: 0.0, 100: 10.0})
+        empty = analytics.free_rooms_distribution("Nowhere")
+        self.assertEqual(empty["hotels"], 0)
+        self.assertTrue(math.isnan(empty["mean"]))
+
+    def test_columns_follow_changes(self):
+        """
+        Test that the columns are updated with each change rather than
+        rebuilt.
+        """
+        analytics.occupancy_by_hotel()
+        with mock.patch.object(analytics.OccupancyColumns, "rebuild") as (
+                rebuild):
+            Hotel.reserve_room(3, 20)
+            Hotel.reserve_room(3, 21, "2099-05-01", "2099-05-03")
+            Hotel.modify_hotel(4, {"total_rooms": 5, "location": "Hill"})
+            Hotel.delete_hotel(2)
+            Hotel.create_hotel(Hotel(5, "New Inn", "Seaside", 1, [30]))
+            rates = self.rates()
+            by_location = analytics.occupancy_by_location()
+        rebuild.assert_not_called()
+        self.assertEqual(rates, {1: 0.5, 3: 0.2, 4: 0.0, 5: 1.0})
+        self.assertEqual(
+            {location: summary["hotels"]
+             for location, summary in by_location.items()},
+            {"Seaside": 2, "Lakeview": 1, "Hill": 1})
+
+    def test_ended_stays_are_not_held(self):
+        """
+        Test that the columns are recounted on a new day, so a stay holds
+        its room only until it ends.
+        """
+        for day, rate in (("2026-03-02", 0.1), ("2026-03-03", 0.0)):
+            ordinal = datetime.date.fromisoformat(day).toordinal()
+            with mock.patch("app.occupancy.today", return_value=ordinal), \
+                    mock.patch.object(analytics, "today",
+                                      return_value=ordinal):
+                if rate:
+                    Hotel.reserve_room(3, 20, "2026-03-01", "2026-03-03")
+                self.assertEqual(self.rates()[3], rate)
+
+    def test_requires_numpy(self):
+        """
+        Test that queries report a missing NumPy.
+        """
+        with mock.patch.object(analytics, "np", None):
+            self.assertRaises(ImportError, analytics.occupancy_by_location)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+test_availability.py
+
+Unit tests for the NightlyInventory class and for date-range reservations.
+Tests include range bookings, overlapping stays and mixing stays with
+reservations without dates.
+"""
+
+import datetime
+import random
+import unittest
+from unittest import mock
+
+from app.availability import NightlyInventory, stay_nights
+from app.occupancy import Occupancy
+
+
+class TestNightlyInventory(unittest.TestCase):
+    """
+    Test cases for the NightlyInventory class.
+    """
+
+    def test_matches_brute_force(self):
+        """
+        Test range updates and queries against a per-night array.
+        """
+        rng = random.Random(7)
+        inventory = NightlyInventory()
+        nights = [0] * 200
+        base = datetime.date(2026, 1, 1).toordinal()
+        for _ in range(300):
+            first = rng.randrange(200)
+            end = rng.randrange(first + 1, 201)
+            amount = rng.choice((1, 1, 2, -1))
+            inventory.add(base + first, base + end, amount)
+            for night in range(first, end):
+                nights[night] += amount
+            first = rng.randrange(200)
+            end = rng.randrange(first + 1, 201)
+            self.assertEqual(inventory.booked(base + first, base + end),
+                             max(nights[first:end]))
+        self.assertEqual(inventory.peak(), max(nights))
+
+    def test_released_nodes_are_freed(self):
+        """
+        Test that releasing stays frees their nodes, so churn does not
+        grow the tree.
+        """
+        rng = random.Random(3)
+        inventory = NightlyInventory()
+        base = datetime.date(2026, 1, 1).toordinal()
+        stays = []
+        sizes = []
+        for _ in range(2000):
+            first = base + rng.randrange(365)
+            stays.append((first, first + rng.randrange(1, 15)))
+            inventory.add(*stays[-1], 1)
+            if len(stays) > 50:
+                inventory.add(*stays.pop(rng.randrange(len(stays))), -1)
+            sizes.append(len(inventory))
+        self.assertLess(max(sizes[1000:]), 2 * max(sizes[:1000]))
+        for stay in stays:
+            inventory.add(*stay, -1)
+        self.assertEqual(len(inventory), 1)
+        self.assertEqual(inventory.peak(), 0)
+
+    def test_invalid_stay(self):
+        """
+        Test that a stay must end after it starts.
+        """
+        with self.assertRaises(ValueError):
+            stay_nights("2026-03-02", "2026-03-02")
+
+
+class TestStays(unittest.TestCase):
+    """
+    Test cases for date-range reservations in an Occupancy.
+    """
+
+    def test_same_room_on_different_nights(self):
+        """
+        Test that one room can be sold for consecutive stays.
+        """
+        occupancy = Occupancy()
+        self.assertTrue(occupancy.reserve(1, 1, "2026-03-01", "2026-03-03"))
+        self.assertTrue(occupancy.reserve(2, 1, "2026-03-03", "2026-03-05"))
+        self.assertFalse(occupancy.reserve(3, 1, "2026-03-02", "2026-03-04"))
+        occupancy.cancel(1)
+        self.assertTrue(occupancy.reserve(3, 1, "2026-03-01", "2026-03-03"))
+
+    def test_reservations_without_dates_hold_every_night(self):
+        """
+        Test that a reservation without dates blocks every stay.
+        """
+        occupancy = Occupancy()
+        self.assertTrue(occupancy.reserve(1, 2, "2099-03-01", "2099-03-03"))
+        self.assertTrue(occupancy.reserve(2, 2))
+        self.assertFalse(occupancy.reserve(3, 2))
+        self.assertFalse(occupancy.reserve(3, 2, "2099-03-02", "2099-03-04"))
+        self.assertTrue(occupancy.reserve(3, 2, "2099-03-03", "2099-03-04"))
+
+    def test_ended_stays_do_not_count(self):
+        """
+        Test that without dates only the nights from today on count.
+        """
+        occupancy = Occupancy()
+        occupancy.reserve(1, 2, "2026-03-01", "2026-03-03")
+        occupancy.reserve(2, 2, "2026-03-01", "2026-03-03")
+        occupancy.reserve(3, 2, "2026-03-05", "2026-03-07")
+        day = datetime.date(2026, 3, 4).toordinal()
+        with mock.patch("app.occupancy.today", return_value=day):
+            self.assertEqual(occupancy.held_rooms(), 1)
+            self.assertEqual(occupancy.free_rooms(2), 1)
+            self.assertTrue(occupancy.reserve(4, 2))
+            self.assertFalse(occupancy.has_room(2))
+
+    def test_round_trip(self):
+        """
+        Test that stays are serialized and restored.
+        """
+        occupancy = Occupancy([9])
+        occupancy.reserve(1, 3, datetime.date(2026, 3, 1), "2026-03-03")
+        restored = Occupancy.from_list(occupancy.to_list(),
+                                       occupancy.stays_to_list())
+        self.assertEqual(restored.to_list(), [9, 1])
+        self.assertEqual(restored.stays_to_list(),
+                         [[1, "2026-03-01", "2026-03-03"]])
+        self.assertFalse(restored.has_room(2, "2026-03-02", "2026-03-03"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+test_benchmark.py
+
+Unit tests for the benchmark module.
+Tests include a small benchmark run and the comparison with a baseline.
+"""
+
+import os
+import unittest
+
+from app.benchmark import compare, run_codecs, run_size
+from app.persistence import CODECS
+
+
+class TestBenchmark(unittest.TestCase):
+    """
+    Test cases for the benchmark harness.
+    """
+
+    def test_run_size_reports_every_operation(self):
+        """
+        Test that a small run times every operation and leaves the working
+        directory unchanged.
+        """
+        directory = os.getcwd()
+        result = run_size(20, samples=5)
+        self.assertEqual(os.getcwd(), directory)
+        self.assertGreater(result["peak_rss_kb"], 0)
+        self.assertEqual(len(result["operations"]), 12)
+        for summary in result["operations"].values():
+            self.assertGreater(summary["ops_per_sec"], 0)
+            self.assertLessEqual(summary["p50_ms"], summary["p99_ms"])
+
+    def test_compare_with_baseline(self):
+        """
+        Test that slower throughput or latency beyond the tolerance is
+        reported, and smaller changes are not.
+        """
+        def results(ops_per_sec, p99_ms):
+            return {"results": {"1000": {"operations": {"display_hotel": {
+                "ops_per_sec": ops_per_sec, "p50_ms": 0.1, "p99_ms": p99_ms,
+            }}}}}
+
+        baseline = results(1000, 1.0)
+        self.assertEqual(compare(results(900, 1.1), baseline), [])
+        self.assertEqual(len(compare(results(700, 1.5), baseline)), 2)
+        self.assertEqual(compare(results(700, 1.5), {"results": {}}), [])
+
+    def test_run_codecs(self):
+        """
+        Test that every codec is timed and its file size reported.
+        """
+        results = run_codecs(50, repeat=1)
+        self.assertEqual(set(results), set(CODECS))
+        for result in results.values():
+            self.assertGreater(result["bytes"], 0)
+            self.assertGreaterEqual(result["encode_ms"], 0)
+        self.assertLess(results["compact-json"]["bytes"],
+                        results["json"]["bytes"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+test_concurrency.py
+
+Stress tests for concurrent writers.
+Several processes book rooms and create customers against the same data
+directory, and the results are checked for overbooking and lost updates.
+"""
+
+import multiprocessing
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from app import customer as customer_module
+from app import hotel as hotel_module
+from app.customer import Customer
+from app.hotel import Hotel
+from app.persistence import (
+    set_storage_mode,
+    JSON_MODE,
+    JOURNAL_MODE,
+    NDJSON_MODE,
+)
+from app.repository import reset_repositories
+from app.storage import ShardedBackend, set_backend
+
+WORKERS = 6
+ATTEMPTS = 25
+HOTELS = 4
+ROOMS = 30
+
+
+def book(worker):
+    """
+    Try to book ATTEMPTS rooms spread over the hotels, and create one
+    customer per attempt.
+
+    Args:
+        worker (int): Number of the worker process.
+
+    Returns:
+        list: The reservation IDs that were booked.
+    """
+    booked = []
+    for attempt in range(ATTEMPTS):
+        reservation_id = worker * 1000 + attempt
+        if Hotel.reserve_room(attempt % HOTELS + 1, reservation_id):
+            booked.append(reservation_id)
+        Customer.create_customer(
+            Customer(reservation_id, "Guest", "guest@example.com", "555"))
+    return booked
+
+
+def register(worker):
+    """
+    Create ATTEMPTS customers without choosing their IDs.
+
+    Args:
+        worker (int): Number of the worker process.
+
+    Returns:
+        list: The IDs given to the customers.
+    """
+    customers = [
+        Customer(None, f"Guest {worker}", "guest@example.com", "555")
+        for _ in range(ATTEMPTS)
+    ]
+    for customer in customers:
+        Customer.create_customer(customer)
+    return [customer.customer_id for customer in customers]
+
+
+@unittest.skipUnless(hasattr(os, "fork"), "requires fork")
+class TestConcurrentWriters(unittest.TestCase):
+    """
+    Test cases for writers running in several processes.
+    """
+
+    def setUp(self):
+        """
+        Point the stores to a temporary directory.
+        """
+        self.tmp_dir = tempfile.mkdtemp()
+        self.patches = [
+            mock.patch.object(hotel_module, "HOTEL_FILE",
+                              os.path.join(self.tmp_dir, "hotels.json")),
+            mock.patch.object(customer_module, "CUSTOMER_FILE",
+                              os.path.join(self.tmp_dir, "customers.json")),
+        ]
+        for patch in self.patches:
+            patch.start()
+        reset_repositories()
+
+    def tearDown(self):
+        """
+        Restore the stores and remove the directory.
+        """
+        for patch in self.patches:
+            patch.stop()
+        set_storage_mode(JSON_MODE)
+        set_backend(None)
+        reset_repositories()
+        shutil.rmtree(self.tmp_dir)
+
+    def run_workers(self):
+        """
+        Run the workers in parallel and check the final state.
+        """
+        Hotel.create_hotels(
+            Hotel(hotel_id, f"Hotel {hotel_id}", "Downtown", ROOMS)
+            for hotel_id in range(1, HOTELS + 1)
+        )
+        context = multiprocessing.get_context("fork")
+        with mock.patch("builtins.print"):
+            with context.Pool(WORKERS) as pool:
+                results = pool.map(book, range(WORKERS))
+        reset_repositories()
+        booked = sorted(r for worker in results for r in worker)
+        self.assertEqual(len(booked), HOTELS * ROOMS)
+        stored = []
+        for hotel_id in range(1, HOTELS + 1):
+            reserved_rooms = Hotel.display_hotel(hotel_id)["reserved_rooms"]
+            self.assertEqual(len(reserved_rooms), ROOMS)
+            stored.extend(reserved_rooms)
+        self.assertEqual(sorted(stored), booked)
+        for worker in range(WORKERS):
+            for attempt in range(ATTEMPTS):
+                self.assertIsNotNone(
+                    Customer.display_customer(worker * 1000 + attempt))
+
+    def test_json_mode(self):
+        """
+        Test that whole-file writers neither overbook nor lose updates.
+        """
+        self.run_workers()
+
+    def test_journal_mode(self):
+        """
+        Test that journal writers neither overbook nor lose updates, while
+        snapshots are being taken.
+        """
+        set_storage_mode(JOURNAL_MODE, snapshot_interval=20)
+        self.run_workers()
+
+    def test_ndjson_mode(self):
+        """
+        Test that streaming writers neither overbook nor lose updates.
+        """
+        set_storage_mode(NDJSON_MODE)
+        self.run_workers()
+
+    def test_sharded_backend(self):
+        """
+        Test that writers to separate shards neither overbook nor lose
+        updates.
+        """
+        set_backend(ShardedBackend(3))
+        self.run_workers()
+
+    def test_allocated_ids_are_unique(self):
+        """
+        Test that customers created in several processes are all given
+        distinct IDs.
+        """
+        Customer.create_customer(
+            Customer(1, "Existing", "guest@example.com", "555"))
+        context = multiprocessing.get_context("fork")
+        with context.Pool(WORKERS) as pool:
+            results = pool.map(register, range(WORKERS))
+        reset_repositories()
+        ids = [customer_id for worker in results for customer_id in worker]
+        self.assertEqual(len(set(ids)), WORKERS * ATTEMPTS)
+        self.assertNotIn(1, ids)
+        for customer_id in ids:
+            self.assertIsNotNone(Customer.display_customer(customer_id))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+"""
+test_consistency.py
+
+Unit tests for the consistency checker and repair tool.
+Tests include every kind of issue, partitioned checks, the repair of the
+stores in each format and with each backend, unreadable stores and the
+command line.
+"""
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from app.consistency import (
+    DUPLICATE_ID,
+    MISSING_CUSTOMER,
+    MISSING_HOTEL,
+    ORPHANED_RESERVATION,
+    ORPHANED_ROOM,
+    OVER_CAPACITY,
+    UNREADABLE_STORE,
+    check,
+    main,
+    repair,
+)
+from app.persistence import NDJSON_FORMAT, detect_format, load_data
+from app.storage import ShardedBackend, SqliteBackend, set_backend
+
+HOTELS = [
+    {"hotel_id": 1, "name": "A", "total_rooms": 2,
+     "reserved_rooms": [10, 11, 90]},
+    {"hotel_id": 2, "name": "B", "total_rooms": 1,
+     "reserved_rooms": [12, 13]},
+    {"hotel_id": 3, "name": "C", "total_rooms": 1, "reserved_rooms": [],
+     "stays": [[14, "2026-05-01", "2026-05-03"]]},
+    {"hotel_id": 1, "name": "A2", "total_rooms": 9,
+     "reserved_rooms": [15]},
+    {"hotel_id": 4, "name": "D", "total_rooms": 0, "reserved_rooms": []},
+]
+CUSTOMERS = [
+    {"customer_id": 1, "name": "X"},
+    {"customer_id": 2, "name": "Y"},
+    {"customer_id": 2, "name": "Y2"},
+]
+RESERVATIONS = [
+    # Held by hotel 1.
+    {"reservation_id": 10, "hotel_id": 1, "customer_id": 1},
+    # Held by hotel 1, but its customer does not exist.
+    {"reservation_id": 11, "hotel_id": 1, "customer_id": 9},
+    # Held by hotel 2, which is over capacity.
+    {"reservation_id": 12, "hotel_id": 2, "customer_id": 1},
+    {"reservation_id": 13, "hotel_id": 2, "customer_id": 2},
+    # Held by hotel 3 for its stay.
+    {"reservation_id": 14, "hotel_id": 3, "customer_id": 1,
+     "check_in": "2026-05-01", "check_out": "2026-05-03"},
+    # Held by a duplicate of hotel 1 only.
+    {"reservation_id": 15, "hotel_id": 1, "customer_id": 1},
+    # Not held, and hotel 4 has no room.
+    {"reservation_id": 16, "hotel_id": 4, "customer_id": 1},
+    # Hotel 9 does not exist.
+    {"reservation_id": 17, "hotel_id": 9, "customer_id": 1},
+    # A duplicate, hidden by reservation 10.
+    {"reservation_id": 10, "hotel_id": 9, "customer_id": 9},
+]
+
+
+def _key(issue):
+    """
+    Return a sortable form of an issue.
+    """
+    return json.dumps(issue, sort_keys=True)
+
+
+class TestConsistency(unittest.TestCase):
+    """
+    Test cases for check and repair.
+    """
+
+    def setUp(self):
+        """
+        Write inconsistent stores to a temporary directory.
+        """
+        self.tmp_dir = tempfile.mkdtemp()
+        self.files = tuple(
+            os.path.join(self.tmp_dir, name)
+            for name in ("hotels.json", "customers.json",
+                         "reservations.json")
+        )
+        for file_path, records in zip(
+                self.files, (HOTELS, CUSTOMERS, RESERVATIONS)):
+            with open(file_path, "w", encoding="utf-8") as f:
+                json.dump(records, f)
+
+    def tearDown(self):
+        """
+        Remove the temporary directory.
+        """
+        shutil.rmtree(self.tmp_dir)
+
+    def _issues(self, partitions=None):
+        """
+        Return the issues found in the stores, in a stable order.
+        """
+        return sorted(check(*self.files, partitions=partitions), key=_key)
+
+    def test_check(self):
+        """
+        Test that every kind of issue is found, and that records hidden by
+        a duplicate are ignored.
+        """
+        expected = [
+            {"kind": DUPLICATE_ID, "store": "hotels", "id": 1, "count": 2},
+            {"kind": DUPLICATE_ID, "store": "customers", "id": 2,
+             "count": 2},
+            {"kind": DUPLICATE_ID, "store": "reservations", "id": 10,
+             "count": 2},
+            {"kind": ORPHANED_ROOM, "store": "hotels", "id": 1,
+             "reservation_id": 90},
+            {"kind": ORPHANED_RESERVATION, "store": "reservations",
+             "id": 15, "hotel_id": 1, "check_in": None,
+             "check_out": None},
+            {"kind": ORPHANED_RESERVATION, "store": "reservations",
+             "id": 16, "hotel_id": 4, "check_in": None,
+             "check_out": None},
+            {"kind": MISSING_HOTEL, "store": "reservations", "id": 17,
+             "hotel_id": 9},
+            {"kind": MISSING_CUSTOMER, "store": "reservations", "id": 11,
+             "customer_id": 9, "hotel_id": 1},
+            {"kind": OVER_CAPACITY, "store": "hotels", "id": 2,
+             "held_rooms": 2, "total_rooms": 1},
+            {"kind": OVER_CAPACITY, "store": "hotels", "id": 1,
+             "held_rooms": 3, "total_rooms": 2},
+        ]
+        self.assertEqual(self._issues(), sorted(expected, key=_key))
+
+    def test_partitions(self):
+        """
+        Test that the issues do not depend on the number of partitions,
+        and that the spilled facts are removed.
+        """
+        self.assertEqual(self._issues(partitions=7), self._issues())
+        self.assertEqual(sorted(os.listdir(self.tmp_dir)),
+                         ["customers.json", "hotels.json",
+                          "reservations.json"])
+
+    def test_consistent(self):
+        """
+        Test that consistent or missing stores have no issues.
+        """
+        for file_path in self.files:
+            os.remove(file_path)
+        self.assertEqual(self._issues(), [])
+
+    def test_repair(self):
+        """
+        Test that the repair leaves only the hotel over capacity.
+        """
+        result = repair(*self.files)
+        self.assertEqual(len(result["issues"]), 10)
+        self.assertEqual(result["duplicates_removed"], 3)
+        # 90, and 11 whose customer is missing.
+        self.assertEqual(result["rooms_released"], 2)
+        # 15, once 90 and 11 are released; hotel 4 has no room for 16.
+        self.assertEqual(result["rooms_reserved"], 1)
+        self.assertEqual(result["reservations_deleted"], 3)
+
+        self.assertEqual(
+            [issue["kind"] for issue in self._issues()], [OVER_CAPACITY])
+        hotels = load_data(self.files[0])
+        self.assertEqual(
+            [(hotel["hotel_id"], hotel["name"], hotel["reserved_rooms"])
+             for hotel in hotels],
+            [(1, "A", [10, 15]), (2, "B", [12, 13]), (3, "C", []),
+             (4, "D", [])])
+        self.assertEqual(hotels[2], HOTELS[2])
+        self.assertEqual(
+            [customer["name"] for customer in load_data(self.files[1])],
+            ["X", "Y"])
+        self.assertEqual(
+            [(reservation["reservation_id"], reservation["customer_id"])
+             for reservation in load_data(self.files[2])],
+            [(10, 1), (12, 1), (13, 2), (14, 1), (15, 1)])
+
+    def test_repair_keeps_format(self):
+        """
+        Test that a repaired store keeps its format.
+        """
+        with open(self.files[2], "w", encoding="utf-8") as f:
+            for record in RESERVATIONS:
+                f.write(json.dumps(record) + "\n")
+        repair(*self.files)
+        self.assertEqual(detect_format(self.files[2]), NDJSON_FORMAT)
+        self.assertEqual(len(load_data(self.files[2])), 5)
+
+    def test_other_backends(self):
+        """
+        Test that the stores are checked and repaired through the active
+        backend, which cannot hold duplicate IDs.
+        """
+        expected = sorted(
+            (issue for issue in self._issues()
+             if issue["kind"] != DUPLICATE_ID), key=_key)
+        backends = (
+            ShardedBackend(3),
+            SqliteBackend(os.path.join(self.tmp_dir, "stores.db")),
+        )
+        for backend in backends:
+            with self.subTest(backend=type(backend).__name__):
+                set_backend(backend)
+                try:
+                    for file_path, key in zip(
+                            self.files, ("hotel_id", "customer_id",
+                                         "reservation_id")):
+                        seen = set()
+                        records = []
+                        for record in load_data(file_path):
+                            if record[key] not in seen:
+                                seen.add(record[key])
+                                records.append(record)
+                        backend.save(file_path, key, records)
+                    self.assertEqual(self._issues(), expected)
+                    result = repair(*self.files)
+                    self.assertEqual(result["rooms_released"], 2)
+                    self.assertEqual(result["reservations_deleted"], 3)
+                    self.assertEqual(
+                        [issue["kind"] for issue in self._issues()],
+                        [OVER_CAPACITY])
+                    self.assertEqual(
+                        sorted(record["reservation_id"] for record in
+                               backend.load(self.files[2])),
+                        [10, 12, 13, 14, 15])
+                finally:
+                    set_backend(None)
+        backends[1].close()
+
+    def test_unreadable_store(self):
+        """
+        Test that an unreadable store is reported alone, and that nothing
+        is repaired.
+        """
+        with open(self.files[2], "w", encoding="utf-8") as f:
+            f.write('[{"reservation_id": 1}, {')
+        issues = self._issues()
+        self.assertEqual(len(issues), 1)
+        self.assertEqual(issues[0]["kind"], UNREADABLE_STORE)
+        self.assertEqual(issues[0]["store"], "reservations")
+
+        with open(self.files[0], "rb") as f:
+            before = f.read()
+        result = repair(*self.files)
+        self.assertEqual(result["reservations_deleted"], 0)
+        with open(self.files[0], "rb") as f:
+            self.assertEqual(f.read(), before)
+
+    def test_main(self):
+        """
+        Test the command line, with a report.
+        """
+        report = os.path.join(self.tmp_dir, "issues.ndjson")
+        args = ["--hotels", self.files[0], "--customers", self.files[1],
+                "--reservations", self.files[2], "--report", report]
+        self.assertEqual(main(args), 1)
+        with open(report, encoding="utf-8") as f:
+            self.assertEqual(len(f.readlines()), 10)
+
+        self.assertEqual(main(args + ["--repair"]), 1)
+        with open(report, encoding="utf-8") as f:
+            self.assertEqual(len(f.readlines()), 10)
+        self.assertEqual(main(args), 1)
+        with open(report, encoding="utf-8") as f:
+            self.assertEqual(len(f.readlines()), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -57,6 +57,18 @@ class TestCustomer(unittest.TestCase):
         result = Customer.display_customer(2)
         self.assertEqual(result["email"], "bobjones@example.com")
 
+    def test_modify_customer_id_is_rejected(self):
+        """
+        Test that a customer's ID cannot be changed.
+        """
+        Customer.create_customer(
+            Customer(4, "Dana White", "dana@example.com", "555-1111"))
+        Customer.modify_customer(4, {"customer_id": None})
+        self.assertEqual(Customer.display_customer(4)["customer_id"], 4)
+        self.assertEqual(
+            Customer.modify_customers({4: {"customer_id": 5}}), [])
+        self.assertIsNone(Customer.display_customer(5))
+
     def test_delete_customer(self):
         """
         Test deletion of a customer.
@@ -67,5 +79,24 @@ class TestCustomer(unittest.TestCase):
         result = Customer.display_customer(3)
         self.assertIsNone(result)
 
+    def test_bulk_customer_operations(self):
+        """
+        Test creating, modifying and deleting customers in batches.
+        """
+        Customer.create_customers(
+            Customer(i, f"Guest {i}", f"guest{i}@example.com", "555-0000")
+            for i in range(10, 15)
+        )
+        updated = Customer.modify_customers({
+            10: {"phone": "555-9999"},
+            99: {"phone": "555-9999"}
+        })
+        self.assertEqual(updated, [10])
+        self.assertEqual(Customer.display_customer(10)["phone"], "555-9999")
+        deleted = Customer.delete_customers([11, 12, 99])
+        self.assertEqual(deleted, [11, 12])
+        self.assertIsNone(Customer.display_customer(11))
+        self.assertIsNotNone(Customer.display_customer(13))
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+"""
+test_events.py
+
+Unit tests for the change feed.
+Tests include the events emitted by each operation, subscriptions, the
+bounded queue and resuming from the event log.
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from app import customer as customer_module
+from app import events
+from app import hotel as hotel_module
+from app import reservation as reservation_module
+from app import transaction as transaction_module
+from app.customer import Customer
+from app.events import EventLog
+from app.hotel import Hotel
+from app.repository import reset_repositories
+from app.reservation import Reservation
+
+
+class TestEvents(unittest.TestCase):
+    """
+    Test cases for the change feed.
+    """
+
+    def setUp(self):
+        """
+        Point the stores at a temporary directory and enable the feed with
+        a log there.
+        """
+        self.tmp_dir = tempfile.mkdtemp()
+        self.patches = [
+            mock.patch.object(customer_module, "CUSTOMER_FILE",
+                              os.path.join(self.tmp_dir, "customers.json")),
+            mock.patch.object(hotel_module, "HOTEL_FILE",
+                              os.path.join(self.tmp_dir, "hotels.json")),
+            mock.patch.object(reservation_module, "RESERVATION_FILE",
+                              os.path.join(self.tmp_dir,
+                                           "reservations.json")),
+        ]
+        for patch in self.patches:
+            patch.start()
+        reset_repositories()
+        self.log_path = os.path.join(self.tmp_dir, "events.log")
+        self.feed = events.enable(self.log_path)
+        self.received = []
+        events.subscribe(self.received.append)
+
+    def tearDown(self):
+        """
+        Disable the feed, restore the stores and remove the directory.
+        """
+        events.disable()
+        transaction_module._logs.pop(self.tmp_dir, None)
+        for patch in self.patches:
+            patch.stop()
+        reset_repositories()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_operations_emit_typed_events(self):
+        """
+        Test that each operation emits its events, in order, with the
+        state of the record.
+        """
+        Hotel.create_hotel(Hotel(1, "Harbor Inn", "Seaside", 2))
+        Customer.create_customer(
+            Customer(1, "Dana White", "dana@example.com", "555-1111"))
+        Hotel.modify_hotel(1, {"name": "Harbor Hotel"})
+        Reservation.create_reservation(Reservation(5, 1, 1))
+        Reservation.cancel_reservation(5)
+        Reservation.create_reservation(Reservation(6, 1, 1))
+        Customer.delete_customer(1)
+        self.assertTrue(self.feed.flush(5))
+
+        self.assertEqual([event.type for event in self.received], [
+            events.HOTEL_CREATED,
+            events.CUSTOMER_CREATED,
+            events.HOTEL_MODIFIED,
+            events.ROOM_RESERVED,
+            events.RESERVATION_CREATED,
+            events.ROOM_RELEASED,
+            events.RESERVATION_CANCELED,
+            events.ROOM_RESERVED,
+            events.RESERVATION_CREATED,
+            events.ROOM_RELEASED,
+            events.RESERVATION_CANCELED,
+            events.CUSTOMER_DELETED,
+        ])
+        self.assertEqual([event.sequence for event in self.received],
+                         list(range(1, 13)))
+        modified = self.received[2]
+        self.assertEqual(modified.record_id, 1)
+        self.assertEqual(modified.record["name"], "Harbor Hotel")
+        reserved = self.received[3]
+        self.assertEqual(reserved.details, {"reservation_id": 5})
+        self.assertEqual(reserved.record["reserved_rooms"], [5])
+        self.assertIsNone(self.received[-1].record)
+
+    def test_failed_operations_emit_nothing(self):
+        """
+        Test that operations that change nothing emit no event.
+        """
+        Hotel.create_hotel(Hotel(1, "Harbor Inn", "Seaside", 1))
+        with mock.patch("builtins.print"):
+            Hotel.create_hotel(Hotel(1, "Harbor Inn", "Seaside", 1))
+            Hotel.modify_hotel(9, {"name": "Nowhere"})
+            Reservation.create_reservation(Reservation(5, 1, 9))
+            Reservation.cancel_reservation(5)
+        self.assertFalse(Hotel.delete_hotel(9))
+        self.feed.flush(5)
+        self.assertEqual([event.type for event in self.received],
+                         [events.HOTEL_CREATED])
+
+    def test_type_filter_and_unsubscribe(self):
+        """
+        Test that subscribers only receive the types they asked for, and
+        nothing once unsubscribed.
+        """
+        modified = []
+        subscription = events.subscribe(
+            modified.append, types=[events.HOTEL_MODIFIED])
+        Hotel.create_hotel(Hotel(1, "Harbor Inn", "Seaside", 1))
+        Hotel.modify_hotels({1: {"location": "Bay"}})
+        self.feed.flush(5)
+        events.unsubscribe(subscription)
+        Hotel.modify_hotel(1, {"location": "Cove"})
+        self.feed.flush(5)
+        self.assertEqual([event.record["location"] for event in modified],
+                         ["Bay"])
+        self.assertEqual(len(self.received), 3)
+
+    def test_resume_from_log(self):
+        """
+        Test that a reader resumes the log from an offset, and that a new
+        feed on the same log continues its sequence numbers.
+        """
+        Hotel.create_hotels([Hotel(1, "Harbor Inn", "Seaside", 1),
+                             Hotel(2, "Lakeside Resort", "Lakeview", 1)])
+        log = EventLog(self.log_path)
+        first, offset = log.read()
+        self.assertEqual([event.record_id for event in first], [1, 2])
+        self.assertEqual(log.read(offset), ([], offset))
+
+        other = events.ChangeFeed(self.log_path)
+        other.emit([(events.HOTEL_MODIFIED, hotel_module._hotels(), 2,
+                     None)])
+        Hotel.delete_hotel(1)
+        later, offset = log.read(offset)
+        self.assertEqual([(event.sequence, event.type) for event in later],
+                         [(3, events.HOTEL_MODIFIED),
+                          (4, events.HOTEL_DELETED)])
+        self.assertEqual(later[0].record["name"], "Lakeside Resort")
+        self.assertEqual(log.last_sequence(), 4)
+
+        # An interrupted append is skipped, and the next one starts on a
+        # new line.
+        with open(self.log_path, "ab") as f:
+            f.write(b'{"sequence": 5, "ty')
+        with mock.patch("builtins.print"):
+            self.assertEqual(log.read(offset), ([], offset))
+            Hotel.modify_hotel(2, {"total_rooms": 3})
+            later, _ = log.read(offset)
+        self.assertEqual([event.sequence for event in later], [5])
+
+        followed = log.follow(poll_interval=0.01)
+        self.assertEqual(next(followed)[0].sequence, 1)
+
+    def test_events_are_committed_with_the_records(self):
+        """
+        Test that the events of a transaction interrupted after it was
+        logged reach the event log once, when it is replayed.
+        """
+        Hotel.create_hotel(Hotel(1, "Harbor Inn", "Seaside", 1))
+        append = EventLog.append
+        for total_rooms, appended in ((2, False), (3, True)):
+            def crash(log, build, transaction=None, after=None,
+                      appended=appended):
+                if appended:
+                    append(log, build, transaction, after)
+                raise SystemExit("crash")
+
+            with mock.patch.object(EventLog, "append", crash):
+                with self.assertRaises(SystemExit):
+                    Hotel.modify_hotel(1, {"total_rooms": total_rooms})
+            # The process that owned the commit log is gone.
+            log = transaction_module._logs.pop(self.tmp_dir)
+            os.close(log._fd)
+            self.assertEqual(transaction_module.recover(self.tmp_dir), 1)
+        logged, _ = EventLog(self.log_path).read()
+        self.assertEqual(
+            [(event.sequence, event.type, event.record["total_rooms"])
+             for event in logged],
+            [(1, events.HOTEL_CREATED, 1), (2, events.HOTEL_MODIFIED, 2),
+             (3, events.HOTEL_MODIFIED, 3)])
+
+    def test_full_queue_blocks_emitters(self):
+        """
+        Test that emitting blocks while the queue is full, until the
+        subscribers catch up.
+        """
+        events.disable()
+        self.feed = events.enable(queue_size=1)
+        gate = threading.Event()
+        delivered = []
+
+        def slow(event):
+            gate.wait(5)
+            delivered.append(event.sequence)
+
+        events.subscribe(slow)
+        Hotel.create_hotel(Hotel(1, "Harbor Inn", "Seaside", 1))
+        writer = threading.Thread(target=lambda: [
+            Hotel.modify_hotel(1, {"total_rooms": rooms})
+            for rooms in range(2, 6)
+        ])
+        writer.start()
+        time.sleep(0.2)
+        self.assertTrue(writer.is_alive())
+        gate.set()
+        writer.join(5)
+        self.assertFalse(writer.is_alive())
+        self.assertTrue(self.feed.flush(5))
+        self.assertEqual(delivered, [1, 2, 3, 4, 5])
+
+    def test_subscriber_may_write(self):
+        """
+        Test that a subscriber changing the stores does not block on its
+        own events.
+        """
+        events.disable()
+        self.feed = events.enable(queue_size=1)
+        received = []
+
+        def react(event):
+            received.append(event.type)
+            if event.type == events.HOTEL_CREATED:
+                Hotel.modify_hotel(event.record_id, {"name": "Seen"})
+
+        events.subscribe(react)
+        Hotel.create_hotels([Hotel(1, "Harbor Inn", "Seaside", 1),
+                             Hotel(2, "Lakeside Resort", "Lakeview", 1)])
+        self.assertTrue(self.feed.flush(5))
+        self.assertEqual(received.count(events.HOTEL_MODIFIED), 2)
+        self.assertEqual(Hotel.display_hotel(2)["name"], "Seen")
+
+    def test_disabled_feed_emits_nothing(self):
+        """
+        Test that nothing is logged while the feed is disabled.
+        """
+        events.disable()
+        Hotel.create_hotel(Hotel(1, "Harbor Inn", "Seaside", 1))
+        self.assertFalse(os.path.exists(self.log_path))
+        self.assertIsNone(events.get_feed())
+
+
+if __name__ == "__main__":
+    unittest.main()
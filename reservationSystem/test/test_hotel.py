@@ -7,9 +7,11 @@ Tests include creating, displaying, modifying, deleting hotels,
 and reserving/canceling room reservations.
 """
 
+import datetime
 import os
 import json
 import unittest
+from unittest import mock
 
 from app.hotel import Hotel
 from app.persistence import HOTEL_FILE
@@ -60,6 +62,18 @@ class TestHotel(unittest.TestCase):
         self.assertEqual(result["name"], "Mountain Retreat")
         self.assertEqual(result["total_rooms"], 8)
 
+    def test_modify_hotel_id_is_rejected(self):
+        """
+        Test that a hotel's ID cannot be changed.
+        """
+        Hotel.create_hotel(Hotel(4, "Harbour Inn", "Port", 5))
+        Hotel.create_hotel(Hotel(5, "Dock Inn", "Port", 5))
+        Hotel.modify_hotel(4, {"hotel_id": 5, "name": "Renamed"})
+        self.assertEqual(Hotel.display_hotel(4)["name"], "Harbour Inn")
+        self.assertEqual(Hotel.display_hotel(5)["name"], "Dock Inn")
+        self.assertEqual(Hotel.modify_hotels({4: {"hotel_id": None}}), [])
+        self.assertEqual(Hotel.display_hotel(4)["hotel_id"], 4)
+
     def test_delete_hotel(self):
         """
         Test deletion of a hotel.
@@ -100,5 +114,64 @@ class TestHotel(unittest.TestCase):
         success2 = Hotel.reserve_room(5, 202)
         self.assertFalse(success2)
 
+    def test_bulk_hotel_operations(self):
+        """
+        Test creating, modifying and deleting hotels in batches.
+        """
+        Hotel.create_hotels(
+            Hotel(i, f"Hotel {i}", "Bay Area", 3) for i in range(20, 24)
+        )
+        updated = Hotel.modify_hotels({20: {"total_rooms": 6}, 99: {}})
+        self.assertEqual(updated, [20])
+        self.assertEqual(Hotel.display_hotel(20)["total_rooms"], 6)
+        self.assertEqual(Hotel.delete_hotels([21, 99]), [21])
+        self.assertIsNone(Hotel.display_hotel(21))
+
+    def test_reserve_rooms_in_batch(self):
+        """
+        Test that a batch reservation stops accepting a hotel once full.
+        """
+        Hotel.create_hotel(Hotel(6, "Twin Rooms", "Harbor", 2))
+        results = Hotel.reserve_rooms([(6, 1), (6, 2), (6, 3), (7, 4)])
+        self.assertEqual(results, [True, True, False, False])
+        self.assertEqual(Hotel.display_hotel(6)["reserved_rooms"], [1, 2])
+
+    def test_search_by_location_and_free_rooms(self):
+        """
+        Test that the search follows reservations and modifications.
+        """
+        Hotel.create_hotels([
+            Hotel(30, "Harbor Inn", "Port", 2),
+            Hotel(31, "Dock Hotel", "Port", 5),
+            Hotel(32, "Hill Lodge", "Hills", 3),
+        ])
+
+        def ids(hotels):
+            return [hotel["hotel_id"] for hotel in hotels]
+
+        self.assertEqual(ids(Hotel.search("Port", 2)), [31, 30])
+        Hotel.reserve_room(30, 1)
+        self.assertEqual(ids(Hotel.search("Port", 2)), [31])
+        Hotel.cancel_reservation(30, 1)
+        Hotel.modify_hotel(32, {"location": "Port"})
+        self.assertEqual(ids(Hotel.search("Port", 3)), [31, 32])
+        self.assertEqual(Hotel.search("Hills"), [])
+        Hotel.delete_hotel(31)
+        self.assertEqual(ids(Hotel.search(min_free_rooms=2)), [32, 30])
+
+    def test_search_drops_ended_stays(self):
+        """
+        Test that a stay stops taking a room from the search once it has
+        ended.
+        """
+        Hotel.create_hotel(Hotel(33, "Bay Inn", "Bay", 1))
+        for day, found in (("2026-03-01", 0), ("2026-03-03", 1)):
+            ordinal = datetime.date.fromisoformat(day).toordinal()
+            with mock.patch("app.occupancy.today", return_value=ordinal), \
+                    mock.patch("app.indexes.today", return_value=ordinal):
+                if not found:
+                    Hotel.reserve_room(33, 1, "2026-03-01", "2026-03-03")
+                self.assertEqual(len(Hotel.search("Bay")), found)
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+test_ids.py
+
+Unit tests for the IdAllocator class and the creation of records with
+allocated IDs.
+Tests include block reservation, persistence of the high-water mark and
+uniqueness checks for IDs chosen by callers.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from app import ids as ids_module
+from app.ids import IdAllocator
+from app.repository import Repository
+
+
+class TestIdAllocator(unittest.TestCase):
+    """
+    Test cases for the IdAllocator class.
+    """
+
+    def setUp(self):
+        """
+        Create a temporary directory for the store.
+        """
+        self.tmp_dir = tempfile.mkdtemp()
+        self.file_path = os.path.join(self.tmp_dir, "hotels.json")
+
+    def tearDown(self):
+        """
+        Remove the temporary directory.
+        """
+        shutil.rmtree(self.tmp_dir)
+
+    def test_reserves_blocks(self):
+        """
+        Test that IDs come from persisted blocks starting above the
+        existing records.
+        """
+        allocator = IdAllocator(self.file_path, block_size=10)
+        ids = allocator.allocate(3, lambda record_id: False, lambda: 5)
+        self.assertEqual(ids, [5, 6, 7])
+        with open(allocator.path, "r", encoding="utf-8") as f:
+            self.assertEqual(f.read(), "15")
+        # Another allocator, as in another process, starts after the block.
+        other = IdAllocator(self.file_path, block_size=10)
+        self.assertEqual(
+            other.allocate(2, lambda record_id: False, lambda: 1), [15, 16])
+        self.assertEqual(
+            allocator.allocate(8, lambda record_id: False, lambda: 1),
+            [8, 9, 10, 11, 12, 13, 14, 25])
+
+    def test_skips_taken_ids(self):
+        """
+        Test that IDs already used by records are not handed out.
+        """
+        allocator = IdAllocator(self.file_path, block_size=10)
+        ids = allocator.allocate(
+            3, lambda record_id: record_id in (2, 3), lambda: 1)
+        self.assertEqual(ids, [1, 4, 5])
+
+
+class TestCreateMany(unittest.TestCase):
+    """
+    Test cases for creating records through a Repository.
+    """
+
+    def setUp(self):
+        """
+        Create a temporary directory for the backing file.
+        """
+        self.tmp_dir = tempfile.mkdtemp()
+        self.file_path = os.path.join(self.tmp_dir, "hotels.json")
+        self.repository = Repository(self.file_path, "hotel_id")
+
+    def tearDown(self):
+        """
+        Remove the temporary directory.
+        """
+        shutil.rmtree(self.tmp_dir)
+
+    def test_insert_rejects_taken_ids(self):
+        """
+        Test that records with taken or repeated IDs are not inserted.
+        """
+        self.repository.put({"hotel_id": 1, "name": "Old"})
+        inserted = self.repository.insert_many([
+            {"hotel_id": 1, "name": "New"},
+            {"hotel_id": 2, "name": "First"},
+            {"hotel_id": 2, "name": "Second"},
+        ])
+        self.assertEqual(inserted, [False, True, False])
+        self.assertEqual(self.repository.get(1)["name"], "Old")
+        self.assertEqual(self.repository.get(2)["name"], "First")
+
+    def test_create_allocates_missing_ids(self):
+        """
+        Test that records without an ID are given unused ones.
+        """
+        self.repository.put_many(
+            {"hotel_id": hotel_id} for hotel_id in (1, 2, 7))
+        records = [{"hotel_id": None}, {"hotel_id": 3}, {"hotel_id": 2},
+                   {"hotel_id": None}]
+        ids = self.repository.create_many(records)
+        self.assertEqual(ids, [8, 3, None, 9])
+        self.assertEqual(records[0]["hotel_id"], 8)
+        self.assertEqual(len(self.repository), 6)
+        self.assertEqual(self.repository.allocate_ids(1), [10])
+        # After a restart, allocation resumes after the reserved block.
+        ids_module._allocators.clear()
+        self.assertEqual(self.repository.allocate_ids(1), [108])
+
+
+if __name__ == "__main__":
+    unittest.main()
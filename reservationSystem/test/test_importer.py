@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+test_importer.py
+
+Unit tests for the bulk import of reservation feeds.
+Tests include CSV and NDJSON feeds, with the capacity checks run in this
+process and in a process pool, IDs given to rows without one, hotels
+changed during an import, failed imports, rejected rows and the report.
+"""
+
+import csv
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from app import customer as customer_module
+from app import hotel as hotel_module
+from app import importer
+from app import reservation as reservation_module
+from app.customer import Customer
+from app.hotel import Hotel
+from app.importer import import_feed, main
+from app.repository import reset_repositories
+from app.reservation import Reservation
+
+ROWS = [
+    {"reservation_id": "10", "hotel_id": "1", "customer_id": "1"},
+    {"reservation_id": "", "hotel_id": "1", "customer_id": "2"},
+    {"reservation_id": "", "hotel_id": "1", "customer_id": "1"},
+    {"reservation_id": "11", "hotel_id": "9", "customer_id": "1"},
+    {"reservation_id": "12", "hotel_id": "2", "customer_id": "9"},
+    {"reservation_id": "10", "hotel_id": "2", "customer_id": "1"},
+    {"reservation_id": "13", "hotel_id": "2", "customer_id": "1",
+     "check_in": "2026-05-03", "check_out": "2026-05-01"},
+    {"reservation_id": "14", "hotel_id": "2", "customer_id": "2",
+     "check_in": "2026-05-01", "check_out": "2026-05-03"},
+    {"reservation_id": "x", "hotel_id": "2", "customer_id": "2"},
+]
+
+
+class TestImporter(unittest.TestCase):
+    """
+    Test cases for import_feed.
+    """
+
+    def setUp(self):
+        """
+        Point the stores at a temporary directory and create the hotels
+        and customers.
+        """
+        self.tmp_dir = tempfile.mkdtemp()
+        self.patches = [
+            mock.patch.object(customer_module, "CUSTOMER_FILE",
+                              os.path.join(self.tmp_dir, "customers.json")),
+            mock.patch.object(hotel_module, "HOTEL_FILE",
+                              os.path.join(self.tmp_dir, "hotels.json")),
+            mock.patch.object(reservation_module, "RESERVATION_FILE",
+                              os.path.join(self.tmp_dir,
+                                           "reservations.json")),
+        ]
+        for patch in self.patches:
+            patch.start()
+        reset_repositories()
+        Hotel.create_hotels([Hotel(1, "Harbor Inn", "Seaside", 2),
+                             Hotel(2, "Lakeside Resort", "Lakeview", 1)])
+        Customer.create_customers([
+            Customer(1, "Dana White", "dana@example.com", "555-1111"),
+            Customer(2, "Sam Green", "sam@example.com", "555-2222"),
+        ])
+
+    def tearDown(self):
+        """
+        Restore the stores and remove the directory.
+        """
+        for patch in self.patches:
+            patch.stop()
+        reset_repositories()
+        shutil.rmtree(self.tmp_dir)
+
+    def write_csv(self, rows):
+        """
+        Write a CSV feed and return its path.
+        """
+        file_path = os.path.join(self.tmp_dir, "feed.csv")
+        with open(file_path, "w", encoding="utf-8", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=(
+                "reservation_id", "hotel_id", "customer_id", "check_in",
+                "check_out"))
+            writer.writeheader()
+            writer.writerows(rows)
+        return file_path
+
+    def check_import(self, result):
+        """
+        Check the outcome of importing ROWS.
+        """
+        self.assertEqual(result["rows"], len(ROWS))
+        self.assertEqual(result["imported"], 3)
+        self.assertEqual(
+            [(line, reason) for line, reason, _ in result["rejected"]],
+            [
+                (4, "Failed to create reservation due to room "
+                    "unavailability."),
+                (5, "Hotel not found."),
+                (6, "Customer not found."),
+                (7, "Reservation ID already exists."),
+                (8, "Invalid dates: check_out must be after check_in"),
+                (10, "Invalid ID: invalid literal for int() with base 10: "
+                     "'x'"),
+            ])
+        self.assertEqual(len(Hotel.display_hotel(1)["reserved_rooms"]), 2)
+        self.assertEqual(Hotel.display_hotel(2)["reserved_rooms"], [14])
+        self.assertEqual(Reservation.display_reservation(14)["check_in"],
+                         "2026-05-01")
+        customer_reservations = Reservation.for_customer(2)
+        self.assertEqual(len(customer_reservations), 2)
+        self.assertIsNotNone(customer_reservations[0]["reservation_id"])
+
+    def test_import_in_process(self):
+        """
+        Test importing a CSV feed without worker processes.
+        """
+        self.check_import(import_feed(self.write_csv(ROWS), workers=1))
+
+    def test_import_in_pool(self):
+        """
+        Test importing an NDJSON feed with a process pool.
+        """
+        file_path = os.path.join(self.tmp_dir, "feed.ndjson")
+        with open(file_path, "w", encoding="utf-8") as f:
+            f.write("\n")
+            for row in ROWS:
+                f.write(json.dumps(row) + "\n")
+            f.write("not json\n")
+        with mock.patch.object(importer, "PARALLEL_ROWS", 0):
+            result = import_feed(file_path, workers=2)
+        self.assertEqual(result["rejected"][-1][:2], (11, "Invalid row."))
+        result["rows"] -= 1
+        del result["rejected"][-1]
+        self.check_import(result)
+
+    def test_changed_hotel_is_checked_again(self):
+        """
+        Test that a hotel booked by another writer during the import has
+        its rows checked again against its current state.
+        """
+        run = importer._run
+
+        def book(work, workers, parallel):
+            outputs = run(work, workers, parallel)
+            Reservation.create_reservation(Reservation(50, 2, 1))
+            return outputs
+
+        with mock.patch.object(importer, "_run", book):
+            result = import_feed(self.write_csv(ROWS[7:8]))
+        self.assertEqual(result["imported"], 0)
+        self.assertEqual(result["rejected"][0][1], reservation_module.NO_ROOM)
+        self.assertEqual(Hotel.display_hotel(2)["reserved_rooms"], [50])
+
+    def test_failed_import_applies_nothing(self):
+        """
+        Test that an import failing in its transaction leaves the stores
+        unchanged.
+        """
+        to_dict = Reservation.to_dict
+        calls = []
+
+        def fail(reservation):
+            calls.append(reservation)
+            if len(calls) > 1:
+                raise OSError("disk full")
+            return to_dict(reservation)
+
+        with mock.patch.object(Reservation, "to_dict", fail):
+            with self.assertRaises(OSError):
+                import_feed(self.write_csv(ROWS))
+        self.assertEqual(Hotel.display_hotel(1)["reserved_rooms"], [])
+        self.assertEqual(Hotel.display_hotel(2)["reserved_rooms"], [])
+        self.assertEqual(Reservation.for_customer(1), [])
+        self.assertEqual(Reservation.for_customer(2), [])
+
+    def test_given_ids_are_not_allocated(self):
+        """
+        Test that rows without an ID are not given the ID of a later row.
+        """
+        rows = [
+            {"reservation_id": "", "hotel_id": "1", "customer_id": "1"}
+        ] + [
+            {"reservation_id": str(reservation_id), "hotel_id": "1",
+             "customer_id": "2"}
+            for reservation_id in range(1, 201)
+        ]
+        Hotel.modify_hotel(1, {"total_rooms": 500})
+        result = import_feed(self.write_csv(rows))
+        self.assertEqual(result["imported"], 201)
+        self.assertEqual(result["rejected"], [])
+        allocated = Reservation.for_customer(1)[0]["reservation_id"]
+        self.assertGreater(allocated, 200)
+
+    def test_report(self):
+        """
+        Test that the command line writes the rejected rows to a report.
+        """
+        report = os.path.join(self.tmp_dir, "rejected.csv")
+        with mock.patch("builtins.print"):
+            status = main([self.write_csv(ROWS), "--report", report])
+        self.assertEqual(status, 1)
+        with open(report, "r", encoding="utf-8", newline="") as f:
+            rows = list(csv.DictReader(f))
+        self.assertEqual(len(rows), 6)
+        self.assertEqual(rows[1]["reason"], "Hotel not found.")
+        self.assertEqual(rows[1]["hotel_id"], "9")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+test_metrics.py
+
+Unit tests for the metrics module.
+Tests include call counting, byte counting, the disabled mode and the
+Prometheus output.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from app import metrics
+from app.customer import Customer
+from app.persistence import load_data, save_data, clear_cache
+from app.repository import reset_repositories
+
+
+class TestMetrics(unittest.TestCase):
+    """
+    Test cases for the hot-path instrumentation.
+    """
+
+    def setUp(self):
+        """
+        Start from empty, enabled metrics and a temporary directory.
+        """
+        self.tmp_dir = tempfile.mkdtemp()
+        self.file_path = os.path.join(self.tmp_dir, "customers.json")
+        clear_cache()
+        metrics.reset()
+        metrics.enable()
+
+    def tearDown(self):
+        """
+        Disable the metrics and remove the directory.
+        """
+        metrics.disable()
+        metrics.reset()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_persistence_calls_and_bytes(self):
+        """
+        Test that loads and saves are counted with their disk traffic.
+        """
+        save_data(self.file_path, [{"customer_id": 1, "name": "Alice"}])
+        clear_cache()
+        load_data(self.file_path)
+        load_data(self.file_path)
+        size = os.path.getsize(self.file_path)
+        snapshot = metrics.snapshot()
+        self.assertEqual(snapshot["save_data"]["calls"], 1)
+        self.assertEqual(snapshot["save_data"]["bytes_written"], size)
+        self.assertEqual(snapshot["load_data"]["calls"], 2)
+        # The second load is served from the parse cache.
+        self.assertEqual(snapshot["load_data"]["bytes_read"], size)
+        self.assertEqual(snapshot["load_data"]["buckets"][-1], ("+Inf", 2))
+
+    def test_model_operations_are_timed(self):
+        """
+        Test that public model operations are counted.
+        """
+        reset_repositories()
+        Customer.display_customer(-1)
+        Customer.display_customer(-2)
+        snapshot = metrics.snapshot()
+        self.assertEqual(snapshot["Customer.display_customer"]["calls"], 2)
+        self.assertGreaterEqual(
+            snapshot["Customer.display_customer"]["seconds"], 0)
+
+    def test_disabled_mode_records_nothing(self):
+        """
+        Test that nothing is collected while metrics are disabled.
+        """
+        metrics.disable()
+        save_data(self.file_path, [])
+        load_data(self.file_path)
+        self.assertEqual(metrics.snapshot(), {})
+
+    def test_prometheus_output(self):
+        """
+        Test that the Prometheus text output holds a histogram and the
+        byte counters of each operation.
+        """
+        metrics.observe("load_data", 0.003)
+        metrics.record_bytes("load_data", read=10)
+        text = metrics.prometheus()
+        self.assertIn("# TYPE reservation_operation_seconds histogram", text)
+        self.assertIn('reservation_operation_seconds_bucket'
+                      '{operation="load_data",le="0.0025"} 0', text)
+        self.assertIn('reservation_operation_seconds_bucket'
+                      '{operation="load_data",le="0.005"} 1', text)
+        self.assertIn('reservation_operation_seconds_count'
+                      '{operation="load_data"} 1', text)
+        self.assertIn('reservation_bytes_read_total'
+                      '{operation="load_data"} 10', text)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+test_occupancy.py
+
+Unit tests for the Occupancy class.
+Tests include reserving, canceling and serializing reservation IDs.
+"""
+
+import unittest
+
+from app.occupancy import Occupancy
+
+
+class TestOccupancy(unittest.TestCase):
+    """
+    Test cases for the Occupancy class.
+    """
+
+    def test_reserve_until_full(self):
+        """
+        Test that rooms can be reserved until the hotel is full.
+        """
+        occupancy = Occupancy()
+        self.assertTrue(occupancy.reserve(1, 2))
+        self.assertTrue(occupancy.reserve(2, 2))
+        self.assertFalse(occupancy.reserve(3, 2))
+        self.assertEqual(occupancy.free_rooms(2), 0)
+
+    def test_duplicate_reservation_is_rejected(self):
+        """
+        Test that a reservation cannot hold two rooms.
+        """
+        occupancy = Occupancy([7])
+        self.assertFalse(occupancy.reserve(7, 5))
+        self.assertEqual(len(occupancy), 1)
+
+    def test_cancel(self):
+        """
+        Test that canceling frees the room once.
+        """
+        occupancy = Occupancy([1, 2])
+        self.assertTrue(occupancy.cancel(1))
+        self.assertFalse(occupancy.cancel(1))
+        self.assertNotIn(1, occupancy)
+        self.assertTrue(occupancy.has_room(2))
+
+    def test_round_trip_keeps_order(self):
+        """
+        Test that serialization returns the IDs in reservation order.
+        """
+        occupancy = Occupancy.from_list([5, 3, 9])
+        occupancy.cancel(3)
+        occupancy.reserve(1, 10)
+        self.assertEqual(occupancy.to_list(), [5, 9, 1])
+
+
+if __name__ == "__main__":
+    unittest.main()
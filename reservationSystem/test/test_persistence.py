@@ -0,0 +1,447 @@
+#!/usr/bin/env python3
+"""
+test_persistence.py
+
+Unit tests for the persistence module.
+Tests include the journal storage mode, its replay and its compaction,
+the parse cache of load_data, the streaming ndjson format and the codecs.
+"""
+
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from app.persistence import (
+    load_data,
+    save_data,
+    journal_path,
+    set_storage_mode,
+    JSON_MODE,
+    JOURNAL_MODE,
+    NDJSON_MODE,
+    iter_records,
+    find_record,
+    rewrite_records,
+    convert_file,
+    is_ndjson,
+    detect_format,
+    set_codec,
+    CODECS,
+    JSON_CODEC,
+    COMPACT_JSON_CODEC,
+    GZIP_JSON_CODEC,
+    PICKLE_CODEC,
+    cache_stats,
+    clear_cache,
+    configure_cache,
+)
+from app.repository import Repository
+
+
+class TestJournal(unittest.TestCase):
+    """
+    Test cases for the journal storage mode.
+    """
+
+    def setUp(self):
+        """
+        Create a temporary directory and switch to journal mode.
+        """
+        self.tmp_dir = tempfile.mkdtemp()
+        self.file_path = os.path.join(self.tmp_dir, "customers.json")
+        set_storage_mode(JOURNAL_MODE, snapshot_interval=3)
+
+    def tearDown(self):
+        """
+        Restore the default storage mode and remove the directory.
+        """
+        set_storage_mode(JSON_MODE)
+        shutil.rmtree(self.tmp_dir)
+
+    def test_mutations_are_appended(self):
+        """
+        Test that a mutation appends to the journal instead of rewriting
+        the data file.
+        """
+        save_data(self.file_path, [{"customer_id": 1, "name": "Alice"}])
+        repo = Repository(self.file_path, "customer_id")
+        repo.update(1, {"name": "Alice Smith"})
+        repo.put({"customer_id": 2, "name": "Bob"})
+        with open(self.file_path, "r", encoding="utf-8") as f:
+            self.assertEqual(json.load(f), [{"customer_id": 1,
+                                             "name": "Alice"}])
+        with open(journal_path(self.file_path), "r", encoding="utf-8") as f:
+            self.assertEqual(len(f.readlines()), 2)
+
+    def test_load_replays_journal(self):
+        """
+        Test that loading applies puts and deletes from the journal.
+        """
+        repo = Repository(self.file_path, "customer_id")
+        repo.put({"customer_id": 1, "name": "Alice"})
+        repo.put({"customer_id": 2, "name": "Bob"})
+        repo.delete(1)
+        self.assertEqual(load_data(self.file_path),
+                         [{"customer_id": 2, "name": "Bob"}])
+
+    def test_snapshot_compacts_journal(self):
+        """
+        Test that a snapshot is written once the journal is full.
+        """
+        repo = Repository(self.file_path, "customer_id")
+        for customer_id in range(3):
+            repo.put({"customer_id": customer_id, "name": "Guest"})
+        self.assertFalse(os.path.exists(journal_path(self.file_path)))
+        with open(self.file_path, "r", encoding="utf-8") as f:
+            self.assertEqual(len(json.load(f)), 3)
+
+    def test_truncated_record_is_ignored(self):
+        """
+        Test that a partially written journal record is dropped and does
+        not corrupt later appends.
+        """
+        repo = Repository(self.file_path, "customer_id")
+        repo.put({"customer_id": 1, "name": "Alice"})
+        with open(journal_path(self.file_path), "a", encoding="utf-8") as f:
+            f.write('{"op": "put", "key": "customer_id", "id": 2, "rec')
+        repo.put({"customer_id": 3, "name": "Carol"})
+        self.assertEqual(load_data(self.file_path),
+                         [{"customer_id": 1, "name": "Alice"},
+                          {"customer_id": 3, "name": "Carol"}])
+
+
+class TestParseCache(unittest.TestCase):
+    """
+    Test cases for the parse cache of load_data.
+    """
+
+    def setUp(self):
+        """
+        Create a temporary directory and start from an empty cache.
+        """
+        self.tmp_dir = tempfile.mkdtemp()
+        self.file_path = os.path.join(self.tmp_dir, "customers.json")
+        with open(self.file_path, "w", encoding="utf-8") as f:
+            json.dump([{"customer_id": 1, "name": "Alice"}], f)
+        clear_cache()
+
+    def tearDown(self):
+        """
+        Restore the default cache limit and remove the directory.
+        """
+        configure_cache()
+        clear_cache()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_unchanged_file_is_parsed_once(self):
+        """
+        Test that loading an unchanged file is served from the cache.
+        """
+        load_data(self.file_path)
+        self.assertEqual(load_data(self.file_path),
+                         [{"customer_id": 1, "name": "Alice"}])
+        stats = cache_stats()
+        self.assertEqual((stats["misses"], stats["hits"]), (1, 1))
+
+    def test_loaded_records_are_copies(self):
+        """
+        Test that changing loaded records does not change the cache.
+        """
+        load_data(self.file_path)[0]["name"] = "Mallory"
+        self.assertEqual(load_data(self.file_path)[0]["name"], "Alice")
+
+    def test_changed_file_is_parsed_again(self):
+        """
+        Test that a file replaced by another writer is re-read.
+        """
+        load_data(self.file_path)
+        other_path = os.path.join(self.tmp_dir, "other.json")
+        with open(other_path, "w", encoding="utf-8") as f:
+            json.dump([{"customer_id": 2, "name": "Bob"}], f)
+        os.replace(other_path, self.file_path)
+        self.assertEqual(load_data(self.file_path),
+                         [{"customer_id": 2, "name": "Bob"}])
+        self.assertEqual(cache_stats()["misses"], 2)
+
+    def test_saved_data_is_cached(self):
+        """
+        Test that data saved by this process is loaded without parsing.
+        """
+        save_data(self.file_path, [{"customer_id": 3, "name": "Carol"}])
+        self.assertEqual(load_data(self.file_path),
+                         [{"customer_id": 3, "name": "Carol"}])
+        self.assertEqual(cache_stats()["hits"], 1)
+
+    def test_least_recently_used_file_is_evicted(self):
+        """
+        Test that the cache stays under its limit by evicting the least
+        recently used file.
+        """
+        other_path = os.path.join(self.tmp_dir, "other.json")
+        with open(other_path, "w", encoding="utf-8") as f:
+            json.dump([{"customer_id": 2, "name": "Bob"}], f)
+        configure_cache(os.path.getsize(self.file_path)
+                        + os.path.getsize(other_path) - 1)
+        load_data(self.file_path)
+        load_data(other_path)
+        stats = cache_stats()
+        self.assertEqual((stats["entries"], stats["evictions"]), (1, 1))
+        self.assertLessEqual(stats["bytes"], stats["max_bytes"])
+        load_data(other_path)
+        self.assertEqual(cache_stats()["hits"], 1)
+
+
+class TestNdjson(unittest.TestCase):
+    """
+    Test cases for the ndjson storage mode and streaming reads.
+    """
+
+    def setUp(self):
+        """
+        Create a temporary directory with an indented JSON array file.
+        """
+        self.tmp_dir = tempfile.mkdtemp()
+        self.file_path = os.path.join(self.tmp_dir, "customers.json")
+        self.records = [
+            {"customer_id": customer_id, "name": f"Guest {customer_id}"}
+            for customer_id in range(1, 6)
+        ]
+        save_data(self.file_path, self.records)
+
+    def tearDown(self):
+        """
+        Restore the default storage mode and remove the directory.
+        """
+        set_storage_mode(JSON_MODE)
+        shutil.rmtree(self.tmp_dir)
+
+    def test_convert_round_trip(self):
+        """
+        Test that a file converts to ndjson and back unchanged.
+        """
+        with open(self.file_path, "r", encoding="utf-8") as f:
+            original = f.read()
+        convert_file(self.file_path)
+        self.assertTrue(is_ndjson(self.file_path))
+        with open(self.file_path, "r", encoding="utf-8") as f:
+            self.assertEqual(len(f.readlines()), 5)
+        self.assertEqual(load_data(self.file_path), self.records)
+        convert_file(self.file_path, ndjson=False)
+        with open(self.file_path, "r", encoding="utf-8") as f:
+            self.assertEqual(f.read(), original)
+
+    def test_iter_records_stops_early(self):
+        """
+        Test that a scan reads records lazily and can stop at a match.
+        """
+        convert_file(self.file_path)
+        records = iter_records(self.file_path)
+        self.assertEqual(next(records), self.records[0])
+        records.close()
+        self.assertEqual(find_record(self.file_path, "customer_id", 4),
+                         self.records[3])
+        self.assertIsNone(find_record(self.file_path, "customer_id", 9))
+
+    def test_iter_records_applies_journal(self):
+        """
+        Test that streamed records reflect the journal.
+        """
+        set_storage_mode(JOURNAL_MODE)
+        repo = Repository(self.file_path, "customer_id")
+        repo.delete(2)
+        repo.update(3, {"name": "Carol"})
+        repo.put({"customer_id": 6, "name": "Dave"})
+        self.assertEqual(list(iter_records(self.file_path)),
+                         load_data(self.file_path))
+
+    def test_rewrite_streams_mutations(self):
+        """
+        Test that puts and deletes are applied through a temporary file.
+        """
+        set_storage_mode(NDJSON_MODE)
+        rewrite_records(self.file_path, "customer_id", [
+            ("delete", 1, None),
+            ("put", 2, {"customer_id": 2, "name": "Bob"}),
+            ("put", 7, {"customer_id": 7, "name": "Eve"}),
+        ])
+        self.assertTrue(is_ndjson(self.file_path))
+        self.assertEqual(
+            [record["name"] for record in iter_records(self.file_path)],
+            ["Bob", "Guest 3", "Guest 4", "Guest 5", "Eve"])
+        self.assertEqual(os.listdir(self.tmp_dir), ["customers.json"])
+
+    def test_repository_in_ndjson_mode(self):
+        """
+        Test that repository writes in ndjson mode keep one record per
+        line and are seen by a new reader.
+        """
+        set_storage_mode(NDJSON_MODE)
+        repo = Repository(self.file_path, "customer_id")
+        repo.delete(5)
+        repo.update(1, {"name": "Alice"})
+        with open(self.file_path, "r", encoding="utf-8") as f:
+            self.assertEqual(len(f.readlines()), 4)
+        other = Repository(self.file_path, "customer_id")
+        self.assertEqual(other.get(1)["name"], "Alice")
+        self.assertIsNone(other.get(5))
+
+
+class TestCodecs(unittest.TestCase):
+    """
+    Test cases for the codecs writing the data files.
+    """
+
+    def setUp(self):
+        """
+        Create a temporary directory and the records to save.
+        """
+        self.tmp_dir = tempfile.mkdtemp()
+        self.file_path = os.path.join(self.tmp_dir, "customers.json")
+        self.records = [
+            {"customer_id": customer_id, "name": f"Guest {customer_id}"}
+            for customer_id in range(1, 6)
+        ]
+        clear_cache()
+
+    def tearDown(self):
+        """
+        Restore the default codec and remove the directory.
+        """
+        set_codec(JSON_CODEC)
+        set_storage_mode(JSON_MODE)
+        clear_cache()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_round_trip(self):
+        """
+        Test that every codec saves records that load back unchanged, and
+        that the format is detected whatever the current codec, except
+        for pickle.
+        """
+        for name in CODECS:
+            with self.subTest(codec=name):
+                set_codec(name)
+                save_data(self.file_path, self.records)
+                if name != PICKLE_CODEC:
+                    set_codec(JSON_CODEC)
+                clear_cache()
+                self.assertEqual(load_data(self.file_path), self.records)
+                self.assertEqual(
+                    detect_format(self.file_path),
+                    JSON_CODEC if name == COMPACT_JSON_CODEC else name)
+                self.assertEqual(list(iter_records(self.file_path)),
+                                 self.records)
+
+    def test_compact_json(self):
+        """
+        Test that compact JSON has no whitespace and is smaller than the
+        indented default.
+        """
+        save_data(self.file_path, self.records)
+        indented = os.path.getsize(self.file_path)
+        set_codec(COMPACT_JSON_CODEC)
+        save_data(self.file_path, self.records)
+        with open(self.file_path, "r", encoding="utf-8") as f:
+            text = f.read()
+        self.assertEqual(text, json.dumps(self.records,
+                                          separators=(",", ":")))
+        self.assertLess(len(text), indented)
+
+    def test_rewrite_keeps_codec(self):
+        """
+        Test that streamed rewrites write the file with the codec, and
+        that a pickle store reads back its journal.
+        """
+        for name in (COMPACT_JSON_CODEC, GZIP_JSON_CODEC, PICKLE_CODEC):
+            with self.subTest(codec=name):
+                set_codec(name)
+                save_data(self.file_path, self.records)
+                rewrite_records(self.file_path, "customer_id", [
+                    ("delete", 1, None),
+                    ("put", 7, {"customer_id": 7, "name": "Eve"}),
+                ])
+                clear_cache()
+                self.assertEqual(
+                    [r["customer_id"] for r in load_data(self.file_path)],
+                    [2, 3, 4, 5, 7])
+        set_storage_mode(JOURNAL_MODE)
+        repo = Repository(self.file_path, "customer_id")
+        repo.update(2, {"name": "Bob"})
+        self.assertEqual(find_record(self.file_path, "customer_id", 2),
+                         {"customer_id": 2, "name": "Bob"})
+
+    def test_convert_between_codecs(self):
+        """
+        Test that a file converts to gzip and back to indented JSON
+        unchanged.
+        """
+        save_data(self.file_path, self.records)
+        with open(self.file_path, "rb") as f:
+            original = f.read()
+        convert_file(self.file_path, ndjson=False, codec=GZIP_JSON_CODEC)
+        with open(self.file_path, "rb") as f:
+            self.assertTrue(f.read().startswith(b"\x1f\x8b"))
+        convert_file(self.file_path, ndjson=False, codec=JSON_CODEC)
+        with open(self.file_path, "rb") as f:
+            self.assertEqual(f.read(), original)
+
+    def test_pickle_needs_pickle_codec(self):
+        """
+        Test that a pickle file is not loaded unless the pickle codec is
+        selected.
+        """
+        set_codec(PICKLE_CODEC)
+        save_data(self.file_path, self.records)
+        set_codec(JSON_CODEC)
+        clear_cache()
+        self.assertEqual(detect_format(self.file_path), PICKLE_CODEC)
+        with mock.patch("pickle.load") as load:
+            with self.assertRaises(ValueError):
+                load_data(self.file_path)
+            with self.assertRaises(ValueError):
+                list(iter_records(self.file_path))
+        load.assert_not_called()
+
+    def test_pickle_store_is_not_overwritten(self):
+        """
+        Test that a store written with the pickle codec is not wiped by a
+        write made under another codec.
+        """
+        set_codec(PICKLE_CODEC)
+        repo = Repository(self.file_path, "customer_id")
+        repo.put_many(self.records[:2])
+        set_codec(JSON_CODEC)
+        clear_cache()
+        repo = Repository(self.file_path, "customer_id")
+        with self.assertRaises(ValueError):
+            repo.put(self.records[2])
+        set_codec(PICKLE_CODEC)
+        self.assertEqual(load_data(self.file_path), self.records[:2])
+
+    def test_damaged_file_is_not_overwritten(self):
+        """
+        Test that a damaged file raises rather than loading as empty, and
+        that a store held in it refuses writes instead of wiping it.
+        """
+        damaged = [b"\x1f\x8bnot gzip", b'[{"customer_id": 1,',
+                   b'{"customer_id": 1}\n{"customer_id"\n']
+        for data in damaged:
+            with self.subTest(data=data):
+                with open(self.file_path, "wb") as f:
+                    f.write(data)
+                clear_cache()
+                with self.assertRaises(ValueError):
+                    load_data(self.file_path)
+                repo = Repository(self.file_path, "customer_id")
+                with self.assertRaises(ValueError):
+                    repo.put(self.records[0])
+                with open(self.file_path, "rb") as f:
+                    self.assertEqual(f.read(), data)
+        self.assertRaises(ValueError, set_codec, "xml")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+test_records.py
+
+Unit tests for the CompactRecord class.
+Tests include the round trip to the stored form, dictionary behavior,
+string interning and the memory held per record.
+"""
+
+import json
+import tracemalloc
+import unittest
+
+from app.records import CompactRecord
+
+
+class _Record(CompactRecord):
+    """
+    A compact record type used by the tests.
+    """
+
+    __slots__ = FIELDS = ("record_id", "name", "check_in")
+    INTERNED = ("check_in",)
+
+
+def _traced_size(make, count):
+    """
+    Return the memory allocated per object by make, in bytes.
+    """
+    tracemalloc.start()
+    objects = [make(number) for number in range(count)]
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del objects
+    return size / count
+
+
+class TestCompactRecord(unittest.TestCase):
+    """
+    Test cases for the CompactRecord class.
+    """
+
+    def test_round_trip_keeps_missing_and_unknown_fields(self):
+        """
+        Test that to_dict gives back the stored record unchanged.
+        """
+        stored = {"record_id": 1, "name": None, "vip": True}
+        record = _Record.from_dict(stored)
+        self.assertEqual(record.to_dict(), stored)
+        self.assertNotIn("check_in", record)
+        self.assertIsNone(record.get("check_in"))
+        with self.assertRaises(KeyError):
+            _ = record["check_in"]
+
+    def test_behaves_like_a_dictionary(self):
+        """
+        Test item access, update and comparison with dictionaries.
+        """
+        record = _Record.from_dict({"record_id": 1, "name": "Alice"})
+        record["name"] = "Alicia"
+        record.update(_Record.from_dict({"check_in": "2025-01-01"}))
+        record.update({"note": "late arrival"})
+        self.assertEqual(record["name"], "Alicia")
+        self.assertEqual(record, {"record_id": 1, "name": "Alicia",
+                                  "check_in": "2025-01-01",
+                                  "note": "late arrival"})
+        self.assertEqual(len(record), 4)
+
+    def test_interned_fields_share_one_string(self):
+        """
+        Test that equal values of interned fields are the same object.
+        """
+        first = _Record.from_dict(json.loads('{"check_in": "2025-01-01"}'))
+        second = _Record.from_dict(json.loads('{"check_in": "2025-01-01"}'))
+        self.assertIs(first["check_in"], second["check_in"])
+
+    def test_uses_less_memory_than_a_dictionary(self):
+        """
+        Test that a compact record holds well under the memory of the
+        dictionary it replaces.
+        """
+        def stored(number):
+            return {"record_id": number, "name": "Guest",
+                    "check_in": "2025-01-01"}
+
+        dictionary = _traced_size(lambda n: dict(stored(n)), 10000)
+        compact = _traced_size(lambda n: _Record(stored(n)), 10000)
+        self.assertLess(compact, dictionary * 0.6)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+test_repository.py
+
+Unit tests for the Repository class.
+Tests include indexed lookups, write-through and reloading on external
+changes.
+"""
+
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from app import storage
+from app.indexes import FieldIndex
+from app.repository import Repository
+
+
+class TestRepository(unittest.TestCase):
+    """
+    Test cases for the Repository class.
+    """
+
+    def setUp(self):
+        """
+        Create a temporary directory for the backing file.
+        """
+        self.tmp_dir = tempfile.mkdtemp()
+        self.file_path = os.path.join(self.tmp_dir, "hotels.json")
+
+    def tearDown(self):
+        """
+        Remove the temporary directory.
+        """
+        shutil.rmtree(self.tmp_dir)
+
+    def test_put_and_get(self):
+        """
+        Test that stored records can be looked up and are written to disk.
+        """
+        repo = Repository(self.file_path, "hotel_id")
+        repo.put({"hotel_id": 1, "name": "Sunrise Inn"})
+        self.assertEqual(repo.get(1)["name"], "Sunrise Inn")
+        with open(self.file_path, "r", encoding="utf-8") as f:
+            self.assertEqual(json.load(f)[0]["hotel_id"], 1)
+
+    def test_failed_write_is_undone(self):
+        """
+        Test that a write failing after the records changed in memory
+        leaves the records, the indexes and the published version as
+        they were.
+        """
+        repo = Repository(self.file_path, "hotel_id",
+                          indexes={"city": FieldIndex("city")})
+        repo.put({"hotel_id": 1, "city": "Lima"})
+
+        def fail(mutations):
+            raise OSError("disk full")
+
+        with mock.patch.object(repo, "_persist", fail):
+            with self.assertRaises(OSError):
+                repo.put_many([{"hotel_id": 1, "city": "Quito"},
+                               {"hotel_id": 2, "city": "Quito"}])
+            with self.assertRaises(OSError):
+                repo.update(1, {"city": "Cusco"})
+        self.assertEqual(repo.get(1), {"hotel_id": 1, "city": "Lima"})
+        self.assertIsNone(repo.get(2))
+        self.assertFalse(repo.contains(2))
+        self.assertEqual(repo.find("city", "Quito"), [])
+        self.assertEqual(repo.find("city", "Lima"), [repo.get(1)])
+        repo.put({"hotel_id": 2, "city": "Quito"})
+        self.assertEqual(len(repo.all()), 2)
+
+    def test_lookups_do_not_reparse(self):
+        """
+        Test that repeated lookups parse the file only once.
+        """
+        repo = Repository(self.file_path, "hotel_id")
+        repo.put({"hotel_id": 1, "name": "Sunrise Inn"})
+        with mock.patch.object(storage, "load_data") as load:
+            for _ in range(10):
+                repo.get(1)
+            load.assert_not_called()
+
+    def test_reloads_after_external_change(self):
+        """
+        Test that a change made by another writer is picked up.
+        """
+        repo = Repository(self.file_path, "hotel_id")
+        repo.put({"hotel_id": 1, "name": "Sunrise Inn"})
+        with open(self.file_path, "w", encoding="utf-8") as f:
+            json.dump([{"hotel_id": 2, "name": "Other Inn, Downtown"}], f)
+        self.assertIsNone(repo.get(1))
+        self.assertEqual(repo.get(2)["name"], "Other Inn, Downtown")
+        os.remove(self.file_path)
+        self.assertEqual(len(repo), 0)
+
+    def test_duplicate_ids_keep_first(self):
+        """
+        Test that the first of several duplicated records is kept.
+        """
+        with open(self.file_path, "w", encoding="utf-8") as f:
+            json.dump([{"hotel_id": 1, "name": "First"},
+                       {"hotel_id": 1, "name": "Second"}], f)
+        repo = Repository(self.file_path, "hotel_id")
+        self.assertEqual(repo.get(1)["name"], "First")
+        self.assertEqual(len(repo), 1)
+
+    def test_update_and_delete_missing(self):
+        """
+        Test that updating or deleting a missing record reports failure.
+        """
+        repo = Repository(self.file_path, "hotel_id")
+        self.assertFalse(repo.update(1, {"name": "Nowhere"}))
+        self.assertFalse(repo.delete(1))
+        self.assertFalse(os.path.exists(self.file_path))
+
+
+if __name__ == "__main__":
+    unittest.main()
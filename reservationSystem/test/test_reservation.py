@@ -8,12 +8,16 @@ Tests include creating and canceling reservations.
 
 import os
 import json
+import threading
 import unittest
+from unittest import mock
 
-from app.reservation import Reservation
+from app import events
+from app.reservation import Reservation, _reservations
 from app.hotel import Hotel
 from app.customer import Customer
 from app.persistence import RESERVATION_FILE
+from app.repository import reset_repositories
 
 # Helper function to clear the reservation persistence file.
 def clear_files():
@@ -33,7 +37,9 @@ class TestReservation(unittest.TestCase):
         Clear persistence files and create a hotel and customer for reservations.
         """
         clear_files()
-        # Ensure a hotel and customer exist for the reservation.
+        # Ensure a fresh hotel and customer exist for the reservation.
+        Hotel.delete_hotel(10)
+        Customer.delete_customer(10)
         hotel = Hotel(10, "Lakeside Resort", "Lakeview", 2)
         Hotel.create_hotel(hotel)
         customer = Customer(10, "Dana White", "dana@example.com", "555-1111")
@@ -75,6 +81,41 @@ class TestReservation(unittest.TestCase):
         res_ids = [r["reservation_id"] for r in reservations]
         self.assertNotIn(302, res_ids)
 
+    def test_racing_cancels(self):
+        """
+        Test that of two cancels racing for the same reservation, only the
+        one that deletes it succeeds and emits its events.
+        """
+        Reservation.create_reservation(Reservation(303, 10, 10))
+        cancel = Hotel.cancel_reservation
+        raced = []
+        results = []
+
+        def race(hotel_id, reservation_id, transaction=None):
+            if not raced:
+                raced.append(reservation_id)
+                # Another thread cancels after the record was read.
+                thread = threading.Thread(target=lambda: results.append(
+                    Reservation.cancel_reservation(303)))
+                thread.start()
+                thread.join()
+            return cancel(hotel_id, reservation_id, transaction)
+
+        received = []
+        feed = events.enable()
+        events.subscribe(received.append)
+        try:
+            with mock.patch.object(Hotel, "cancel_reservation", race), \
+                    mock.patch("builtins.print"):
+                results.append(Reservation.cancel_reservation(303))
+            feed.flush(5)
+        finally:
+            events.disable()
+        self.assertEqual(results, [True, False])
+        self.assertEqual([event.type for event in received],
+                         [events.ROOM_RELEASED, events.RESERVATION_CANCELED])
+        self.assertEqual(Hotel.display_hotel(10)["reserved_rooms"], [])
+
     def test_cancel_nonexistent_reservation(self):
         """
         Test canceling a reservation that does not exist.
@@ -89,5 +130,143 @@ class TestReservation(unittest.TestCase):
         sys.stdout = sys.__stdout__
         self.assertIn("Reservation not found", captured_output.getvalue())
 
+    def test_create_reservations_in_batch(self):
+        """
+        Test that a batch reports which reservations found a room.
+        """
+        results = Reservation.create_reservations(
+            Reservation(i, 10, 10) for i in range(401, 404)
+        )
+        self.assertEqual(results, [True, True, False])
+        with open(RESERVATION_FILE, "r", encoding="utf-8") as f:
+            reservations = json.load(f)
+        res_ids = [r["reservation_id"] for r in reservations]
+        self.assertEqual(res_ids, [401, 402])
+
+    def test_reservations_for_different_nights(self):
+        """
+        Test that stays on different nights share the same rooms.
+        """
+        for reservation_id in range(501, 505):
+            Reservation.create_reservation(Reservation(
+                reservation_id, 10, 10, "2026-05-01", "2026-05-03"))
+        self.assertFalse(Hotel.is_available(10, "2026-05-02", "2026-05-04"))
+        self.assertTrue(Hotel.is_available(10, "2026-05-03", "2026-05-04"))
+        Reservation.create_reservation(
+            Reservation(505, 10, 10, "2026-05-03", "2026-05-04"))
+        with open(RESERVATION_FILE, "r", encoding="utf-8") as f:
+            reservations = json.load(f)
+        self.assertEqual(
+            [r["reservation_id"] for r in reservations], [501, 502, 505])
+        self.assertEqual(reservations[2]["check_in"], "2026-05-03")
+        Reservation.cancel_reservation(501)
+        self.assertTrue(Hotel.is_available(10, "2026-05-02", "2026-05-04"))
+
+    def test_reservations_by_customer_and_hotel(self):
+        """
+        Test listing reservations by customer and by hotel, as they are
+        created and canceled, and after reloading from disk.
+        """
+        Reservation.create_reservation(Reservation(601, 10, 10))
+        Reservation.create_reservation(Reservation(602, 10, 10))
+        self.assertEqual(
+            [r["reservation_id"] for r in Reservation.for_customer(10)],
+            [601, 602])
+        self.assertEqual(
+            [r["reservation_id"] for r in Reservation.for_hotel(10)],
+            [601, 602])
+        self.assertEqual(Reservation.for_customer(99), [])
+        Reservation.cancel_reservation(601)
+        self.assertEqual(
+            [r["reservation_id"] for r in Reservation.for_hotel(10)], [602])
+        reset_repositories()
+        self.assertEqual(Reservation.for_customer(10), [
+            {"reservation_id": 602, "hotel_id": 10, "customer_id": 10}])
+
+    def test_reservation_requires_existing_customer(self):
+        """
+        Test that a reservation for an unknown customer is rejected.
+        """
+        results = Reservation.create_reservations(
+            [Reservation(701, 10, 99), Reservation(702, 10, 10)])
+        self.assertEqual(results, [None, True])
+        self.assertIsNone(Reservation.display_reservation(701))
+        self.assertEqual(Hotel.display_hotel(10)["reserved_rooms"], [702])
+
+    def test_delete_customer_cascades(self):
+        """
+        Test that deleting a customer cancels its reservations and
+        releases their rooms.
+        """
+        Reservation.create_reservation(Reservation(801, 10, 10))
+        self.assertTrue(Customer.delete_customer(10))
+        self.assertIsNone(Customer.display_customer(10))
+        self.assertIsNone(Reservation.display_reservation(801))
+        self.assertEqual(Hotel.display_hotel(10)["reserved_rooms"], [])
+
+    def test_delete_restricted_by_reservations(self):
+        """
+        Test that a restricted delete keeps customers and hotels that
+        have reservations.
+        """
+        Reservation.create_reservation(Reservation(901, 10, 10))
+        self.assertFalse(Customer.delete_customer(10, "restrict"))
+        self.assertFalse(Hotel.delete_hotel(10, "restrict"))
+        self.assertIsNotNone(Reservation.display_reservation(901))
+        Reservation.cancel_reservation(901)
+        self.assertTrue(Customer.delete_customer(10, "restrict"))
+        with self.assertRaises(ValueError):
+            Hotel.delete_hotel(10, "ignore")
+
+    def test_delete_hotel_cascades(self):
+        """
+        Test that deleting a hotel cancels its reservations.
+        """
+        Reservation.create_reservation(Reservation(1001, 10, 10))
+        self.assertTrue(Hotel.delete_hotel(10))
+        self.assertEqual(Reservation.for_hotel(10), [])
+        self.assertEqual(Reservation.for_customer(10), [])
+
+    def test_reservation_ids_are_unique(self):
+        """
+        Test that reservations without an ID are given one, and that a
+        taken ID is rejected without holding a room.
+        """
+        reservation = Reservation(None, 10, 10)
+        self.assertTrue(Reservation.create_reservation(reservation))
+        self.assertIsNotNone(reservation.reservation_id)
+        duplicate = Reservation(reservation.reservation_id, 10, 10)
+        self.assertEqual(Reservation.create_reservations([duplicate]),
+                         [None])
+        self.assertEqual(Hotel.display_hotel(10)["reserved_rooms"],
+                         [reservation.reservation_id])
+        self.assertFalse(Hotel.create_hotel(
+            Hotel(10, "Lakeside Resort", "Lakeview", 2)))
+
+    def test_retry_keeps_reserved_ids(self):
+        """
+        Test that a reservation whose new ID is taken by a concurrent
+        writer is retried with an ID outside the reserved ones.
+        """
+        reservation = Reservation(None, 10, 10)
+        reserve_rooms = Hotel.reserve_rooms
+        taken = []
+
+        def race(requests, transaction=None):
+            if not taken:
+                taken.append(reservation.reservation_id)
+                _reservations().put(
+                    Reservation(reservation.reservation_id, 10, 10)
+                    .to_dict())
+            return reserve_rooms(requests, transaction)
+
+        reserved = range(0, 10 ** 6, 2)
+        with mock.patch.object(Hotel, "reserve_rooms", race):
+            self.assertEqual(Reservation.try_create_reservations(
+                [reservation], reserved), [None])
+        self.assertNotEqual(reservation.reservation_id, taken[0])
+        self.assertNotIn(reservation.reservation_id, reserved)
+        self.assertEqual(len(Reservation.for_hotel(10)), 2)
+
 if __name__ == "__main__":
     unittest.main()
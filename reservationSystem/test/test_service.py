@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+test_service.py
+
+Unit tests for the AsyncReservationService class.
+Tests include many concurrent bookings against the same hotels and
+canceling reservations.
+"""
+
+import asyncio
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from app import customer as customer_module
+from app import hotel as hotel_module
+from app import reservation as reservation_module
+from app import service as service_module
+from app.customer import Customer
+from app.hotel import Hotel
+from app.repository import reset_repositories
+from app.reservation import Reservation
+from app.service import AsyncReservationService
+
+HOTELS = 4
+ROOMS = 10
+REQUESTS = 1000
+
+
+class TestAsyncReservationService(unittest.TestCase):
+    """
+    Test cases for the AsyncReservationService class.
+    """
+
+    def setUp(self):
+        """
+        Point the stores at a temporary directory and create the hotels
+        and the customer.
+        """
+        self.tmp_dir = tempfile.mkdtemp()
+        self.patches = [
+            mock.patch.object(customer_module, "CUSTOMER_FILE",
+                              os.path.join(self.tmp_dir, "customers.json")),
+            mock.patch.object(hotel_module, "HOTEL_FILE",
+                              os.path.join(self.tmp_dir, "hotels.json")),
+            mock.patch.object(reservation_module, "RESERVATION_FILE",
+                              os.path.join(self.tmp_dir,
+                                           "reservations.json")),
+            mock.patch("builtins.print"),
+        ]
+        for patch in self.patches:
+            patch.start()
+        reset_repositories()
+        Hotel.create_hotels(
+            Hotel(hotel_id, f"Hotel {hotel_id}", "Downtown", ROOMS)
+            for hotel_id in range(1, HOTELS + 1)
+        )
+        Customer.create_customer(
+            Customer(1, "Dana White", "dana@example.com", "555-1111"))
+
+    def tearDown(self):
+        """
+        Restore the stores and remove the directory.
+        """
+        for patch in self.patches:
+            patch.stop()
+        reset_repositories()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_concurrent_reservations_do_not_overbook(self):
+        """
+        Test that many concurrent requests fill every hotel exactly.
+        """
+        async def book():
+            return await asyncio.gather(*(
+                AsyncReservationService.create_reservation(
+                    Reservation(reservation_id,
+                                reservation_id % HOTELS + 1, 1))
+                for reservation_id in range(REQUESTS)
+            ))
+
+        results = asyncio.run(book())
+        self.assertEqual(sum(results), HOTELS * ROOMS)
+        for hotel_id in range(1, HOTELS + 1):
+            self.assertEqual(
+                len(Hotel.display_hotel(hotel_id)["reserved_rooms"]), ROOMS)
+        self.assertEqual(service_module._hotel_locks, {})
+
+    def test_reserve_and_cancel(self):
+        """
+        Test reserving a room and canceling reservations.
+        """
+        async def run():
+            reserved = await AsyncReservationService.reserve_room(
+                1, 500, "2025-01-01", "2025-01-03")
+            created = await AsyncReservationService.create_reservation(
+                Reservation(501, 2, 1))
+            canceled = await asyncio.gather(
+                AsyncReservationService.cancel_reservation(501),
+                AsyncReservationService.cancel_reservation(999))
+            return reserved, created, canceled
+
+        reserved, created, canceled = asyncio.run(run())
+        self.assertTrue(reserved)
+        self.assertTrue(created)
+        self.assertEqual(canceled, [True, False])
+        self.assertIsNone(Reservation.display_reservation(501))
+        self.assertEqual(Hotel.display_hotel(2)["reserved_rooms"], [])
+
+
+if __name__ == "__main__":
+    unittest.main()
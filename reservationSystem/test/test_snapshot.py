@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+test_snapshot.py
+
+Unit tests for the copy-on-write versions read by the repositories.
+Tests include immutable record maps, reads that do not wait for writers
+and transactions published atomically across stores.
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from app import customer as customer_module
+from app import hotel as hotel_module
+from app import reservation as reservation_module
+from app.customer import Customer
+from app.hotel import Hotel
+from app.repository import Repository, reset_repositories
+from app.reservation import Reservation
+from app.snapshot import RecordMap
+from app.transaction import Transaction
+
+
+class TestRecordMap(unittest.TestCase):
+    """
+    Test cases for the RecordMap class.
+    """
+
+    def test_evolve_leaves_version_unchanged(self):
+        """
+        Test that a new version does not change the previous one.
+        """
+        old = RecordMap.from_dict({i: {"id": i} for i in range(1000)})
+        new = old.evolve({1: None, 5: {"id": 50}, 2000: {"id": 2000}})
+        self.assertEqual(len(old), 1000)
+        self.assertEqual(len(new), 1000)
+        self.assertEqual(old.get(5), {"id": 5})
+        self.assertEqual(new.get(5), {"id": 50})
+        self.assertIn(1, old)
+        self.assertNotIn(1, new)
+        self.assertIn(2000, new)
+        self.assertEqual(sorted(new), sorted(set(range(1000)) - {1} | {2000}))
+        self.assertIsNone(new.get([1]))
+
+
+class TestRepositoryVersions(unittest.TestCase):
+    """
+    Test cases for the versions published by a Repository.
+    """
+
+    def setUp(self):
+        """
+        Create a temporary directory for the backing files.
+        """
+        self.tmp_dir = tempfile.mkdtemp()
+        self.hotels = Repository(
+            os.path.join(self.tmp_dir, "hotels.json"), "hotel_id")
+        self.guests = Repository(
+            os.path.join(self.tmp_dir, "customers.json"), "customer_id")
+
+    def tearDown(self):
+        """
+        Remove the temporary directory.
+        """
+        shutil.rmtree(self.tmp_dir)
+
+    def test_versions_are_copy_on_write(self):
+        """
+        Test that a version taken before a write is not changed by it.
+        """
+        self.hotels.put({"hotel_id": 1, "rooms": 1})
+        before = self.hotels.view()
+
+        def add_room(record):
+            record["rooms"] += 1
+            return True
+
+        self.hotels.mutate(1, add_room)
+        self.hotels.update(1, {"name": "Renamed"})
+        self.assertEqual(before.get(1), {"hotel_id": 1, "rooms": 1})
+        self.assertEqual(self.hotels.get(1),
+                         {"hotel_id": 1, "rooms": 2, "name": "Renamed"})
+
+    def test_reads_do_not_wait_for_writers(self):
+        """
+        Test that a reader gets the published record while a writer holds
+        the lock.
+        """
+        self.hotels.put({"hotel_id": 1, "name": "Old"})
+        locked = threading.Event()
+        release = threading.Event()
+
+        def write():
+            with self.hotels._writing([1]):
+                locked.set()
+                release.wait(5)
+
+        writer = threading.Thread(target=write)
+        writer.start()
+        try:
+            self.assertTrue(locked.wait(5))
+            self.assertEqual(self.hotels.get(1)["name"], "Old")
+            self.assertTrue(self.hotels.contains(1))
+        finally:
+            release.set()
+            writer.join()
+
+    def test_transactions_publish_together(self):
+        """
+        Test that the changes of a transaction are only visible once it
+        ends, in every store at once.
+        """
+        with Transaction() as transaction:
+            transaction.stage(self.hotels).put_many([{"hotel_id": 1}])
+            transaction.stage(self.guests).put_many([{"customer_id": 1}])
+            self.assertIsNone(self.hotels.get(1))
+            self.assertIsNone(self.guests.get(1))
+        self.assertIsNotNone(self.hotels.get(1))
+        self.assertIsNotNone(self.guests.get(1))
+
+
+class TestSnapshot(unittest.TestCase):
+    """
+    Test cases for snapshots of several stores.
+    """
+
+    def setUp(self):
+        """
+        Point the stores at a temporary directory and create a hotel and
+        a customer.
+        """
+        self.tmp_dir = tempfile.mkdtemp()
+        self.patches = [
+            mock.patch.object(customer_module, "CUSTOMER_FILE",
+                              os.path.join(self.tmp_dir, "customers.json")),
+            mock.patch.object(hotel_module, "HOTEL_FILE",
+                              os.path.join(self.tmp_dir, "hotels.json")),
+            mock.patch.object(reservation_module, "RESERVATION_FILE",
+                              os.path.join(self.tmp_dir,
+                                           "reservations.json")),
+            mock.patch("builtins.print"),
+        ]
+        for patch in self.patches:
+            patch.start()
+        reset_repositories()
+        Hotel.create_hotel(Hotel(1, "Harbor Inn", "Seaside", 5))
+        Customer.create_customer(
+            Customer(1, "Dana White", "dana@example.com", "555-1111"))
+
+    def tearDown(self):
+        """
+        Restore the stores and remove the directory.
+        """
+        for patch in self.patches:
+            patch.stop()
+        reset_repositories()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_snapshot_is_point_in_time(self):
+        """
+        Test that a snapshot does not see later writes.
+        """
+        Reservation.create_reservation(Reservation(1, 1, 1))
+        snapshot = Reservation.snapshot()
+        Reservation.cancel_reservation(1)
+        self.assertIsNotNone(snapshot.get("reservations", 1))
+        self.assertEqual(snapshot.get("hotels", 1)["reserved_rooms"], [1])
+        self.assertEqual(snapshot.count("customers"), 1)
+        self.assertIsNone(Reservation.snapshot().get("reservations", 1))
+
+    def test_snapshots_are_consistent_under_writes(self):
+        """
+        Test that every snapshot taken while reservations are created and
+        canceled shows each reservation together with its room.
+        """
+        done = threading.Event()
+        errors = []
+
+        def write():
+            for reservation_id in range(1, 101):
+                Reservation.create_reservation(
+                    Reservation(reservation_id, 1, 1))
+                Reservation.cancel_reservation(reservation_id)
+            done.set()
+
+        def read():
+            while not done.is_set():
+                snapshot = Reservation.snapshot()
+                rooms = snapshot.get("hotels", 1)["reserved_rooms"]
+                for reservation_id in rooms:
+                    if snapshot.get("reservations", reservation_id) is None:
+                        errors.append(reservation_id)
+
+        threads = [threading.Thread(target=write)] + [
+            threading.Thread(target=read) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+"""
+test_storage.py
+
+Unit tests for the storage backends and the SQLite migration.
+Tests include running the reservation system against SQLite and sharded
+JSON files, and copying the JSON files into SQLite.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from app import customer as customer_module
+from app import hotel as hotel_module
+from app import reservation as reservation_module
+from app import storage as storage_module
+from app.customer import Customer
+from app.hotel import Hotel
+from app.migrate import migrate
+from app.persistence import save_data, set_storage_mode, JSON_MODE
+from app.repository import Repository, reset_repositories
+from app.reservation import Reservation
+from app.storage import ShardedBackend, SqliteBackend, set_backend, shard_of
+
+
+class TestSqliteBackend(unittest.TestCase):
+    """
+    Test cases for the SqliteBackend class.
+    """
+
+    def setUp(self):
+        """
+        Use a SQLite database in a temporary directory.
+        """
+        self.tmp_dir = tempfile.mkdtemp()
+        self.backend = SqliteBackend(os.path.join(self.tmp_dir, "test.db"))
+        set_backend(self.backend)
+        reset_repositories()
+
+    def tearDown(self):
+        """
+        Restore the default backend and remove the directory.
+        """
+        set_backend(None)
+        reset_repositories()
+        self.backend.close()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_reservation_system_runs_on_sqlite(self):
+        """
+        Test that hotels, customers and reservations work unchanged.
+        """
+        Hotel.create_hotel(Hotel(1, "Sunrise Inn", "Beach City", 1))
+        Customer.create_customer(
+            Customer(1, "Alice Smith", "alice@example.com", "555-1234"))
+        Customer.modify_customer(1, {"phone": "555-4321"})
+        Reservation.create_reservation(Reservation(100, 1, 1))
+        self.assertEqual(Hotel.display_hotel(1)["reserved_rooms"], [100])
+        self.assertEqual(Customer.display_customer(1)["phone"], "555-4321")
+        self.assertEqual(
+            self.backend.find("json/reservations.json", "customer_id", 1),
+            [{"reservation_id": 100, "hotel_id": 1, "customer_id": 1}])
+        Reservation.cancel_reservation(100)
+        self.assertEqual(Hotel.display_hotel(1)["reserved_rooms"], [])
+        self.assertIsNone(
+            self.backend.get("json/reservations.json", 100))
+
+    def test_changes_from_another_connection_are_seen(self):
+        """
+        Test that a write made through another connection is picked up.
+        """
+        repo = Repository("hotels.json", "hotel_id")
+        repo.put({"hotel_id": 1, "name": "Sunrise Inn"})
+        other = SqliteBackend(self.backend.db_path)
+        other.write("hotels.json", "hotel_id",
+                    [("put", 1, {"hotel_id": 1, "name": "Sunset Inn"})],
+                    None)
+        other.close()
+        self.assertEqual(repo.get(1)["name"], "Sunset Inn")
+
+    def test_changes_read_only_changed_rows(self):
+        """
+        Test that writes through another connection are applied without
+        reloading the table, unless it was replaced or the log trimmed.
+        """
+        repo = Repository("hotels.json", "hotel_id")
+        repo.put_many({"hotel_id": i, "name": "Hotel"} for i in range(40))
+        self.assertEqual(len(repo), 40)
+        other = SqliteBackend(self.backend.db_path)
+        other.write("hotels.json", "hotel_id",
+                    [("put", 7, {"hotel_id": 7, "name": "Renamed"}),
+                     ("delete", 8, None)], None)
+        with mock.patch.object(self.backend, "load",
+                               side_effect=AssertionError):
+            self.assertEqual(repo.get(7)["name"], "Renamed")
+            self.assertIsNone(repo.get(8))
+            self.assertEqual(len(repo), 39)
+
+        other.save("hotels.json", "hotel_id", [{"hotel_id": 1}])
+        self.assertEqual(len(repo), 1)
+        signature = self.backend.signature("hotels.json")
+        with mock.patch.object(storage_module, "CHANGE_LOG_SIZE", 4):
+            for i in range(2, 12):
+                other.write("hotels.json", "hotel_id",
+                            [("put", i, {"hotel_id": i})], None)
+        self.assertIsNone(
+            self.backend.changes("hotels.json", signature, "hotel_id"))
+        other.close()
+        self.assertEqual(len(repo), 11)
+
+
+class TestShardedBackend(unittest.TestCase):
+    """
+    Test cases for the ShardedBackend class.
+    """
+
+    def setUp(self):
+        """
+        Point the stores at a temporary directory and shard them.
+        """
+        self.tmp_dir = tempfile.mkdtemp()
+        self.patches = [
+            mock.patch.object(hotel_module, "HOTEL_FILE",
+                              os.path.join(self.tmp_dir, "hotels.json")),
+            mock.patch.object(customer_module, "CUSTOMER_FILE",
+                              os.path.join(self.tmp_dir, "customers.json")),
+            mock.patch.object(reservation_module, "RESERVATION_FILE",
+                              os.path.join(self.tmp_dir,
+                                           "reservations.json")),
+        ]
+        for patch in self.patches:
+            patch.start()
+        self.backend = ShardedBackend(4)
+        set_backend(self.backend)
+        reset_repositories()
+
+    def tearDown(self):
+        """
+        Restore the stores and the default backend, and remove the
+        directory.
+        """
+        for patch in self.patches:
+            patch.stop()
+        set_backend(None)
+        reset_repositories()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_reservation_system_runs_on_shards(self):
+        """
+        Test that hotels, customers and reservations work unchanged.
+        """
+        Hotel.create_hotels(
+            Hotel(i, f"Hotel {i}", "Beach City", 1) for i in range(1, 9))
+        Customer.create_customer(
+            Customer(1, "Alice Smith", "alice@example.com", "555-1234"))
+        Reservation.create_reservation(Reservation(100, 3, 1))
+        reset_repositories()
+        self.assertEqual(Hotel.display_hotel(3)["reserved_rooms"], [100])
+        self.assertEqual(Reservation.display_reservation(100)["hotel_id"], 3)
+        Reservation.cancel_reservation(100)
+        Hotel.delete_hotel(8)
+        reset_repositories()
+        self.assertEqual(Hotel.display_hotel(3)["reserved_rooms"], [])
+        self.assertIsNone(Hotel.display_hotel(8))
+        hotel_file = hotel_module.HOTEL_FILE
+        self.assertEqual(
+            sorted(r["hotel_id"] for r in self.backend.iter_records(
+                hotel_file)),
+            list(range(1, 8)))
+        self.assertFalse(os.path.exists(hotel_file))
+
+    def test_write_rewrites_only_its_shard(self):
+        """
+        Test that a mutation leaves the other shards untouched.
+        """
+        file_path = os.path.join(self.tmp_dir, "hotels.json")
+        repo = Repository(file_path, "hotel_id")
+        repo.put_many({"hotel_id": i, "name": "Hotel"} for i in range(40))
+        before = self.backend.signature(file_path)
+        repo.update(7, {"name": "Renamed"})
+        after = self.backend.signature(file_path)
+        changed = [
+            shard for shard in range(4) if before[shard] != after[shard]
+        ]
+        self.assertEqual(changed, [shard_of(7, 4)])
+
+    def test_changes_reload_only_changed_shards(self):
+        """
+        Test that a write by another process is picked up without
+        reloading the whole store.
+        """
+        file_path = os.path.join(self.tmp_dir, "hotels.json")
+        repo = Repository(file_path, "hotel_id")
+        repo.put_many({"hotel_id": i, "name": "Hotel"} for i in range(40))
+        self.assertEqual(len(repo), 40)
+        other = ShardedBackend(4)
+        other.write(file_path, "hotel_id",
+                    [("put", 7, {"hotel_id": 7, "name": "Renamed"}),
+                     ("delete", 8, None)], None)
+        with mock.patch.object(self.backend, "load",
+                               side_effect=AssertionError):
+            self.assertEqual(repo.get(7)["name"], "Renamed")
+            self.assertIsNone(repo.get(8))
+            self.assertEqual(len(repo), 39)
+
+    def test_own_writes_are_not_read_back(self):
+        """
+        Test that a write keeps the cache valid, while writes made by
+        another process to other shards are still picked up.
+        """
+        file_path = os.path.join(self.tmp_dir, "hotels.json")
+        repo = Repository(file_path, "hotel_id")
+        repo.put_many({"hotel_id": i, "name": "Hotel"} for i in range(40))
+        other_id = next(i for i in range(40)
+                        if shard_of(i, 4) != shard_of(7, 4))
+        other = ShardedBackend(4)
+        other.write(file_path, "hotel_id",
+                    [("put", other_id, {"hotel_id": other_id,
+                                        "name": "Other"})], None)
+        repo.update(7, {"name": "Renamed"})
+        with mock.patch.object(self.backend, "load",
+                               side_effect=AssertionError):
+            self.assertEqual(repo.get(other_id)["name"], "Other")
+            with mock.patch.object(self.backend, "changes",
+                                   side_effect=AssertionError):
+                repo.update(7, {"name": "Renamed again"})
+                self.assertEqual(repo.get(7)["name"], "Renamed again")
+
+    def test_split_unsharded_file(self):
+        """
+        Test that an existing JSON file is distributed over the shards.
+        """
+        file_path = os.path.join(self.tmp_dir, "hotels.json")
+        save_data(file_path, [{"hotel_id": i} for i in range(10)]
+                  + [{"hotel_id": 0, "name": "Duplicate"}])
+        self.assertEqual(self.backend.split(file_path, "hotel_id"), 10)
+        repo = Repository(file_path, "hotel_id")
+        self.assertEqual(len(repo), 10)
+        self.assertNotIn("name", repo.get(0))
+
+
+class TestMigrate(unittest.TestCase):
+    """
+    Test cases for the JSON to SQLite migration.
+    """
+
+    def setUp(self):
+        """
+        Create a temporary directory for the files and the database.
+        """
+        self.tmp_dir = tempfile.mkdtemp()
+        self.file_path = os.path.join(self.tmp_dir, "hotels.json")
+        self.db_path = os.path.join(self.tmp_dir, "test.db")
+
+    def tearDown(self):
+        """
+        Restore the default storage mode and remove the directory.
+        """
+        set_storage_mode(JSON_MODE)
+        shutil.rmtree(self.tmp_dir)
+
+    def test_migrate_file_and_journal(self):
+        """
+        Test that the snapshot and its journal are copied in order.
+        """
+        save_data(self.file_path, [
+            {"hotel_id": i, "name": f"Hotel {i}"} for i in range(5)
+        ] + [{"hotel_id": 0, "name": "Duplicate"}])
+        set_storage_mode("journal")
+        repo = Repository(self.file_path, "hotel_id")
+        repo.delete(1)
+        repo.update(2, {"name": "Renamed"})
+        counts = migrate(self.db_path, {self.file_path: "hotel_id"},
+                         batch_size=2)
+        self.assertEqual(counts[self.file_path], 8)
+        backend = SqliteBackend(self.db_path)
+        records = backend.load(self.file_path)
+        backend.close()
+        self.assertEqual([r["hotel_id"] for r in records], [0, 2, 3, 4])
+        self.assertEqual(records[0]["name"], "Hotel 0")
+        self.assertEqual(records[1]["name"], "Renamed")
+
+
+if __name__ == "__main__":
+    unittest.main()
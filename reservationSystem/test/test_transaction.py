@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+"""
+test_transaction.py
+
+Unit tests for the transaction module.
+Tests include committing and rolling back changes to several stores,
+recovering a transaction interrupted by a crash, and group commit.
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from app import transaction as transaction_module
+from app.persistence import load_data, save_data
+from app.repository import Repository
+from app.transaction import GroupCommit, Transaction, recover
+
+
+def reserve(hotel):
+    """
+    Take one room of a hotel record if one is left.
+    """
+    if hotel["free_rooms"] < 1:
+        return False
+    hotel["free_rooms"] -= 1
+    return True
+
+
+class TestTransaction(unittest.TestCase):
+    """
+    Test cases for the Transaction class.
+    """
+
+    def setUp(self):
+        """
+        Create two stores in a temporary directory.
+        """
+        self.tmp_dir = tempfile.mkdtemp()
+        self.hotels = Repository(
+            os.path.join(self.tmp_dir, "hotels.json"), "hotel_id")
+        self.reservations = Repository(
+            os.path.join(self.tmp_dir, "reservations.json"),
+            "reservation_id")
+        self.hotels.put({"hotel_id": 1, "free_rooms": 1})
+
+    def tearDown(self):
+        """
+        Drop the commit log of the directory and remove it.
+        """
+        transaction_module._logs.pop(self.tmp_dir, None)
+        shutil.rmtree(self.tmp_dir)
+
+    def book(self, reservation_id):
+        """
+        Reserve a room and store the reservation in one transaction.
+        """
+        with Transaction() as transaction:
+            if not transaction.stage(self.hotels).mutate(1, reserve):
+                return False
+            transaction.stage(self.reservations).put_many(
+                [{"reservation_id": reservation_id, "hotel_id": 1}])
+        return True
+
+    def test_commit_writes_every_store(self):
+        """
+        Test that a committed transaction reaches both stores and leaves
+        an empty commit log.
+        """
+        self.assertTrue(self.book(100))
+        self.assertFalse(self.book(101))
+        self.assertEqual(load_data(self.hotels.file_path),
+                         [{"hotel_id": 1, "free_rooms": 0}])
+        self.assertEqual(load_data(self.reservations.file_path),
+                         [{"reservation_id": 100, "hotel_id": 1}])
+        log = transaction_module._logs[self.tmp_dir]
+        self.assertEqual(os.path.getsize(log.path), 0)
+
+    def test_error_rolls_back(self):
+        """
+        Test that an error before commit restores the staged records and
+        writes nothing.
+        """
+        with self.assertRaises(RuntimeError):
+            with Transaction() as transaction:
+                transaction.stage(self.hotels).mutate(1, reserve)
+                raise RuntimeError("payment declined")
+        self.assertEqual(self.hotels.get(1)["free_rooms"], 1)
+        self.assertEqual(load_data(self.hotels.file_path),
+                         [{"hotel_id": 1, "free_rooms": 1}])
+
+    def test_repository_is_changed_once(self):
+        """
+        Test that changing a repository twice in a transaction fails.
+        """
+        with self.assertRaises(ValueError):
+            with Transaction() as transaction:
+                stage = transaction.stage(self.hotels)
+                stage.mutate(1, reserve)
+                stage.mutate(1, reserve)
+        self.assertEqual(self.hotels.get(1)["free_rooms"], 1)
+
+    def test_crash_after_commit_is_recovered(self):
+        """
+        Test that a transaction interrupted after it was logged is
+        completed by recover().
+        """
+        persist = Repository._persist
+
+        def crash(repository, mutations):
+            if repository is self.reservations:
+                raise SystemExit("crash")
+            persist(repository, mutations)
+
+        with mock.patch.object(Repository, "_persist", crash):
+            with self.assertRaises(SystemExit):
+                self.book(100)
+        self.assertEqual(load_data(self.reservations.file_path), [])
+        # The process that owned the log is gone.
+        log = transaction_module._logs.pop(self.tmp_dir)
+        os.close(log._fd)
+        self.assertEqual(recover(self.tmp_dir), 1)
+        self.assertEqual(load_data(self.reservations.file_path),
+                         [{"reservation_id": 100, "hotel_id": 1}])
+        self.assertFalse(os.path.exists(log.path))
+
+    def test_next_transaction_recovers_first(self):
+        """
+        Test that a transaction replays the log of a dead process before
+        it reads the records.
+        """
+        persist = Repository._persist
+
+        def crash(repository, mutations):
+            if repository is self.reservations:
+                raise SystemExit("crash")
+            persist(repository, mutations)
+
+        with mock.patch.object(Repository, "_persist", crash):
+            with self.assertRaises(SystemExit):
+                self.book(100)
+        log = transaction_module._logs.pop(self.tmp_dir)
+        os.close(log._fd)
+        self.assertFalse(self.book(101))
+        self.assertEqual(load_data(self.reservations.file_path),
+                         [{"reservation_id": 100, "hotel_id": 1}])
+
+    def test_writer_recovers_first(self):
+        """
+        Test that a write replays the log of a dead process before it
+        changes the records of the logged transaction.
+        """
+        persist = Repository._persist
+
+        def crash(repository, mutations):
+            if repository is self.reservations:
+                raise SystemExit("crash")
+            persist(repository, mutations)
+
+        with mock.patch.object(Repository, "_persist", crash):
+            with self.assertRaises(SystemExit):
+                self.book(100)
+        log = transaction_module._logs.pop(self.tmp_dir)
+        os.close(log._fd)
+        # Others cancel the reservation and book the room again.
+        self.reservations.delete(100)
+        self.hotels.put({"hotel_id": 1, "free_rooms": 1})
+        self.assertTrue(self.book(101))
+
+        self.assertEqual(recover(self.tmp_dir), 0)
+        self.assertEqual(load_data(self.hotels.file_path),
+                         [{"hotel_id": 1, "free_rooms": 0}])
+        self.assertEqual(load_data(self.reservations.file_path),
+                         [{"reservation_id": 101, "hotel_id": 1}])
+
+    def test_superseded_transaction_is_skipped(self):
+        """
+        Test that recover() does not replay a transaction whose records
+        were changed since by other means.
+        """
+        persist = Repository._persist
+
+        def crash(repository, mutations):
+            if repository is self.reservations:
+                raise SystemExit("crash")
+            persist(repository, mutations)
+
+        with mock.patch.object(Repository, "_persist", crash):
+            with self.assertRaises(SystemExit):
+                self.book(100)
+        log = transaction_module._logs.pop(self.tmp_dir)
+        os.close(log._fd)
+        save_data(self.hotels.file_path, [{"hotel_id": 1, "free_rooms": 5}])
+
+        self.assertEqual(recover(self.tmp_dir), 0)
+        self.assertEqual(load_data(self.hotels.file_path),
+                         [{"hotel_id": 1, "free_rooms": 5}])
+        self.assertEqual(load_data(self.reservations.file_path), [])
+        self.assertFalse(os.path.exists(log.path))
+
+    def test_failed_commit_is_recovered(self):
+        """
+        Test that a transaction whose stores could not all be written is
+        completed once its locks are released.
+        """
+        persist = Repository._persist
+        failures = []
+
+        def fail(repository, mutations):
+            if repository is self.reservations and not failures:
+                failures.append(repository)
+                raise OSError("disk full")
+            persist(repository, mutations)
+
+        with mock.patch.object(Repository, "_persist", fail):
+            with self.assertRaises(OSError):
+                self.book(100)
+            self.assertEqual(self.reservations.get(100),
+                             {"reservation_id": 100, "hotel_id": 1})
+            self.assertEqual(self.hotels.get(1)["free_rooms"], 0)
+        log = transaction_module._logs[self.tmp_dir]
+        self.assertEqual(os.listdir(os.path.dirname(log.path)),
+                         [os.path.basename(log.path)])
+        self.assertEqual(os.path.getsize(log.path), 0)
+
+    def test_log_tail_is_cut_off(self):
+        """
+        Test that a shorter transaction does not keep the end of a longer
+        one in the log.
+        """
+        def crash():
+            raise SystemExit("crash")
+
+        log = transaction_module._commit_log(self.tmp_dir)
+        with self.assertRaises(SystemExit):
+            log.commit(b'{"stores": []}' + b" " * 100 + b"\n", crash)
+        with self.assertRaises(SystemExit):
+            log.commit(b'{"stores": []}\n', crash)
+        with open(log.path, "rb") as f:
+            self.assertEqual(f.read(), b'{"stores": []}\n')
+
+    def test_log_of_running_process_is_not_replayed(self):
+        """
+        Test that recover() leaves alone the log of a live process.
+        """
+        self.book(100)
+        self.assertEqual(recover(self.tmp_dir), 0)
+
+
+class TestGroupCommit(unittest.TestCase):
+    """
+    Test cases for the GroupCommit class.
+    """
+
+    def test_concurrent_requests_are_batched(self):
+        """
+        Test that requests arriving during a commit share the next batch
+        and each get their own result.
+        """
+        batches = []
+
+        def handler(values):
+            batches.append(len(values))
+            time.sleep(0.01)
+            return [value * 2 for value in values]
+
+        group = GroupCommit(handler)
+        results = {}
+
+        def submit(value):
+            results[value] = group.submit(value)
+
+        threads = [threading.Thread(target=submit, args=(value,))
+                   for value in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, {value: value * 2 for value in range(20)})
+        self.assertEqual(sum(batches), 20)
+        self.assertLess(len(batches), 20)
+
+    def test_errors_reach_every_request_of_the_batch(self):
+        """
+        Test that a failing batch raises in the submitting thread.
+        """
+        def handler(values):
+            raise ValueError("disk full")
+
+        with self.assertRaises(ValueError):
+            GroupCommit(handler).submit(1)
+
+    def test_interrupted_batch_releases_its_requests(self):
+        """
+        Test that the other requests of a batch fail, rather than wait
+        forever, when the leader is interrupted.
+        """
+        def handler(values):
+            raise KeyboardInterrupt
+
+        group = GroupCommit(handler, window=0.05)
+        errors = []
+
+        def submit(value):
+            try:
+                group.submit(value)
+            except (KeyboardInterrupt, RuntimeError) as error:
+                errors.append(type(error).__name__)
+
+        threads = [threading.Thread(target=submit, args=(value,))
+                   for value in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(sorted(errors), ["KeyboardInterrupt", "RuntimeError"])
+
+
+if __name__ == "__main__":
+    unittest.main()